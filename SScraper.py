@@ -1,20 +1,37 @@
 import time
 import datetime
 import json
-import requests
 import threading
 from random import randint
-from dhooks import Webhook, Embed
+from dhooks import Embed
 import sqlite3
 import logging
 import os
-from logging.handlers import TimedRotatingFileHandler
+from logging.handlers import TimedRotatingFileHandler, QueueHandler, QueueListener
 from dotenv import load_dotenv
-import math
 import random
+import hashlib
+import codecs
+import re
+import asyncio
+import aiohttp
+import multiprocessing
+import queue
+from urllib.parse import urlparse
+from contextlib import nullcontext
 
 load_dotenv()
 
+from db import connect, get_connection, change_seq, project_product, product_body_text, pack_json, unpack_json  # after load_dotenv so DB_* tuning from .env applies
+from scheduler import StoreScheduler, HostBackoff, change_score, MAX_INLINE_WAIT, PAGE_JITTER, SCHEDULE_UPSERT_SQL, BACKOFF_UPSERT_SQL
+from proxy_pool import ProxyPool, retry_after_seconds
+from notifier import WebhookDispatcher
+from history import create_history_tables, store_id, compact_events, EVENT_INSERT_SQL, HISTORY_COMPACT_INTERVAL
+from canonical import CanonicalIndex, AlertAggregator, canonical_key, CANONICAL_DEDUP, AGGREGATE_ALERTS, AGGREGATE_EVENTS
+from maintenance import run_maintenance, MAINTENANCE_INTERVAL
+from metrics import Counter, Gauge, Histogram, CallbackMetric, start_metrics_server, METRICS_PORT
+from sharding import HashRing, SCRAPER_PROCESSES, SHARD_QUEUE_SIZE, SHARD_RESTART_DELAY
+
 URL_PATH = 'products.json?limit=200&page=1'
 DB_PATH = 'data/products.db'
 
@@ -49,8 +66,14 @@ MIN_SLEEP = 180
 MAX_SLEEP = 300
 JITTER = 30
 
+# Crawl engine: 'threads' runs one thread per store, 'asyncio' runs every store as a task in one event loop
+SCRAPER_ENGINE = os.getenv('SCRAPER_ENGINE', 'threads').strip().lower()
+CRAWL_CONCURRENCY = int(os.getenv('CRAWL_CONCURRENCY', '50'))  # Max in-flight requests across all stores (asyncio engine)
+PER_HOST_CONCURRENCY = int(os.getenv('PER_HOST_CONCURRENCY', '1'))  # Max in-flight requests per host (asyncio engine)
+SCRAPER_WORKERS = int(os.getenv('SCRAPER_WORKERS', '0'))  # Worker threads polling due stores (threads engine); 0 = one per store, max 16
+
 # Setup logging
-LOG_DIR = 'logs'
+LOG_DIR = os.getenv('LOG_DIR', 'logs')  # Directory of the rotating scraper.log
 os.makedirs(LOG_DIR, exist_ok=True)
 log_formatter = logging.Formatter('%(asctime)s [%(threadName)s][Thread-%(thread)d][%(levelname)s] %(message)s', datefmt='%Y-%m-%d %H:%M:%S')
 log_file = os.path.join(LOG_DIR, 'scraper.log')
@@ -65,6 +88,8 @@ logger.addHandler(file_handler)
 logger.addHandler(console_handler)
 
 db_lock = threading.Lock()
+# Set in shard worker processes (see sharding.py): product writes and notifications go to the coordinator instead
+COORDINATOR_QUEUE = None
 
 def getProxies():
     logger.debug('Entering getProxies')
@@ -72,104 +97,350 @@ def getProxies():
     proxy = PROXIES.copy()
     logger.debug(f'Loaded {len(proxy)} proxies')
     return proxy
-    
-def fetch_all_products_with_paging(url, product_limit=PRODUCT_LIMIT, max_errors=3):
+
+# Shared by every store: health scoring, circuit breaking and per proxy/host rate limits (see proxy_pool.py)
+PROXY_POOL = ProxyPool(PROXIES)
+# Per-host pacing and 429/error backoff (see scheduler.py); init_db points it at DB_PATH and restores saved state
+HOST_BACKOFF = HostBackoff()
+# Discord notifications are queued and sent in batches by a background thread (see notifier.py); init_db sets its DB_PATH for dead letters
+NOTIFIER = WebhookDispatcher()
+# Classification and image per canonical product, shared by every store (see canonical.py)
+CANONICAL = CanonicalIndex()
+
+# Metrics served on METRICS_PORT (see metrics.py). Hosts and proxies are the only labels, so series stay few.
+FETCH_SECONDS = Histogram('scraper_fetch_request_seconds', 'Time per products.json request (to response headers when streaming)', ('host',))
+FETCH_RESPONSES = Counter('scraper_fetch_responses_total', 'products.json responses by status; "error" when the request failed', ('host', 'status'))
+FETCH_PASS_SECONDS = Histogram('scraper_fetch_pass_seconds', 'Time per paged fetch of a store', ('host',),
+                               buckets=(0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+FETCH_PRODUCTS = Counter('scraper_fetched_products_total', 'Products returned by paged fetches', ('host',))
+DB_WRITE_SECONDS = Histogram('scraper_db_write_seconds', 'Time per product write transaction, including the wait for db_lock')
+DB_WRITE_ROWS = Counter('scraper_db_write_rows_total', 'Rows written by product write transactions', ('kind',))
+ALCOHOL_TYPE_LOOKUPS = Counter('scraper_alcohol_type_lookups_total', 'get_alcohol_type calls by where the answer came from', ('source',))
+CLASSIFY_SECONDS = Histogram('scraper_alcohol_type_classify_seconds', 'Time per keyword classification (memo and canonical hits excluded)',
+                             buckets=(1e-5, 2.5e-5, 5e-5, 1e-4, 2.5e-4, 5e-4, 0.001, 0.0025, 0.005, 0.01))
+DB_BYTES = Gauge('scraper_db_bytes', 'Size of each products.db table and index at the last maintenance run', ('name', 'kind'))
+WEBHOOKS_QUEUED = Counter('scraper_webhooks_queued_total', 'Webhook messages handed to the dispatcher', ('type',))
+ALCOHOL_TYPE_SOURCES = {source: ALCOHOL_TYPE_LOOKUPS.labels(source) for source in ('memo', 'canonical', 'classified')}
+
+def proxy_label(proxy):
+    """Proxy address without credentials, for metric labels."""
+    return proxy.rsplit('@', 1)[-1] if proxy else 'direct'
+
+def proxy_counts(field):
+    return lambda: {(proxy_label(p),): getattr(stats, field) for p, stats in list(PROXY_POOL.stats.items())}
+
+CallbackMetric('scraper_proxy_requests_total', 'Requests sent through each proxy', proxy_counts('requests'), ('proxy',), type='counter')
+CallbackMetric('scraper_proxy_failures_total', 'Failed requests (errors and non-2xx responses other than 429) per proxy', proxy_counts('failures'), ('proxy',), type='counter')
+CallbackMetric('scraper_proxy_throttled_total', '429 responses per proxy', proxy_counts('throttled'), ('proxy',), type='counter')
+CallbackMetric('scraper_webhook_queue_depth', 'Notifications waiting for the webhook dispatcher', lambda: NOTIFIER.queue.qsize())
+CallbackMetric('scraper_alcohol_type_memo_size', 'Memoized (product id, updated_at) classifications', lambda: len(ALCOHOL_TYPE_MEMO))
+CallbackMetric('scraper_canonical_index_size', 'Canonical products kept in memory', lambda: len(CANONICAL.entries))
+
+
+def build_request_headers(url):
+    """Randomized browser-like headers for a products.json request."""
+    return {
+        'User-Agent': random.choice(USER_AGENTS),
+        'Accept': 'application/json, text/javascript, */*; q=0.01',
+        'Accept-Language': random.choice(ACCEPT_LANGUAGES),
+        'Referer': random.choice(REFERERS) or url,
+        'Connection': 'keep-alive',
+    }
+
+# --- Incremental fetch: conditional requests and early page cutoff ---
+INCREMENTAL_FETCH = os.getenv('INCREMENTAL_FETCH', '1') == '1'  # Send If-None-Match/If-Modified-Since and reuse pages on 304
+EARLY_PAGE_CUTOFF = os.getenv('EARLY_PAGE_CUTOFF', '1') == '1'  # Stop paging recency-ordered stores once a page has nothing new
+PAGE_CACHE = {}  # store url -> {page: {'etag': str, 'last_modified': str, 'products': list}}
+STORE_LATEST_UPDATED_AT = {}  # store url -> newest updated_at (epoch seconds) seen so far
+STORE_RECENCY_ORDERED = {}  # store url -> True if the last full pass was ordered by updated_at descending
+
+def parse_shopify_time(value):
+    """Parse a Shopify ISO 8601 timestamp into epoch seconds, or None."""
+    try:
+        return datetime.datetime.fromisoformat(value).timestamp()
+    except (TypeError, ValueError):
+        return None
+
+def newest_updated_at(products):
+    stamps = [t for t in (parse_shopify_time(p.get('updated_at')) for p in products) if t is not None]
+    return max(stamps) if stamps else None
+
+def is_recency_ordered(products):
+    stamps = [parse_shopify_time(p.get('updated_at')) for p in products]
+    if len(stamps) < 2 or None in stamps:
+        return False
+    return all(a >= b for a, b in zip(stamps, stamps[1:]))
+
+def conditional_headers(url, page):
+    """Validator headers for a page we already hold a copy of."""
+    cached = PAGE_CACHE.get(url, {}).get(page) if INCREMENTAL_FETCH else None
+    headers = {}
+    if cached:
+        if cached.get('etag'):
+            headers['If-None-Match'] = cached['etag']
+        if cached.get('last_modified'):
+            headers['If-Modified-Since'] = cached['last_modified']
+    return headers
+
+def cached_page(url, page):
+    return PAGE_CACHE.get(url, {}).get(page) if INCREMENTAL_FETCH else None
+
+def remember_page(url, page, response_headers, products):
+    if INCREMENTAL_FETCH:
+        PAGE_CACHE.setdefault(url, {})[page] = {
+            'etag': response_headers.get('ETag'),
+            'last_modified': response_headers.get('Last-Modified'),
+            'products': products,
+        }
+
+def should_stop_paging(url, products):
+    """True when a recency-ordered store's page holds nothing newer than the newest product of the previous pass."""
+    if not (INCREMENTAL_FETCH and EARLY_PAGE_CUTOFF) or not STORE_RECENCY_ORDERED.get(url):
+        return False
+    known = STORE_LATEST_UPDATED_AT.get(url)
+    newest = newest_updated_at(products)
+    return known is not None and newest is not None and newest <= known
+
+def cached_pages_after(url, page):
+    """Products of the cached pages following page, used to fill in a pass stopped early."""
+    pages = PAGE_CACHE.get(url, {})
+    products = []
+    page += 1
+    while page in pages:
+        products.extend(pages[page]['products'])
+        page += 1
+    return products
+
+def finish_incremental_pass(url, products, full_pass, last_page=None):
     """
-    Fetch all products from a Shopify store using paging, with advanced anti-bot and error handling logic.
-    Adds a random jitter between successful requests and uses a requests.Session for cookie and connection reuse.
-    If too many errors occur, aborts and returns what was fetched so far.
+    Record the newest updated_at seen for url. A pass that wasn't cut off also re-checks whether the store pages by recency;
+    when the catalog's real last page was reached, cached pages beyond it are dropped.
+    """
+    if not INCREMENTAL_FETCH:
+        return
+    newest = newest_updated_at(products)
+    if newest is not None:
+        STORE_LATEST_UPDATED_AT[url] = max(newest, STORE_LATEST_UPDATED_AT.get(url, newest))
+    if full_pass:
+        STORE_RECENCY_ORDERED[url] = is_recency_ordered(products)
+    if last_page is not None:
+        pages = PAGE_CACHE.get(url, {})
+        for stale in [p for p in pages if p > last_page]:
+            del pages[stale]
+
+# --- Streaming products.json parsing ---
+STREAM_PRODUCTS = os.getenv('STREAM_PRODUCTS', '0') == '1'  # Parse pages incrementally and process products one at a time
+STREAM_CHUNK_SIZE = int(os.getenv('STREAM_CHUNK_SIZE', '65536'))  # Bytes read from the response per chunk when streaming
+_STREAM_SKIP = re.compile(r'[\s,]*')
+
+class ProductStreamParser:
     """
-    logger.debug(f'Fetching all products with paging for url: {url}')
-    proxy_list = getProxies()
+    Incremental parser for a products.json body: feed() text chunks and get back each product dict as soon as
+    its closing brace has arrived. Only the unparsed tail (at most one partial product) is buffered.
+    """
+
+    def __init__(self):
+        self.buf = ''
+        self.state = 'prefix'  # 'prefix' until the products array opens, then 'array', then 'done'
+        self.decoder = json.JSONDecoder()
+
+    def feed(self, text):
+        buf = self.buf + text
+        pos = 0
+        products = []
+        while self.state != 'done':
+            if self.state == 'prefix':
+                key = buf.find('"products"', pos)
+                if key < 0:
+                    pos = max(pos, len(buf) - len('"products"'))
+                    break
+                start = buf.find('[', key)
+                if start < 0:
+                    pos = key
+                    break
+                pos = start + 1
+                self.state = 'array'
+                continue
+            pos = _STREAM_SKIP.match(buf, pos).end()
+            if pos >= len(buf):
+                break
+            if buf[pos] == ']':
+                self.state = 'done'
+                pos = len(buf)
+                break
+            try:
+                product, pos = self.decoder.raw_decode(buf, pos)
+            except json.JSONDecodeError:
+                break  # product not complete yet, wait for the next chunk
+            products.append(product)
+        self.buf = buf[pos:]
+        return products
+
+    def close(self):
+        if self.state != 'done':
+            raise ValueError(f'Truncated products.json body ({len(self.buf)} unparsed characters)')
+
+def iter_response_products(response, chunk_size=STREAM_CHUNK_SIZE):
+    """Yield products from a streamed requests response one at a time."""
+    parser = ProductStreamParser()
+    decoder = codecs.getincrementaldecoder(response.encoding or 'utf-8')(errors='replace')
+    for chunk in response.iter_content(chunk_size):
+        yield from parser.feed(decoder.decode(chunk))
+    yield from parser.feed(decoder.decode(b'', final=True))
+    parser.close()
+
+def iter_products_with_paging(url, product_limit=PRODUCT_LIMIT, max_errors=3, stream=False):
+    """
+    Generator behind fetch_all_products_with_paging, yielding products page by page.
+    With stream=True each page is parsed incrementally from the response body and products are yielded as they
+    arrive, so memory stays bounded by a single product. Streaming skips the incremental page cache since it never
+    holds a whole page; a page retried after a mid-stream error skips the products already yielded.
+    Requests are paced by HOST_BACKOFF. A 429 or error retries at once on another proxy when one can serve the host;
+    otherwise the host's backoff is extended and the pass ends early instead of sleeping, leaving the caller to
+    reschedule the store for HOST_BACKOFF.ready_at(host).
+    """
+    logger.debug(f'Fetching all products with paging for url: {url} (stream={stream})')
+    host = urlparse(url).netloc
     all_products = []
+    fetched = 0
     page = 1
     per_page = 200
-    site_429_count = 0
-    max_429_skip = 5  # After this many 429s, skip site for 30 min
-    session = requests.Session()  # Use a session for cookies and connection reuse
     error_count = 0
-    while len(all_products) < product_limit:
+    full_pass = True
+    last_page = None
+
+    def give_up(lease, reason, back_off):
+        """
+        After a failed request: False to retry on another proxy, or True to end the pass once max_errors is reached
+        or no other proxy can serve the host, in which case back_off() records the host's backoff.
+        """
+        if error_count < max_errors and lease is not None and PROXY_POOL.available(host, exclude=lease.proxy):
+            logger.debug('Retrying with another proxy')
+            return False
+        if error_count >= max_errors:
+            logger.error(f'Maximum error count ({max_errors}) reached in fetch_all_products_with_paging. Aborting.')
+        logger.info(f'{reason}: {host} backs off for {back_off():.0f} seconds, ending this pass of {url}')
+        return True
+
+    while fetched < product_limit:
         url_1 = f"{url}products.json?limit={per_page}&page={page}"
         condition = True
         products = []
-        backoff = random.randint(MIN_SLEEP, MAX_SLEEP)  # Start with random 3-5 min
-        headers = {
-            'User-Agent': random.choice(USER_AGENTS),
-            'Accept': 'application/json, text/javascript, */*; q=0.01',
-            'Accept-Language': random.choice(ACCEPT_LANGUAGES),
-            'Referer': random.choice(REFERERS) or url,
-            'Connection': 'keep-alive',
-        }
+        page_count = 0  # Products of this page already yielded (stream mode)
+        headers = build_request_headers(url)
+        cached = None
+        if not stream:
+            headers.update(conditional_headers(url, page))
+            cached = cached_page(url, page)
         while condition:
-            use_proxy = len(proxy_list) > 0
+            lease = None
+            if not HOST_BACKOFF.acquire(host):
+                logger.info(f'{host} is not ready for another {HOST_BACKOFF.wait(host):.0f} seconds, ending this pass of {url}')
+                return
             try:
-                if use_proxy:
-                    x = randint(0, len(proxy_list) - 1)
-                    proxy = proxy_list[x]
-                    proxy_dict = {'http': f'http://{proxy}', 'https': f'https://{proxy}'}
-                    logger.debug(f'Trying proxy: {proxy} (page {page})')
-                    webpage = session.get(url_1, headers=headers, proxies=proxy_dict, timeout=30)
+                # The pool's persistent per-proxy session reuses connections across pages and cycles
+                lease = PROXY_POOL.acquire(host, max_wait=MAX_INLINE_WAIT)
+                if lease is None:
+                    logger.info(f'No proxy can serve {host} within {MAX_INLINE_WAIT} seconds, ending this pass of {url}')
+                    return
+                if lease.proxy:
+                    logger.debug(f'Trying proxy: {lease.proxy} (page {page})')
                 else:
                     logger.debug(f'No proxies, using localhost (page {page})')
-                    webpage = session.get(url_1, headers=headers, timeout=30)
+                started = time.perf_counter()
+                try:
+                    webpage = lease.session.get(url_1, headers=headers, timeout=30, stream=stream)
+                except Exception as e:
+                    FETCH_RESPONSES.labels(host, 'error').inc()
+                    lease.report(error=e)
+                    raise
+                FETCH_SECONDS.labels(host).observe(time.perf_counter() - started)
+                FETCH_RESPONSES.labels(host, webpage.status_code).inc()
+                retry_after = retry_after_seconds(webpage.headers)
+                lease.report(webpage.status_code, retry_after=retry_after)
+                if webpage.status_code == 304 and cached is not None:
+                    products = cached['products']
+                    logger.debug(f'Page {page} not modified, reusing {len(products)} cached products')
+                    HOST_BACKOFF.succeeded(host, 304)
+                    condition = False
+                    continue
                 if webpage.status_code == 429:
                     logger.error(f'Non-200 response 429 for {url_1}: {webpage.text[:200]}')
-                    site_429_count += 1
-                    if site_429_count >= max_429_skip:
-                        logger.error(f'Too many 429s for {url}. Skipping this site for 30 minutes.')
-                        time.sleep(1800 + random.randint(0, JITTER))
-                        site_429_count = 0
-                    else:
-                        logger.debug(f'Backing off for {backoff} seconds (exponential, with jitter)')
-                        time.sleep(backoff + random.randint(0, JITTER))
-                        backoff = min(backoff * 2, 1800)
                     error_count += 1
-                    if error_count >= max_errors:
-                        logger.error(f'Maximum error count ({max_errors}) reached in fetch_all_products_with_paging. Aborting.')
-                        return all_products
+                    if give_up(lease, 'Rate limited', lambda: HOST_BACKOFF.throttled(host, retry_after)):
+                        return
                     continue
                 elif webpage.status_code != 200:
                     logger.error(f'Non-200 response {webpage.status_code} for {url_1}: {webpage.text[:200]}')
-                    time.sleep(random.randint(MIN_SLEEP, MAX_SLEEP))
                     error_count += 1
-                    if error_count >= max_errors:
-                        logger.error(f'Maximum error count ({max_errors}) reached in fetch_all_products_with_paging. Aborting.')
-                        return all_products
+                    if give_up(lease, f'HTTP {webpage.status_code}', lambda: HOST_BACKOFF.failed(host, webpage.status_code)):
+                        return
                     continue
                 try:
-                    products = json.loads((webpage.text))['products']
+                    if stream:
+                        index = 0
+                        try:
+                            for product in iter_response_products(webpage):
+                                if index >= page_count:
+                                    page_count += 1
+                                    yield product
+                                index += 1
+                        finally:
+                            webpage.close()
+                    else:
+                        products = json.loads((webpage.text))['products']
+                        remember_page(url, page, webpage.headers, products)
                 except Exception as e:
-                    logger.error(f'JSON decode error for {url_1}: {e}\nResponse: {webpage.text[:200]}')
-                    time.sleep(random.randint(MIN_SLEEP, MAX_SLEEP))
+                    logger.error(f'JSON decode error for {url_1}: {e}' + ('' if stream else f'\nResponse: {webpage.text[:200]}'))
                     error_count += 1
-                    if error_count >= max_errors:
-                        logger.error(f'Maximum error count ({max_errors}) reached in fetch_all_products_with_paging. Aborting.')
-                        return all_products
+                    if give_up(lease, 'Bad response body', lambda: HOST_BACKOFF.failed(host, webpage.status_code)):
+                        return
                     continue
-                logger.debug(f'Successfully fetched {len(products)} products (page {page})')
+                HOST_BACKOFF.succeeded(host)
+                logger.debug(f'Successfully fetched {page_count if stream else len(products)} products (page {page})')
                 condition = False
             except Exception as e:
-                logger.error(f'Error getting products (page {page})(url {url_1}): {e}\n Sleeping 3 minutes...')
-                time.sleep(random.randint(MIN_SLEEP, MAX_SLEEP))
+                logger.error(f'Error getting products (page {page})(url {url_1}): {e}')
                 error_count += 1
-                if error_count >= max_errors:
-                    logger.error(f'Maximum error count ({max_errors}) reached in fetch_all_products_with_paging. Aborting.')
-                    return all_products
+                if give_up(lease, 'Request failed', lambda: HOST_BACKOFF.failed(host)):
+                    return
                 continue
-        if not products:
+        page_size = page_count if stream else len(products)
+        if not page_size:
             logger.debug(f'No more products returned at page {page}. Stopping.')
+            last_page = page - 1
             break
-        all_products.extend(products)
-        # Add jitter between successful requests
-        sleep_jitter = random.randint(0, JITTER)
-        logger.debug(f'Jitter sleep for {sleep_jitter} seconds after page {page}')
-        time.sleep(sleep_jitter)
-        if len(products) < per_page:
+        fetched += page_size
+        FETCH_PRODUCTS.labels(host).inc(page_size)
+        if not stream:
+            all_products.extend(products)
+            yield from products
+            if should_stop_paging(url, products):
+                rest = cached_pages_after(url, page)
+                logger.debug(f'Nothing newer than the last pass on page {page}, reusing {len(rest)} cached products for later pages')
+                all_products.extend(rest)
+                yield from rest
+                full_pass = False
+                break
+        if page_size < per_page:
             logger.debug(f'Last page reached at page {page}.')
+            last_page = page
             break
         page += 1
-    logger.debug(f'Exiting fetch_all_products_with_paging. Total products fetched: {len(all_products)}')
-    return all_products
+    if not stream:
+        finish_incremental_pass(url, all_products, full_pass, last_page)
+    logger.debug(f'Exiting fetch_all_products_with_paging. Total products fetched: {fetched}')
+
+def fetch_all_products_with_paging(url, product_limit=PRODUCT_LIMIT, max_errors=3):
+    """
+    Fetch all products from a Shopify store using paging, with advanced anti-bot and error handling logic.
+    Adds a random jitter between successful requests and uses a requests.Session for cookie and connection reuse.
+    With INCREMENTAL_FETCH, pages are requested conditionally and a 304 reuses the cached page; recency-ordered
+    stores stop paging at the first page with nothing newer than the previous pass (see should_stop_paging).
+    If too many errors occur, aborts and returns what was fetched so far.
+    """
+    with FETCH_PASS_SECONDS.labels(urlparse(url).netloc).time():
+        return list(iter_products_with_paging(url, product_limit, max_errors))
 
 ALCOHOL_TYPES_PATH = os.path.join(os.path.dirname(__file__), 'alcohol_types.json')
 ALCOHOL_TYPES_CACHE = None
@@ -189,7 +460,35 @@ def load_alcohol_types():
         ALCOHOL_TYPES_CACHE = []
     return ALCOHOL_TYPES_CACHE
 
-def get_alcohol_type(product):
+ALCOHOL_TYPES_CHECK_INTERVAL = float(os.getenv('ALCOHOL_TYPES_CHECK_INTERVAL', '5'))  # Min seconds between alcohol_types.json mtime checks
+ALCOHOL_TYPE_MEMO_SIZE = int(os.getenv('ALCOHOL_TYPE_MEMO_SIZE', '200000'))  # Max memoized (product id, updated_at) classifications
+ALCOHOL_KEYWORDS = ()  # Flat ((keyword, type), ...) table in alcohol_types.json priority order
+ALCOHOL_KEYWORDS_MTIME = None
+ALCOHOL_TYPES_CHECKED_AT = 0.0
+ALCOHOL_TYPE_MEMO = {}
+alcohol_types_lock = threading.Lock()
+
+def get_alcohol_keywords():
+    """
+    Return the compiled keyword table, rebuilt only when alcohol_types.json changes.
+    The file is stat'ed at most once every ALCOHOL_TYPES_CHECK_INTERVAL seconds; a rebuild also clears the classification memo.
+    """
+    global ALCOHOL_KEYWORDS, ALCOHOL_KEYWORDS_MTIME, ALCOHOL_TYPES_CHECKED_AT
+    now = time.monotonic()
+    if ALCOHOL_KEYWORDS_MTIME is None or now - ALCOHOL_TYPES_CHECKED_AT >= ALCOHOL_TYPES_CHECK_INTERVAL:
+        with alcohol_types_lock:
+            ALCOHOL_TYPES_CHECKED_AT = now
+            types = load_alcohol_types()
+            if ALCOHOL_TYPES_CACHE_MTIME != ALCOHOL_KEYWORDS_MTIME:
+                # Flattening keeps first-entry-wins: every keyword of an entry precedes those of later entries
+                ALCOHOL_KEYWORDS = tuple((keyword, entry['type']) for entry in types for keyword in entry.get('keywords', []))
+                ALCOHOL_KEYWORDS_MTIME = ALCOHOL_TYPES_CACHE_MTIME
+                ALCOHOL_TYPE_MEMO.clear()
+                CANONICAL.clear_types()
+    return ALCOHOL_KEYWORDS
+
+def classify_alcohol_type(product, keywords):
+    """First keyword (in alcohol_types.json order) found in the product's type, title, description or tags."""
     # Lowercase all relevant fields for easier matching
     fields = [
         (product.get('product_type') or '').lower(),
@@ -198,12 +497,46 @@ def get_alcohol_type(product):
         ' '.join(product.get('tags', [])).lower()
     ]
     text = ' '.join(fields)
-    for entry in load_alcohol_types():
-        if any(keyword in text for keyword in entry.get('keywords', [])):
-            return entry['type']
+    for keyword, entry_type in keywords:
+        if keyword in text:
+            return entry_type
     return 'Other'
 
+def get_alcohol_type(product):
+    keywords = get_alcohol_keywords()
+    # Unchanged products (same id and updated_at) are never reclassified
+    memo_key = None
+    if product.get('id') is not None:
+        memo_key = (product['id'], product.get('updated_at'))
+        cached = ALCOHOL_TYPE_MEMO.get(memo_key)
+        if cached is not None:
+            ALCOHOL_TYPE_SOURCES['memo'].inc()
+            return cached
+    source = 'canonical'
+
+    def classify():
+        nonlocal source
+        source = 'classified'
+        started = time.perf_counter()
+        alcohol_type = classify_alcohol_type(product, keywords)
+        CLASSIFY_SECONDS.observe(time.perf_counter() - started)
+        return alcohol_type
+
+    # The same bottle listed by another store is classified once
+    key = canonical_key(product) if CANONICAL_DEDUP else None
+    if key is not None:
+        alcohol_type = CANONICAL.alcohol_type(key, classify)
+    else:
+        alcohol_type = classify()
+    ALCOHOL_TYPE_SOURCES[source].inc()
+    if memo_key is not None:
+        if len(ALCOHOL_TYPE_MEMO) >= ALCOHOL_TYPE_MEMO_SIZE:
+            ALCOHOL_TYPE_MEMO.clear()
+        ALCOHOL_TYPE_MEMO[memo_key] = alcohol_type
+    return alcohol_type
+
 def send_webhook(webhook_type, content=None, embed=None):
+    """Queue a webhook message for the background dispatcher. embed may be a dhooks Embed or a dict."""
     if webhook_type == 'notify':
         wh_url = NOTIFY_WEBHOOK
     elif webhook_type == 'error':
@@ -214,14 +547,15 @@ def send_webhook(webhook_type, content=None, embed=None):
     if not wh_url:
         logger.error(f'Webhook URL for type {webhook_type} is not set.')
         return
-    try:
-        hook = Webhook(wh_url)
-        if embed:
-            hook.send(embed=embed)
-        elif content:
-            hook.send(content)
-    except Exception as e:
-        logger.error(f'Error sending {webhook_type} webhook: {e}')
+    if embed is None and not content:
+        return
+    if isinstance(embed, Embed):
+        embed = embed.to_dict()
+    if COORDINATOR_QUEUE is not None:
+        COORDINATOR_QUEUE.put(('webhook', (webhook_type, content, embed)))
+        return
+    if NOTIFIER.submit(webhook_type, wh_url, embed=embed, content=content):
+        WEBHOOKS_QUEUED.labels(webhook_type).inc()
 
 def send_webhook_notification(product, url, event_type):
     """
@@ -278,11 +612,59 @@ def send_webhook_notification(product, url, event_type):
         embed.set_thumbnail(image_url)
     embed.set_author(name='Shopify Crawler', icon_url='https://pbs.twimg.com/profile_images/1122559367046410242/6pzYlpWd_400x400.jpg')
     try:
-        logger.debug(f'Sending {event_type} webhook notification')
+        logger.debug(f'Queueing {event_type} webhook notification')
         send_webhook('notify', embed=embed)
     except Exception as e:
         logger.error(f'Error sending {event_type} webhook: {e}')
 
+def send_aggregated_notification(event_type, stores):
+    """
+    One alert for the same canonical product at several stores. stores is [(input_url, product), ...];
+    a single store gets the regular per-store alert.
+    """
+    if len(stores) == 1:
+        url, product = stores[0]
+        send_webhook_notification(product, url, event_type)
+        return
+    url, product = stores[0]
+    title = product.get('title', 'Unknown Product')
+    if event_type == 'available':
+        description = f'***Available again at {len(stores)} stores!***'
+        color = 0x00ff00
+    else:
+        description = f'***New product at {len(stores)} stores!***'
+        color = 0x1e0f3
+    lines = []
+    for store_url, store_product in stores:
+        variants = store_product.get('variants') or []
+        price = variants[0].get('price', '0.00') if variants else '0.00'
+        lines.append(f"[{urlparse(store_url).netloc}]({store_url}products/{store_product.get('handle', '')}) ${price}")
+    embed = Embed(description=description, color=color, timestamp='now')
+    embed.add_field(name='Product Name', value=title)
+    embed.add_field(name='Stores', value='\n'.join(lines)[:1024], inline=False)
+    embed.set_footer(text='Shopify Scraper', icon_url='https://pbs.twimg.com/profile_images/1122559367046410242/6pzYlpWd_400x400.jpg')
+    image_url = next((s[1]['images'][0].get('src') for s in stores if s[1].get('images') and isinstance(s[1]['images'][0], dict)), None)
+    if image_url:
+        embed.set_thumbnail(image_url)
+    embed.set_author(name='Shopify Crawler', icon_url='https://pbs.twimg.com/profile_images/1122559367046410242/6pzYlpWd_400x400.jpg')
+    logger.debug(f'Queueing {event_type} webhook notification for {title} at {len(stores)} stores')
+    send_webhook('notify', embed=embed)
+
+# With AGGREGATE_ALERTS, 'available' and 'new' alerts for the same canonical product are merged across stores
+ALERT_AGGREGATOR = AlertAggregator(lambda event_type, stores: send_aggregated_notification(event_type, stores))
+
+def notify_product(product, url, event_type):
+    """Alert on a product event, merging it with other stores' alerts for the same bottle when AGGREGATE_ALERTS is on."""
+    if COORDINATOR_QUEUE is not None:
+        # The coordinator aggregates across every shard's stores
+        COORDINATOR_QUEUE.put(('notify', (product, url, event_type)))
+        return
+    key = canonical_key(product) if AGGREGATE_ALERTS and event_type in AGGREGATE_EVENTS else None
+    if key is not None:
+        ALERT_AGGREGATOR.add(key, event_type, url, product)
+    else:
+        send_webhook_notification(product, url, event_type)
+
 def send_error_webhook(message):
     send_webhook('error', content=message)
 
@@ -290,90 +672,407 @@ def column_exists(cursor, table, column):
     cursor.execute(f"PRAGMA table_info({table})")
     return any(row[1] == column for row in cursor.fetchall())
 
+SCHEMA_VERSION = 4  # Stored in PRAGMA user_version; bump it with every change to create_schema
+
 def init_db():
-    with db_lock:
-        conn = sqlite3.connect(DB_PATH)
-        c = conn.cursor()
-        # Add columns if they do not exist
-        c.execute('''CREATE TABLE IF NOT EXISTS products (
+    """
+    Create or migrate the schema unless the file is already at SCHEMA_VERSION, in which case this is a single PRAGMA
+    read. Then point the host backoff and the notifier at the DB.
+    """
+    if COORDINATOR_QUEUE is None:
+        with db_lock:
+            conn = get_connection(DB_PATH)
+            version = conn.execute('PRAGMA user_version').fetchone()[0]
+            if version < SCHEMA_VERSION:
+                create_schema(conn, version)
+                conn.execute(f'PRAGMA user_version = {SCHEMA_VERSION}')
+    # A shard worker (COORDINATOR_QUEUE set) relies on the coordinator having created and migrated the schema
+    HOST_BACKOFF.db_path = DB_PATH
+    HOST_BACKOFF.writer = state_writer()
+    HOST_BACKOFF.load()
+    NOTIFIER.db_path = DB_PATH
+
+def create_schema(conn, version=0):
+    """
+    Create the tables, run the column migrations and backfills, and create the indexes and triggers. version is the
+    file's user_version, for the data migrations that only older files need.
+    """
+    c = conn.cursor()
+    # Add columns if they do not exist
+    c.execute('''CREATE TABLE IF NOT EXISTS products (
+        id INTEGER,
+        handle TEXT,
+        title TEXT,
+        available INTEGER,
+        last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        published_at TEXT,  -- ISO date string
+        created_at TEXT,    -- ISO date string
+        updated_at TEXT,    -- ISO date string
+        vendor TEXT,
+        url TEXT,
+        price TEXT,
+        original_json TEXT,
+        input_url TEXT,
+        alcohol_type TEXT,
+        became_available_at TEXT,
+        became_unavailable_at TEXT,
+        date_added TEXT DEFAULT (datetime('now')),
+        ignore_notifications INTEGER DEFAULT 0,
+        fingerprint TEXT,
+        image_url TEXT,
+        variant_count INTEGER,
+        tags TEXT,
+        product_type TEXT,
+        body_text TEXT,
+        PRIMARY KEY (id, input_url)
+    )''')
+    # Adaptive polling schedule per store, written by scheduler.StoreScheduler
+    c.execute('''CREATE TABLE IF NOT EXISTS store_schedule (
+        input_url TEXT PRIMARY KEY,
+        interval_seconds REAL,
+        change_rate REAL,  -- weighted changes per hour
+        next_due_at TEXT,  -- UTC
+        last_polled_at TEXT,
+        last_changes REAL,
+        polls INTEGER DEFAULT 0
+    )''')
+    # Per-host 429/error backoff, written by scheduler.HostBackoff
+    c.execute('''CREATE TABLE IF NOT EXISTS host_backoff (
+        host TEXT PRIMARY KEY,
+        throttled INTEGER DEFAULT 0,  -- consecutive 429s
+        failures INTEGER DEFAULT 0,  -- consecutive other errors
+        backoff_seconds REAL,
+        ready_at TEXT,  -- UTC; NULL when not backing off
+        last_status INTEGER,
+        updated_at TEXT
+    )''')
+    # Webhook messages the notifier gave up on, kept for inspection or a manual resend
+    c.execute('''CREATE TABLE IF NOT EXISTS webhook_dead_letters (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        webhook_type TEXT,
+        payload TEXT,  -- the JSON body that was posted
+        status INTEGER,  -- last HTTP status, NULL for connection errors
+        error TEXT,
+        attempts INTEGER,
+        created_at TEXT
+    )''')
+    # Change-only price/availability history (see history.py)
+    create_history_tables(c)
+    # Full product JSON, zlib-compressed, only loaded on demand
+    c.execute('''CREATE TABLE IF NOT EXISTS product_raw (
+        id INTEGER,
+        input_url TEXT,
+        json_z BLOB,
+        PRIMARY KEY (id, input_url)
+    )''')
+    # A deleted product's raw JSON goes with it, whichever path deletes it (web UI, maintenance)
+    c.execute('''CREATE TRIGGER IF NOT EXISTS products_raw_ad AFTER DELETE ON products BEGIN
+                    DELETE FROM product_raw WHERE id = old.id AND input_url = old.input_url;
+                 END''')
+    # Add columns if missing (for migrations)
+    if not column_exists(c, 'products', 'became_available_at'):
+        try:
+            c.execute('ALTER TABLE products ADD COLUMN became_available_at TEXT')
+        except Exception:
+            pass
+    if not column_exists(c, 'products', 'became_unavailable_at'):
+        try:
+            c.execute('ALTER TABLE products ADD COLUMN became_unavailable_at TEXT')
+        except Exception:
+            pass
+    if not column_exists(c, 'products', 'date_added'):
+        try:
+            # SQLite does not allow non-constant defaults in ALTER TABLE, so add without default
+            c.execute("ALTER TABLE products ADD COLUMN date_added TEXT")
+        except Exception as e:
+            logger.error(f'Error adding date_added column to products table {e}')
+            pass
+    if not column_exists(c, 'products', 'ignore_notifications'):
+        try:
+            c.execute('ALTER TABLE products ADD COLUMN ignore_notifications INTEGER DEFAULT 0')
+        except Exception:
+            pass
+    if not column_exists(c, 'products', 'fingerprint'):
+        try:
+            c.execute('ALTER TABLE products ADD COLUMN fingerprint TEXT')
+        except Exception:
+            pass
+    for column, column_type in (('image_url', 'TEXT'), ('variant_count', 'INTEGER'), ('tags', 'TEXT'), ('product_type', 'TEXT')):
+        if not column_exists(c, 'products', column):
+            try:
+                c.execute(f'ALTER TABLE products ADD COLUMN {column} {column_type}')
+            except Exception as e:
+                logger.error(f'Error adding {column} column to products table {e}')
+    backfill_body = False
+    if not column_exists(c, 'products', 'body_text'):
+        try:
+            c.execute('ALTER TABLE products ADD COLUMN body_text TEXT')
+            backfill_body = True
+        except Exception as e:
+            logger.error(f'Error adding body_text column to products table {e}')
+    backfill_canonical = False
+    if not column_exists(c, 'products', 'canonical_key'):
+        try:
+            c.execute('ALTER TABLE products ADD COLUMN canonical_key TEXT')
+            backfill_canonical = True
+        except Exception as e:
+            logger.error(f'Error adding canonical_key column to products table {e}')
+    init_indexes(c)
+    conn.commit()
+    if backfill_body:
+        backfill_body_text(conn)
+    init_search_index(conn)
+    init_change_counter(conn)
+    migrate_original_json(conn)
+    if backfill_canonical:
+        backfill_canonical_keys(conn)
+    elif version == 1:
+        # Version 1 took any 8-14 digit SKU as a GTIN; re-key those products from their barcodes
+        backfill_canonical_keys(conn, where="p.canonical_key LIKE 'gtin:%'")
+    if 0 < version < 4:
+        # Products deleted before products_raw_ad existed left their product_raw rows behind
+        with conn:
+            orphans = conn.execute('''DELETE FROM product_raw WHERE NOT EXISTS
+                                      (SELECT 1 FROM products p WHERE p.id = product_raw.id AND p.input_url = product_raw.input_url)''').rowcount
+        if orphans:
+            logger.info(f'Removed {orphans} product_raw rows of deleted products')
+
+# Secondary indexes on products, created (and added to older databases) by init_db. The primary key (id, input_url)
+# already serves lookups by id alone.
+PRODUCT_INDEXES = (
+    # Cross-store lookups of the same bottle (see canonical.py)
+    ('idx_products_canonical_key', 'canonical_key'),
+    # Keyset pagination indexes for the web UI's sort keys; the expressions match web_ui.SORT_KEYS.
+    # idx_products_last_seen also serves the stale-product prune in maintenance.py, and the vendor, alcohol_type and
+    # available ones the web UI's filters and facets, which compare the same expressions.
+    ('idx_products_last_seen', "COALESCE(last_seen, ''), id, input_url"),
+    ('idx_products_price', 'COALESCE(CAST(price AS REAL), 0), id, input_url'),
+    ('idx_products_title', "COALESCE(title, ''), id, input_url"),
+    ('idx_products_vendor', "COALESCE(vendor, ''), id, input_url"),
+    ('idx_products_alcohol_type', "COALESCE(alcohol_type, ''), id, input_url"),
+    ('idx_products_available', 'COALESCE(available, 0), id, input_url'),
+    ('idx_products_published_at', "COALESCE(published_at, ''), id, input_url"),
+    ('idx_products_updated_at', "COALESCE(updated_at, ''), id, input_url"),
+    # Covers load_product_availability (per store at startup and on every reload) and the web UI's input_url filter
+    ('idx_products_store', 'input_url, id, available, price, ignore_notifications, fingerprint'),
+)
+
+def init_indexes(c):
+    """Create the missing PRODUCT_INDEXES, and rebuild any whose definition has changed since the file was created."""
+    existing = dict(c.execute("SELECT name, sql FROM sqlite_master WHERE type = 'index' AND tbl_name = 'products'").fetchall())
+    for name, columns in PRODUCT_INDEXES:
+        sql = f'CREATE INDEX {name} ON products ({columns})'
+        if existing.get(name) != sql:
+            start = time.monotonic()
+            c.execute(f'DROP INDEX IF EXISTS {name}')
+            c.execute(sql)
+            logger.debug(f'Created index {name} in {time.monotonic() - start:.1f}s')
+
+# Full-text index over the searchable product columns. External content: the text lives in products only,
+# and the triggers keep the index in step with every insert, delete and changed update (scraper or web UI).
+FTS_COLUMNS = ('title', 'vendor', 'alcohol_type', 'tags', 'product_type', 'body_text')
+
+def init_search_index(conn):
+    """Create products_fts and its sync triggers, building the index from existing rows the first time."""
+    cols = ', '.join(FTS_COLUMNS)
+    new_cols = ', '.join(f'new.{c}' for c in FTS_COLUMNS)
+    old_cols = ', '.join(f'old.{c}' for c in FTS_COLUMNS)
+    changed = ' OR '.join(f'old.{c} IS NOT new.{c}' for c in FTS_COLUMNS)
+    exists = conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone()
+    try:
+        with conn:
+            conn.execute(f"""CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5({cols},
+                             content='products', content_rowid='rowid', tokenize='unicode61 remove_diacritics 2', prefix='2 3')""")
+            conn.execute(f'''CREATE TRIGGER IF NOT EXISTS products_fts_ai AFTER INSERT ON products BEGIN
+                                INSERT INTO products_fts(rowid, {cols}) VALUES (new.rowid, {new_cols});
+                             END''')
+            conn.execute(f'''CREATE TRIGGER IF NOT EXISTS products_fts_ad AFTER DELETE ON products BEGIN
+                                INSERT INTO products_fts(products_fts, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+                             END''')
+            conn.execute(f'''CREATE TRIGGER IF NOT EXISTS products_fts_au AFTER UPDATE OF {cols} ON products WHEN {changed} BEGIN
+                                INSERT INTO products_fts(products_fts, rowid, {cols}) VALUES ('delete', old.rowid, {old_cols});
+                                INSERT INTO products_fts(rowid, {cols}) VALUES (new.rowid, {new_cols});
+                             END''')
+            if not exists:
+                conn.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+    except sqlite3.OperationalError as e:
+        # SQLite built without FTS5: the web UI falls back to LIKE search
+        logger.warning(f'Full-text search index unavailable: {e}')
+        return
+    if not exists:
+        logger.info('Built products_fts full-text index')
+
+def init_change_counter(conn):
+    """
+    db_meta.change_seq counts every products insert, update and delete (see db.change_seq); the web UI keys its caches
+    on it. Each row also keeps the sequence number of its last change in products.change_seq, and a deleted row leaves
+    a product_tombstones entry, so /api/products/changes can return only what changed after a given number.
+    """
+    with conn:
+        conn.execute('CREATE TABLE IF NOT EXISTS db_meta (key TEXT PRIMARY KEY, value INTEGER)')
+        conn.execute("INSERT OR IGNORE INTO db_meta (key, value) VALUES ('change_seq', 0)")
+        conn.execute("INSERT OR IGNORE INTO db_meta (key, value) VALUES ('tombstone_floor', 0)")
+        if not column_exists(conn.cursor(), 'products', 'change_seq'):
+            conn.execute('ALTER TABLE products ADD COLUMN change_seq INTEGER')  # NULL: unchanged since before the change feed
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_products_change_seq ON products (change_seq)')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_products_store_changes ON products (input_url, change_seq)')  # StoreState.refresh
+        conn.execute('''CREATE TABLE IF NOT EXISTS product_tombstones (
             id INTEGER,
-            handle TEXT,
-            title TEXT,
-            available INTEGER,
-            last_seen TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-            published_at TEXT,  -- ISO date string
-            created_at TEXT,    -- ISO date string
-            updated_at TEXT,    -- ISO date string
-            vendor TEXT,
-            url TEXT,
-            price TEXT,
-            original_json TEXT,
             input_url TEXT,
-            alcohol_type TEXT,
-            became_available_at TEXT,
-            became_unavailable_at TEXT,
-            date_added TEXT DEFAULT (datetime('now')),
-            ignore_notifications INTEGER DEFAULT 0,
+            change_seq INTEGER NOT NULL,
+            deleted_at INTEGER,  -- epoch seconds
             PRIMARY KEY (id, input_url)
         )''')
-        # Add columns if missing (for migrations)
-        if not column_exists(c, 'products', 'became_available_at'):
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_product_tombstones_seq ON product_tombstones (change_seq)')
+        for name in ('ai', 'au', 'ad'):
+            conn.execute(f'DROP TRIGGER IF EXISTS products_seq_{name}')  # Counter-only triggers from before change_seq rows
+        bump = "UPDATE db_meta SET value = value + 1 WHERE key = 'change_seq';"
+        seq = "(SELECT value FROM db_meta WHERE key = 'change_seq')"
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS products_changes_ai AFTER INSERT ON products BEGIN
+                            {bump}
+                            UPDATE products SET change_seq = {seq} WHERE rowid = new.rowid;
+                         END''')
+        # The WHEN clause skips the trigger's own change_seq update (and the insert trigger's)
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS products_changes_au AFTER UPDATE ON products
+                         WHEN new.change_seq IS old.change_seq BEGIN
+                            {bump}
+                            UPDATE products SET change_seq = {seq} WHERE rowid = new.rowid;
+                         END''')
+        conn.execute(f'''CREATE TRIGGER IF NOT EXISTS products_changes_ad AFTER DELETE ON products BEGIN
+                            {bump}
+                            INSERT OR REPLACE INTO product_tombstones (id, input_url, change_seq, deleted_at)
+                            VALUES (old.id, old.input_url, {seq}, CAST(strftime('%s', 'now') AS INTEGER));
+                         END''')
+
+TOMBSTONE_KEEP_DAYS = float(os.getenv('TOMBSTONE_KEEP_DAYS', '7'))  # Days deleted-product markers are kept for the change feed
+TOMBSTONE_PRUNE_BATCH = 1000  # Markers deleted per transaction
+
+def prune_tombstones(conn, now=None, keep_days=TOMBSTONE_KEEP_DAYS, lock=None):
+    """
+    Drop product_tombstones older than keep_days and raise db_meta.tombstone_floor to the newest dropped sequence
+    number: change feed clients behind the floor may have missed deletes and must reload. The floor is raised first,
+    then the markers are deleted TOMBSTONE_PRUNE_BATCH per transaction, each under lock. Returns the rows removed.
+    """
+    cutoff = int((now or time.time()) - keep_days * 86400)
+    lock = lock or nullcontext()
+    floor = conn.execute('SELECT MAX(change_seq) FROM product_tombstones WHERE deleted_at < ?', (cutoff,)).fetchone()[0]
+    if floor is None:
+        return 0
+    with lock, conn:
+        conn.execute("UPDATE db_meta SET value = MAX(value, ?) WHERE key = 'tombstone_floor'", (floor,))
+    pruned = 0
+    while True:
+        with lock, conn:
+            n = conn.execute('''DELETE FROM product_tombstones WHERE rowid IN
+                                (SELECT rowid FROM product_tombstones WHERE change_seq <= ? LIMIT ?)''', (floor, TOMBSTONE_PRUNE_BATCH)).rowcount
+        pruned += n
+        if n < TOMBSTONE_PRUNE_BATCH:
+            return pruned
+
+def backfill_body_text(conn, chunk_size=500):
+    """Fill the new body_text column from the stored product_raw JSON, in chunks."""
+    last_rowid = 0
+    filled = 0
+    while True:
+        rows = conn.execute('''SELECT p.rowid, r.json_z FROM products p JOIN product_raw r ON r.id = p.id AND r.input_url = p.input_url
+                               WHERE p.rowid > ? ORDER BY p.rowid LIMIT ?''', (last_rowid, chunk_size)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for rowid, json_z in rows:
             try:
-                c.execute('ALTER TABLE products ADD COLUMN became_available_at TEXT')
+                updates.append((product_body_text(json.loads(unpack_json(json_z))), rowid))
             except Exception:
                 pass
-        if not column_exists(c, 'products', 'became_unavailable_at'):
+        with conn:
+            conn.executemany('UPDATE products SET body_text = ? WHERE rowid = ?', updates)
+        filled += len(updates)
+        last_rowid = rows[-1][0]
+    if filled:
+        logger.info(f'Backfilled body_text for {filled} products')
+
+def backfill_canonical_keys(conn, chunk_size=500, where='1'):
+    """
+    Fill the canonical_key column (for the products matching where) from product_raw where available, else from the
+    stored title and vendor. Only keys that change are written.
+    """
+    last_rowid = 0
+    filled = 0
+    while True:
+        rows = conn.execute(f'''SELECT p.rowid, p.title, p.vendor, p.canonical_key, r.json_z FROM products p LEFT JOIN product_raw r ON r.id = p.id AND r.input_url = p.input_url
+                                WHERE p.rowid > ? AND {where} ORDER BY p.rowid LIMIT ?''', (last_rowid, chunk_size)).fetchall()
+        if not rows:
+            break
+        updates = []
+        for rowid, title, vendor, key, json_z in rows:
             try:
-                c.execute('ALTER TABLE products ADD COLUMN became_unavailable_at TEXT')
+                product = json.loads(unpack_json(json_z)) if json_z is not None else {'title': title, 'vendor': vendor}
             except Exception:
-                pass
-        if not column_exists(c, 'products', 'date_added'):
-            try:
-                # SQLite does not allow non-constant defaults in ALTER TABLE, so add without default
-                c.execute("ALTER TABLE products ADD COLUMN date_added TEXT")
-            except Exception as e:
-                logger.error(f'Error adding date_added column to products table {e}')
-                pass
-        if not column_exists(c, 'products', 'ignore_notifications'):
+                product = {'title': title, 'vendor': vendor}
+            new_key = canonical_key(product)
+            if new_key != key:
+                updates.append((new_key, rowid))
+        with conn:
+            conn.executemany('UPDATE products SET canonical_key = ? WHERE rowid = ?', updates)
+        filled += len(updates)
+        last_rowid = rows[-1][0]
+    if filled:
+        logger.info(f'Backfilled canonical_key for {filled} products')
+
+def migrate_original_json(conn, chunk_size=500):
+    """
+    One-time move of legacy products.original_json blobs into the slim columns and compressed product_raw rows.
+    Runs in chunks so a large DB never holds one huge write transaction.
+    """
+    moved = 0
+    while True:
+        rows = conn.execute('SELECT rowid, id, input_url, original_json FROM products WHERE original_json IS NOT NULL LIMIT ?', (chunk_size,)).fetchall()
+        if not rows:
+            break
+        slim = []
+        raw = []
+        for rowid, id_, input_url, original_json in rows:
             try:
-                c.execute('ALTER TABLE products ADD COLUMN ignore_notifications INTEGER DEFAULT 0')
+                product = json.loads(original_json)
             except Exception:
-                pass
-        conn.commit()
-        conn.close()
+                product = {}
+            slim.append(project_product(product) + (product_body_text(product), rowid))
+            if STORE_RAW_JSON and product:
+                raw.append((id_, input_url, pack_json(original_json)))
+        with conn:
+            conn.executemany('UPDATE products SET image_url = ?, variant_count = ?, tags = ?, product_type = ?, body_text = ?, original_json = NULL WHERE rowid = ?', slim)
+            conn.executemany(RAW_UPSERT_SQL, raw)
+        moved += len(rows)
+    if moved:
+        logger.info(f'Migrated {moved} products from original_json to slim columns and product_raw')
+
+AVAILABILITY_COLUMNS = 'id, available, price, ignore_notifications, fingerprint'
+
+def availability_entry(available, price, ignore_notifications, fingerprint):
+    return {'available': bool(available), 'price': float(price) if price is not None else None, 'ignore_notifications': ignore_notifications if ignore_notifications is not None else 0, 'fingerprint': fingerprint}
 
 def load_product_availability(input_url):
-    conn = sqlite3.connect(DB_PATH)
-    c = conn.cursor()
-    c.execute('SELECT id, available, price, ignore_notifications FROM products WHERE input_url = ?', (input_url,))
-    rows = c.fetchall()
-    conn.close()
-    # Return a dict: id -> {'available': bool, 'price': float or None, 'ignore_notifications': int}
-    return {id_: {'available': bool(available), 'price': float(price) if price is not None else None, 'ignore_notifications': ignore_notifications if ignore_notifications is not None else 0} for id_, available, price, ignore_notifications in rows}
+    conn = get_connection(DB_PATH)
+    rows = conn.execute(f'SELECT {AVAILABILITY_COLUMNS} FROM products WHERE input_url = ?', (input_url,)).fetchall()
+    # Return a dict: id -> {'available': bool, 'price': float or None, 'ignore_notifications': int, 'fingerprint': str or None}
+    return {id_: availability_entry(*values) for id_, *values in rows}
 
-def update_product_in_db(id_val, handle, title, available, product, url):
-    with db_lock:
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        c = conn.cursor()
-        published_at = str(product.get('published_at') or '')
-        created_at = str(product.get('created_at') or '')
-        updated_at = str(product.get('updated_at') or '')
-        vendor = product.get('vendor')
-        product_url = f"{url}products/{handle}"
-        variants = product.get('variants', [])
-        price = variants[0].get('price', "0.00") if variants else "0.00"
-        original_json = json.dumps(product)
-        input_url = url
-        new_alcohol_type = get_alcohol_type(product)
-        # Check if the current alcohol_type is 'unwanted' in the DB
-        c.execute('SELECT alcohol_type FROM products WHERE id = ? AND input_url = ?', (id_val, input_url))
-        row = c.fetchone()
-        if row and row[0] == 'unwanted':
-            alcohol_type = 'unwanted'
-        else:
-            alcohol_type = new_alcohol_type
-        c.execute('''INSERT INTO products (id, handle, title, available, last_seen, published_at, created_at, updated_at, vendor, url, price, original_json, input_url, alcohol_type, date_added)
-                     VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+def load_availability_changes(input_url, since):
+    """
+    What changed for input_url after change sequence number since (see init_change_counter): ({id: entry} for rows
+    inserted or updated, [id, ...] deleted), or None when since is behind the pruned tombstones and the store has to
+    reload everything. Both queries are range scans of the store's own changes.
+    """
+    conn = get_connection(DB_PATH)
+    floor = conn.execute("SELECT value FROM db_meta WHERE key = 'tombstone_floor'").fetchone()
+    if since < (floor[0] if floor else 0):
+        return None
+    rows = conn.execute(f'SELECT {AVAILABILITY_COLUMNS} FROM products WHERE input_url = ? AND change_seq > ?', (input_url, since)).fetchall()
+    deleted = conn.execute('SELECT id FROM product_tombstones WHERE input_url = ? AND change_seq > ?', (input_url, since)).fetchall()
+    return {id_: availability_entry(*values) for id_, *values in rows}, [r[0] for r in deleted]
+
+PRODUCT_UPSERT_SQL = '''INSERT INTO products (id, handle, title, available, last_seen, published_at, created_at, updated_at, vendor, url, price, image_url, variant_count, tags, product_type, body_text, input_url, alcohol_type, fingerprint, canonical_key, date_added)
+                     VALUES (?, ?, ?, ?, CURRENT_TIMESTAMP, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
                      ON CONFLICT(id, input_url) DO UPDATE SET
                         handle=excluded.handle,
                         title=excluded.title,
@@ -385,25 +1084,230 @@ def update_product_in_db(id_val, handle, title, available, product, url):
                         vendor=excluded.vendor,
                         url=excluded.url,
                         price=excluded.price,
-                        original_json=excluded.original_json,
-                        alcohol_type=?''',
-                  (id_val, handle, title, int(available), published_at, created_at, updated_at, vendor, product_url, price, original_json, input_url, alcohol_type, alcohol_type))
-        conn.commit()
+                        image_url=excluded.image_url,
+                        variant_count=excluded.variant_count,
+                        tags=excluded.tags,
+                        product_type=excluded.product_type,
+                        body_text=excluded.body_text,
+                        alcohol_type=CASE WHEN products.alcohol_type = 'unwanted' THEN 'unwanted' ELSE excluded.alcohol_type END,
+                        fingerprint=excluded.fingerprint,
+                        canonical_key=excluded.canonical_key'''
+AVAILABILITY_TIMESTAMPS_SQL = '''UPDATE products SET
+                        became_available_at = COALESCE(?, became_available_at),
+                        became_unavailable_at = COALESCE(?, became_unavailable_at)
+                     WHERE id = ? AND input_url = ?'''
+TOUCH_LAST_SEEN_SQL = 'UPDATE products SET last_seen = CURRENT_TIMESTAMP WHERE id = ? AND input_url = ?'
+RAW_UPSERT_SQL = 'INSERT OR REPLACE INTO product_raw (id, input_url, json_z) VALUES (?, ?, ?)'
+
+STORE_RAW_JSON = os.getenv('STORE_RAW_JSON', '0') == '1'  # Also keep the full product JSON (zlib-compressed) in product_raw
+WRITE_BATCH_SIZE = int(os.getenv('WRITE_BATCH_SIZE', '500'))  # Flush pending product writes after this many rows
+WRITE_BATCH_WINDOW = float(os.getenv('WRITE_BATCH_WINDOW', '30'))  # ...or after this many seconds
+LAST_SEEN_TOUCH_INTERVAL = int(os.getenv('LAST_SEEN_TOUCH_INTERVAL', '3600'))  # Min seconds between last_seen bumps of unchanged products
+
+def product_fingerprint(product):
+    """
+    Compact digest of the fields the scraper stores for a product: updated_at, title/vendor and every variant's price and availability.
+    The alcohol_types.json mtime is mixed in so editing the keywords reclassifies every product once.
+    """
+    parts = [str(product.get('updated_at') or ''), str(product.get('title') or ''), str(product.get('vendor') or ''), str(ALCOHOL_TYPES_CACHE_MTIME)]
+    for v in product.get('variants') or []:
+        parts.append(f"{v.get('id')}:{v.get('price')}:{v.get('available')}")
+    return hashlib.blake2b('|'.join(parts).encode('utf-8'), digest_size=8).hexdigest()
+
+def product_row(id_val, handle, title, available, product, url, fingerprint=None):
+    """
+    Build the PRODUCT_UPSERT_SQL parameters for one product: the fields the web UI reads, not the raw JSON (see raw_row).
+    A stored 'unwanted' alcohol_type is kept by the upsert itself.
+    """
+    published_at = str(product.get('published_at') or '')
+    created_at = str(product.get('created_at') or '')
+    updated_at = str(product.get('updated_at') or '')
+    vendor = product.get('vendor')
+    product_url = f"{url}products/{handle}"
+    variants = product.get('variants', [])
+    price = variants[0].get('price', "0.00") if variants else "0.00"
+    image_url, variant_count, tags, product_type = project_product(product)
+    alcohol_type = get_alcohol_type(product)
+    key = canonical_key(product)
+    if key is not None and CANONICAL_DEDUP:
+        # Listings without a picture borrow one from another store carrying the same bottle
+        image_url = CANONICAL.image_url(key, image_url)
+    return (id_val, handle, title, int(available), published_at, created_at, updated_at, vendor, product_url, price, image_url, variant_count, tags, product_type, product_body_text(product), url, alcohol_type, fingerprint, key)
+
+def raw_row(id_val, product, url):
+    """RAW_UPSERT_SQL parameters holding the compressed product JSON."""
+    return (id_val, url, pack_json(product))
+
+def write_product_batch(rows, timestamps=(), touches=(), raw_rows=(), events=(), schedules=(), backoffs=()):
+    """
+    Apply product upserts, availability timestamp updates and last_seen bumps with executemany in a single transaction.
+    rows are product_row tuples, timestamps are (became_available_at, became_unavailable_at, id, input_url) tuples,
+    touches are (id, input_url) tuples of unchanged products, raw_rows are raw_row tuples and events are
+    (id, input_url, ts, old_price, new_price, old_available, new_available) history tuples. schedules and backoffs are
+    store_schedule and host_backoff rows the coordinator received from shard workers (see state_writer).
+    """
+    if not rows and not timestamps and not touches and not raw_rows and not events and not schedules and not backoffs:
+        return
+    if COORDINATOR_QUEUE is not None:
+        COORDINATOR_QUEUE.put(('write', (rows, timestamps, touches, raw_rows, events)))
+        return
+    started = time.perf_counter()
+    conn = get_connection(DB_PATH)
+    with db_lock, conn:
+        if rows:
+            conn.executemany(PRODUCT_UPSERT_SQL, rows)
+        if timestamps:
+            conn.executemany(AVAILABILITY_TIMESTAMPS_SQL, timestamps)
+        if touches:
+            conn.executemany(TOUCH_LAST_SEEN_SQL, touches)
+        if raw_rows:
+            conn.executemany(RAW_UPSERT_SQL, raw_rows)
+        if events:
+            store_ids = {url: store_id(conn, url) for url in {e[1] for e in events}}
+            conn.executemany(EVENT_INSERT_SQL, [(e[0], store_ids[e[1]]) + tuple(e[2:]) for e in events])
+        if schedules:
+            conn.executemany(SCHEDULE_UPSERT_SQL, schedules)
+        if backoffs:
+            conn.executemany(BACKOFF_UPSERT_SQL, backoffs)
+    DB_WRITE_SECONDS.observe(time.perf_counter() - started)
+    for kind, batch in (('products', rows), ('timestamps', timestamps), ('touches', touches), ('raw', raw_rows), ('events', events)):
+        if batch:
+            DB_WRITE_ROWS.labels(kind).inc(len(batch))
+
+def queue_state_row(kind, params):
+    COORDINATOR_QUEUE.put((kind, params))
+
+def state_writer():
+    """
+    The writer StoreScheduler and HostBackoff use: in a shard worker their store_schedule and host_backoff rows go to
+    the coordinator with the product writes, elsewhere (None) they write them directly.
+    """
+    return queue_state_row if COORDINATOR_QUEUE is not None else None
+
+class ProductWriteBatch:
+    """Collects a store cycle's product writes and flushes them in one transaction per WRITE_BATCH_SIZE rows / WRITE_BATCH_WINDOW seconds."""
+
+    def __init__(self, url):
+        self.url = url
+        self.rows = []
+        self.timestamps = []
+        self.touches = []
+        self.raw_rows = []
+        self.events = []
+        self.started = time.monotonic()
+
+    def __len__(self):
+        return len(self.rows) + len(self.timestamps) + len(self.touches) + len(self.events)
+
+    def add_product(self, id_val, handle, title, available, product, fingerprint=None):
+        self.rows.append(product_row(id_val, handle, title, available, product, self.url, fingerprint))
+        if STORE_RAW_JSON:
+            self.raw_rows.append(raw_row(id_val, product, self.url))
+
+    def touch(self, product_id):
+        """Queue a last_seen bump for a product whose stored row is otherwise unchanged."""
+        self.touches.append((product_id, self.url))
+
+    def add_availability_timestamps(self, product_id, became_available_at=None, became_unavailable_at=None):
+        self.timestamps.append((became_available_at, became_unavailable_at, product_id, self.url))
+
+    def add_event(self, product_id, old_price, new_price, old_available, new_available):
+        """Queue a product_events row: the product appeared (old values None) or its price or availability changed."""
+        self.events.append((product_id, self.url, int(time.time()), old_price, new_price,
+                            None if old_available is None else int(old_available), int(new_available)))
+
+    def due(self):
+        return len(self) >= WRITE_BATCH_SIZE or (len(self) and time.monotonic() - self.started >= WRITE_BATCH_WINDOW)
+
+    def flush(self):
+        if len(self):
+            start = time.monotonic()
+            write_product_batch(self.rows, self.timestamps, self.touches, self.raw_rows, self.events)
+            logger.debug(f'Flushed {len(self.rows)} product rows, {len(self.timestamps)} timestamp updates, {len(self.touches)} last_seen bumps and {len(self.events)} history events for {self.url} in {time.monotonic() - start:.3f}s')
+        self.rows = []
+        self.timestamps = []
+        self.touches = []
+        self.raw_rows = []
+        self.events = []
+        self.started = time.monotonic()
+
+HISTORY_COMPACTED_AT = 0.0
+HISTORY_THREAD = None
+history_lock = threading.Lock()
+
+def maybe_compact_history():
+    """
+    Start the product_events and product_tombstones retention jobs on a background thread if HISTORY_COMPACT_INTERVAL
+    has passed since the last run (any thread may call this). Like maintenance, the job has its own connection and
+    takes db_lock only around each batch it writes.
+    """
+    global HISTORY_COMPACTED_AT, HISTORY_THREAD
+    if COORDINATOR_QUEUE is not None or not HISTORY_COMPACT_INTERVAL:
+        return  # The coordinator runs retention
+    now = time.monotonic()
+    if HISTORY_COMPACTED_AT and now - HISTORY_COMPACTED_AT < HISTORY_COMPACT_INTERVAL:
+        return
+    if not history_lock.acquire(blocking=False):
+        return  # The previous run is still going
+    HISTORY_COMPACTED_AT = now
+    HISTORY_THREAD = threading.Thread(target=history_retention_job, args=(DB_PATH,), name='History retention', daemon=True)
+    HISTORY_THREAD.start()
+
+def history_retention_job(db_path):
+    conn = connect(db_path)
+    try:
+        start = time.monotonic()
+        deleted, merged = compact_events(conn, lock=db_lock)
+        tombstones = prune_tombstones(conn, lock=db_lock)
+        if deleted or merged or tombstones:
+            logger.info(f'History retention removed {deleted} expired and merged {merged} old product events, and dropped {tombstones} deleted-product markers in {time.monotonic() - start:.1f}s')
+    except Exception as e:
+        logger.error(f'Error compacting product history: {e}')
+    finally:
         conn.close()
+        history_lock.release()
+
+MAINTENANCE_RAN_AT = 0.0
+MAINTENANCE_THREAD = None
+maintenance_lock = threading.Lock()
+
+def maybe_run_maintenance():
+    """
+    Start the products.db maintenance job (see maintenance.py) on a background thread if MAINTENANCE_INTERVAL has
+    passed since the last run. The caller carries on; the job takes db_lock only around its short write steps.
+    """
+    global MAINTENANCE_RAN_AT, MAINTENANCE_THREAD
+    if COORDINATOR_QUEUE is not None or not MAINTENANCE_INTERVAL:
+        return
+    now = time.monotonic()
+    if MAINTENANCE_RAN_AT and now - MAINTENANCE_RAN_AT < MAINTENANCE_INTERVAL:
+        return
+    if not maintenance_lock.acquire(blocking=False):
+        return  # The previous run is still going
+    MAINTENANCE_RAN_AT = now
+    MAINTENANCE_THREAD = threading.Thread(target=maintenance_job, args=(DB_PATH,), name='DB maintenance', daemon=True)
+    MAINTENANCE_THREAD.start()
+
+def maintenance_job(db_path):
+    conn = connect(db_path)
+    try:
+        report = run_maintenance(conn, lock=db_lock)
+        for row in report['footprint']:
+            DB_BYTES.labels(row['name'], row['kind']).set(row['bytes'])
+    except Exception as e:
+        logger.error(f'Error running DB maintenance: {e}')
+    finally:
+        conn.close()
+        maintenance_lock.release()
+
+def update_product_in_db(id_val, handle, title, available, product, url):
+    write_product_batch([product_row(id_val, handle, title, available, product, url)], raw_rows=[raw_row(id_val, product, url)] if STORE_RAW_JSON else ())
 
 def update_availability_timestamps(product_id, input_url, became_available_at=None, became_unavailable_at=None):
     """
     Update only the became_available_at and/or became_unavailable_at columns for a product.
     """
-    with db_lock:
-        conn = sqlite3.connect(DB_PATH, check_same_thread=False)
-        c = conn.cursor()
-        if became_available_at is not None:
-            c.execute('UPDATE products SET became_available_at = ? WHERE id = ? AND input_url = ?', (became_available_at, product_id, input_url))
-        if became_unavailable_at is not None:
-            c.execute('UPDATE products SET became_unavailable_at = ? WHERE id = ? AND input_url = ?', (became_unavailable_at, product_id, input_url))
-        conn.commit()
-        conn.close()
+    write_product_batch([], [(became_available_at, became_unavailable_at, product_id, input_url)])
 
 def get_random_sleep_time(min_seconds=240, max_seconds=360):
     """Return a random sleep time between min_seconds and max_seconds (inclusive)."""
@@ -418,117 +1322,519 @@ def is_interesting(product):
         return True, product_type
     return False, product_type
 
+class StoreState:
+    """Per-store tracking state carried between scan cycles of a single input_url."""
+
+    def __init__(self, url):
+        self.url = url
+        # Load product availability from DB for this input_url, remembering the change counter it is current to
+        self.synced_seq = change_seq(get_connection(DB_PATH))
+        self.product_availability = load_product_availability(url)
+        self.init_product_count = len(self.product_availability)
+        self.last_changes = 0.0  # change_score of the last cycle, fed to the scheduler
+        logger.debug(f'{self.init_product_count} products loaded from DB for {url}')
+        logger.debug(f'DB Returned {len(self.product_availability)} products availablity')
+
+    def refresh(self):
+        """
+        Apply the store's rows changed in the DB since the last sync (web UI edits such as ignore_notifications, and
+        deletes) to product_availability. Called before every cycle; it only reads what changed.
+        A shard worker's own writes reach the DB later through the coordinator, so a changed row may be older than the
+        worker's memory: there only ignore_notifications (set by the web UI alone) and deletes are taken from the DB.
+        """
+        seq = change_seq(get_connection(DB_PATH))
+        if seq is None or seq == self.synced_seq:
+            return
+        worker = COORDINATOR_QUEUE is not None
+        changes = load_availability_changes(self.url, self.synced_seq) if self.synced_seq is not None else None
+        if changes is None:
+            if worker:
+                logger.warning(f'Change feed for {self.url} was pruned; keeping the worker state, web UI edits before seq {seq} are skipped')
+            else:
+                self.product_availability = load_product_availability(self.url)
+                logger.debug(f'Reloaded {len(self.product_availability)} products from DB for {self.url}')
+        else:
+            rows, deleted = changes
+            for id_ in deleted:
+                self.product_availability.pop(id_, None)
+            for id_, entry in rows.items():
+                previous = self.product_availability.get(id_)
+                if worker and previous:
+                    previous['ignore_notifications'] = entry['ignore_notifications']
+                    continue
+                entry['touched_at'] = previous.get('touched_at', 0) if previous else 0
+                self.product_availability[id_] = entry
+            if rows or deleted:
+                logger.debug(f'Refreshed {len(rows)} changed and {len(deleted)} deleted products from DB for {self.url}')
+        self.synced_seq = seq
+
+def process_products(state, products):
+    """
+    Run one change-detection pass over the products (a list or a streaming iterator) fetched for state.url.
+    Sends notifications, updates the DB and the in-memory availability map.
+    Returns the list of new/changed product ids.
+    """
+    url = state.url
+    product_availability = state.product_availability
+    new_products = []
+    brandnewproducts = 0
+    interesting_count = 0
+    flips = 0
+    updated = 0
+    batch = ProductWriteBatch(url)
+    now_mono = time.monotonic()
+    # --- Check for product availability changes ---
+    for product in products:
+        # Filter products using is_interesting before tracking for availability and new product detection.
+        # products may be a generator (STREAM_PRODUCTS), so filter lazily instead of building a list.
+        if not is_interesting(product)[0]:
+            continue
+        interesting_count += 1
+        id_val = product.get('id')
+        handle = product.get('handle', '')
+        title = product.get('title', '')
+        # If variants exist, check the first one for availability, else False
+        available = False
+        if product.get('variants') and len(product['variants']) > 0:
+            available = product['variants'][0].get('available', False)
+        # --- Price drop notification logic ---
+        price = 0.0
+        try:
+            price = float(product['variants'][0]['price']) if product.get('variants') and len(product['variants']) > 0 else 0.0
+        except Exception:
+            price = 0.0
+        prev_price = None
+        prev_available = None
+        prev_info = product_availability.get(id_val)
+        ignore_notifications = 0
+        # Fingerprint before the price drop logic below annotates the product
+        fingerprint = product_fingerprint(product)
+
+        if prev_info is not None:
+            prev_available = prev_info.get('available')
+            prev_price = prev_info.get('price')
+            ignore_notifications = prev_info.get('ignore_notifications', 0)
+
+        # --- End price drop logic ---
+        if prev_available is not None and not prev_available and available:
+            logger.debug(f'Product became available: {product["title"]} ({handle})')
+            new_products.append(id_val)
+            flips += 1
+            if not ignore_notifications:
+                notify_product(product, url, 'available')
+            now = datetime.datetime.utcnow().isoformat()
+            batch.add_availability_timestamps(id_val, became_available_at=now)
+        elif prev_available is not None and prev_available and not available:
+            logger.debug(f'Product became UNAVAILABLE: {product["title"]} ({handle})')
+            new_products.append(id_val)
+            flips += 1
+            if not ignore_notifications:
+                notify_product(product, url, 'unavailable')
+            now = datetime.datetime.utcnow().isoformat()
+            batch.add_availability_timestamps(id_val, became_unavailable_at=now)
+        elif prev_available is None:
+            logger.debug(f'New product detected: {product["title"]} ({handle})')
+            new_products.append(id_val)
+            brandnewproducts += 1
+            # Only Send a webhook notification if DB has been initialized and we haven't sent 5 notifications already
+            if state.init_product_count > 0 and brandnewproducts <= 15:
+                notify_product(product, url, 'new')
+        elif prev_price is not None and price < prev_price:
+            percent_drop = (prev_price - price) / prev_price
+            if percent_drop >= PRICE_DROP_THRESHOLD:
+                logger.debug(f'Product price reduced: {product["title"]} ({handle}) {prev_price} -> {price} ({percent_drop*100:.1f}% drop)')
+                # Add price drop info to product for notification
+                product['price_drop_amount'] = prev_price - price
+                product['price_drop_percent'] = percent_drop * 100
+                if not ignore_notifications:
+                    notify_product(product, url, 'price_reduced')
+        # Change-only history: the first sighting and every price or availability change
+        if prev_info is None or prev_available != available or (prev_price is not None and price != prev_price):
+            batch.add_event(id_val, prev_price, price, prev_available, available)
+        # Update the tracked availability in memory and DB, only rewriting rows whose fingerprint changed
+        if prev_info is not None and prev_info.get('fingerprint') == fingerprint:
+            touched_at = prev_info.get('touched_at', 0)
+            if now_mono - touched_at >= LAST_SEEN_TOUCH_INTERVAL:
+                batch.touch(id_val)
+                touched_at = now_mono
+        else:
+            batch.add_product(id_val, handle, title, available, product, fingerprint)
+            touched_at = now_mono
+            if prev_info is not None:
+                updated += 1
+        product_availability[id_val] = {'available': available, 'price': price, 'ignore_notifications': ignore_notifications, 'fingerprint': fingerprint, 'touched_at': touched_at}
+        if batch.due():
+            batch.flush()
+    batch.flush()
+    maybe_compact_history()
+    maybe_run_maintenance()
+    state.last_changes = change_score(flips, brandnewproducts, updated)
+    logger.debug(f'{interesting_count} interesting products fetched with paging')
+    # --- End availability check ---
+    logger.debug(f'Scraping target$* {url} new/changed products: {len(new_products)}')
+    return new_products
+
+def run_store_cycle(state):
+    """One scan of state.url: refresh tracked state, fetch every page and run change detection. Returns the change score."""
+    state.refresh()
+    # Monitors website for new products
+    if STREAM_PRODUCTS:
+        products = iter_products_with_paging(state.url, stream=True)
+    else:
+        products = fetch_all_products_with_paging(state.url)
+    process_products(state, products)
+    return state.last_changes
+
+def scheduler_worker(scheduler, states, loop_exceptions):
+    """
+    Worker thread: repeatedly take the store that is due first, scan it and hand it back to the scheduler.
+    states (url -> StoreState) and loop_exceptions (url -> consecutive failures) are shared by all workers.
+    """
+    while scheduler.stores:
+        url = scheduler.next_due(timeout=60)
+        if url is None:
+            continue
+        host = urlparse(url).netloc
+        host_wait = HOST_BACKOFF.ready_at(host) - time.time()
+        if host_wait > 0:
+            # Another store on this host hit a backoff: don't tie up a worker, come back when the host is ready
+            logger.debug(f'{host} is backing off, postponing {url} by {host_wait:.0f} seconds')
+            scheduler.reschedule(url, host_wait)
+            continue
+        try:
+            state = states.get(url)
+            if state is None:
+                state = states[url] = StoreState(url)
+            changes = run_store_cycle(state)
+            delay = scheduler.record(url, changes, not_before=HOST_BACKOFF.ready_at(host))
+            logger.debug(f'{url}: change score {changes}, next poll in {delay:.0f} seconds')
+            loop_exceptions[url] = 0  # Reset exception counter after successful iteration
+        except Exception as e:
+            count = loop_exceptions.get(url, 0)
+            if count > 5:
+                logger.error(f'Store {url} has encountered too many exceptions ({count}). Removing it from the schedule...')
+                send_error_webhook(f'Store {url} has encountered too many exceptions last exception was ({e}). Removing it from the schedule...')
+                scheduler.remove(url)
+                continue
+            logger.error(f'Error scanning {url}: {e}')
+            logger.debug('Retrying in 5 seconds...')
+            loop_exceptions[url] = count + 1
+            scheduler.reschedule(url, 5)
+
+def log_schedule(scheduler, limit=10):
+    for entry in scheduler.snapshot()[:limit]:
+        logger.debug(f"Next due {entry['next_due_at']} every {entry['interval_seconds']:.0f}s ({entry['change_rate']} changes/h): {entry['input_url']}")
+    for entry in HOST_BACKOFF.snapshot():
+        if entry['ready_at']:
+            logger.debug(f"{entry['host']} backing off until {entry['ready_at']} (last status {entry['last_status']})")
+
+def run_thread_engine(urls, workers=SCRAPER_WORKERS):
+    """Poll every url from a pool of worker threads, each store as often as its change rate warrants."""
+    init_db()
+    scheduler = StoreScheduler(DB_PATH, writer=state_writer())
+    for url in urls:
+        # Spread the first requests out so every store doesn't hit the network at once
+        scheduler.add(url, stagger=JITTER)
+    log_schedule(scheduler)
+    states = {}
+    loop_exceptions = {}
+    workers = workers or min(len(urls), 16)
+    threads = []
+    for x in range(workers):
+        worker = threading.Thread(target=scheduler_worker, name=f'Worker {x}', args=(scheduler, states, loop_exceptions))
+        worker.start()
+        threads.append(worker)
+        logger.debug(f'{worker.name} initialized')
+    return scheduler, threads
+
 def Main(url):
+    """Monitor a single store on the calling thread."""
     logger.debug(f'Entering Main for url: {url}')
-    # Initialize DB
-    init_db()
-    # Load product availability from DB for this input_url
-    product_availability = load_product_availability(url)
-    init_product_count = len(product_availability)
-    logger.debug(f'{init_product_count} products loaded from DB for {url}')
-    logger.debug(f'DB Returned {len(product_availability)} products availablity')
-    proxies = getProxies()
-
-    logger.debug('Webhook loaded')   
-    loop_exceptions = 0
-    refresh_counter = 0
-    REFRESH_INTERVAL = 5  # every 5 loops
+    _, threads = run_thread_engine([url], workers=1)
+    for worker in threads:
+        worker.join()
+
+# --- Asyncio crawl engine ---
+class CrawlLimits:
+    """Global and per-host concurrency caps shared by every store task of the asyncio engine."""
+
+    def __init__(self, global_limit=CRAWL_CONCURRENCY, per_host_limit=PER_HOST_CONCURRENCY):
+        self.global_sem = asyncio.Semaphore(global_limit)
+        self.per_host_limit = per_host_limit
+        self.host_sems = {}
+
+    def host(self, url):
+        host = urlparse(url).netloc
+        sem = self.host_sems.get(host)
+        if sem is None:
+            sem = self.host_sems[host] = asyncio.Semaphore(self.per_host_limit)
+        return sem
+
+async def async_fetch_all_products_with_paging(session, url, limits, product_limit=PRODUCT_LIMIT, max_errors=3):
+    """
+    Asyncio counterpart of fetch_all_products_with_paging.
+    Each request holds its host slot and a global slot only while in flight, and pacing waits release both so other
+    stores keep crawling in the meantime. Backoff follows the same HOST_BACKOFF rules as the threaded fetch: retry on
+    another proxy if one can serve the host, otherwise end the pass and let the caller wait for the host.
+    """
+    logger.debug(f'Fetching all products with paging (async) for url: {url}')
+    host = urlparse(url).netloc
+    all_products = []
+    page = 1
+    per_page = 200
+    error_count = 0
+    host_sem = limits.host(url)
+    timeout = aiohttp.ClientTimeout(total=30)
+    full_pass = True
+    last_page = None
+    while len(all_products) < product_limit:
+        url_1 = f"{url}products.json?limit={per_page}&page={page}"
+        products = None
+        headers = build_request_headers(url)
+        headers.update(conditional_headers(url, page))
+        cached = cached_page(url, page)
+        while products is None:
+            wait = HOST_BACKOFF.try_acquire(host)
+            while wait > 0:
+                if wait > MAX_INLINE_WAIT:
+                    logger.info(f'{host} is not ready for another {wait:.0f} seconds, ending this pass of {url}')
+                    return all_products
+                await asyncio.sleep(wait)
+                wait = HOST_BACKOFF.try_acquire(host)
+            await asyncio.sleep(random.uniform(0, PAGE_JITTER))
+            lease, pool_wait = PROXY_POOL.choose(host)
+            while lease is None:
+                if pool_wait > MAX_INLINE_WAIT:
+                    logger.info(f'No proxy can serve {host} within {MAX_INLINE_WAIT} seconds, ending this pass of {url}')
+                    return all_products
+                await asyncio.sleep(pool_wait)
+                lease, pool_wait = PROXY_POOL.choose(host)
+            proxy = lease.proxy
+            status = None
+            retry_after = None
+            try:
+                async with host_sem, limits.global_sem:
+                    if proxy:
+                        logger.debug(f'Trying proxy: {proxy} (page {page})')
+                    else:
+                        logger.debug(f'No proxies, using localhost (page {page})')
+                    started = time.perf_counter()
+                    try:
+                        async with session.get(url_1, headers=headers, proxy=f'http://{proxy}' if proxy else None, timeout=timeout) as webpage:
+                            status = webpage.status
+                            text = await webpage.text()
+                            response_headers = webpage.headers
+                    except Exception as e:
+                        FETCH_RESPONSES.labels(host, 'error').inc()
+                        lease.report(error=e)
+                        raise
+                    FETCH_SECONDS.labels(host).observe(time.perf_counter() - started)
+                    FETCH_RESPONSES.labels(host, status).inc()
+                retry_after = retry_after_seconds(response_headers)
+                lease.report(status, retry_after=retry_after)
+                if status == 304 and cached is not None:
+                    products = cached['products']
+                    logger.debug(f'Page {page} not modified, reusing {len(products)} cached products')
+                elif status == 429:
+                    logger.error(f'Non-200 response 429 for {url_1}: {text[:200]}')
+                elif status != 200:
+                    logger.error(f'Non-200 response {status} for {url_1}: {text[:200]}')
+                else:
+                    try:
+                        products = json.loads(text)['products']
+                        remember_page(url, page, response_headers, products)
+                    except Exception as e:
+                        logger.error(f'JSON decode error for {url_1}: {e}\nResponse: {text[:200]}')
+            except Exception as e:
+                logger.error(f'Error getting products (page {page})(url {url_1}): {e}')
+            if products is None:
+                error_count += 1
+                if error_count < max_errors and PROXY_POOL.available(host, exclude=proxy):
+                    logger.debug('Retrying with another proxy')
+                    continue
+                if error_count >= max_errors:
+                    logger.error(f'Maximum error count ({max_errors}) reached in async_fetch_all_products_with_paging. Aborting.')
+                # HOST_BACKOFF persists to the host_backoff table; keep that SQLite write off the event loop
+                if status == 429:
+                    backoff = await asyncio.to_thread(HOST_BACKOFF.throttled, host, retry_after)
+                else:
+                    backoff = await asyncio.to_thread(HOST_BACKOFF.failed, host, status)
+                logger.info(f'{host} backs off for {backoff:.0f} seconds, ending this pass of {url}')
+                return all_products
+            await asyncio.to_thread(HOST_BACKOFF.succeeded, host, status)
+        logger.debug(f'Successfully fetched {len(products)} products (page {page})')
+        if not products:
+            logger.debug(f'No more products returned at page {page}. Stopping.')
+            last_page = page - 1
+            break
+        FETCH_PRODUCTS.labels(host).inc(len(products))
+        all_products.extend(products)
+        if should_stop_paging(url, products):
+            rest = cached_pages_after(url, page)
+            logger.debug(f'Nothing newer than the last pass on page {page}, reusing {len(rest)} cached products for later pages')
+            all_products.extend(rest)
+            full_pass = False
+            break
+        if len(products) < per_page:
+            logger.debug(f'Last page reached at page {page}.')
+            last_page = page
+            break
+        page += 1
+    finish_incremental_pass(url, all_products, full_pass, last_page)
+    logger.debug(f'Exiting async_fetch_all_products_with_paging. Total products fetched: {len(all_products)}')
+    return all_products
 
+async def async_monitor_store(session, url, limits, scheduler):
+    """Asyncio counterpart of scheduler_worker: one cooperative task per store, sleeping until the store is due."""
+    logger.debug(f'Entering async monitor for url: {url}')
+    state = await asyncio.to_thread(StoreState, url)
+    entry = await asyncio.to_thread(scheduler.add, url, None, None, JITTER)
+    await asyncio.sleep(max(entry.due_at - time.time(), 0))
+    loop_exceptions = 0
     while True:
         try:
-            # Refresh product_availability from DB every 5 loops
-            if refresh_counter >= REFRESH_INTERVAL:
-                product_availability = load_product_availability(url)
-                refresh_counter = 0
-                logger.debug('Refreshed product_availability from DB (every 5 loops)')
-            # Monitors website for new products
-            products = fetch_all_products_with_paging(url)
-            # Filter products using is_interesting before tracking for availability and new product detection in Main.
-            interesting_products = [p for p in products if is_interesting(p)[0]]
-            new_products = []
-            brandnewproducts = 0
-            logger.debug(f'{len(interesting_products)} interesting products fetched with paging')
-            # --- Check for product availability changes ---
-            for product in interesting_products:
-                id_val = product.get('id')
-                handle = product.get('handle', '')
-                title = product.get('title', '')
-                # If variants exist, check the first one for availability, else False
-                available = False
-                if product.get('variants') and len(product['variants']) > 0:
-                    available = product['variants'][0].get('available', False)
-                # --- Price drop notification logic ---
-                price = 0.0
-                try:
-                    price = float(product['variants'][0]['price']) if product.get('variants') and len(product['variants']) > 0 else 0.0
-                except Exception:
-                    price = 0.0
-                prev_price = None
-                prev_available = None
-                prev_info = product_availability.get(id_val)
-                ignore_notifications = 0
-
-                if prev_info is not None:
-                    prev_available = prev_info.get('available')
-                    prev_price = prev_info.get('price')
-                    ignore_notifications = prev_info.get('ignore_notifications', 0)
-                
-                # --- End price drop logic ---
-                if prev_available is not None and not prev_available and available:
-                    logger.debug(f'Product became available: {product["title"]} ({handle})')
-                    new_products.append(id_val)
-                    if not ignore_notifications:
-                        send_webhook_notification(product, url, 'available')
-                    now = datetime.datetime.utcnow().isoformat()
-                    update_availability_timestamps(id_val, url, became_available_at=now)
-                elif prev_available is not None and prev_available and not available:
-                    logger.debug(f'Product became UNAVAILABLE: {product["title"]} ({handle})')
-                    new_products.append(id_val)
-                    if not ignore_notifications:
-                        send_webhook_notification(product, url, 'unavailable')
-                    now = datetime.datetime.utcnow().isoformat()
-                    update_availability_timestamps(id_val, url, became_unavailable_at=now)
-                elif prev_available is None:
-                    logger.debug(f'New product detected: {product["title"]} ({handle})')
-                    new_products.append(id_val)
-                    brandnewproducts += 1
-                    # Only Send a webhook notification if DB has been initialized and we haven't sent 5 notifications already
-                    if init_product_count > 0 and brandnewproducts <= 15:
-                        send_webhook_notification(product, url, 'new')
-                elif prev_price is not None and price < prev_price:
-                    percent_drop = (prev_price - price) / prev_price
-                    if percent_drop >= PRICE_DROP_THRESHOLD:
-                        logger.debug(f'Product price reduced: {product["title"]} ({handle}) {prev_price} -> {price} ({percent_drop*100:.1f}% drop)')
-                        # Add price drop info to product for notification
-                        product['price_drop_amount'] = prev_price - price
-                        product['price_drop_percent'] = percent_drop * 100
-                        if not ignore_notifications:
-                            send_webhook_notification(product, url, 'price_reduced')
-                # Update the tracked availability in memory and DB
-                product_availability[id_val] = {'available': available, 'price': price, 'ignore_notifications': ignore_notifications}
-                update_product_in_db(id_val, handle, title, available, product, url)
-            # --- End availability check ---
-            logger.debug(f'Scraping target$* {url} new/changed products: {len(new_products)}')
-            sleep_time = get_random_sleep_time(240, 360)
-            logger.debug(f'sleeping for {sleep_time} seconds')
-            logger.debug(f'Current refresh_counter: {refresh_counter}')
-            refresh_counter += 1
-            time.sleep(sleep_time)
-            loop_exceptions = 0  # Reset exception counter after successful iteration
-            # End of main loop, increment refresh_counter
-            
+            await asyncio.to_thread(state.refresh)
+            with FETCH_PASS_SECONDS.labels(urlparse(url).netloc).time():
+                products = await async_fetch_all_products_with_paging(session, url, limits)
+            # DB writes and webhooks are blocking, keep them off the event loop
+            await asyncio.to_thread(process_products, state, products)
+            sleep_time = await asyncio.to_thread(scheduler.record, url, state.last_changes, None, HOST_BACKOFF.ready_at(urlparse(url).netloc))
+            logger.debug(f'{url}: change score {state.last_changes}, sleeping for {sleep_time:.0f} seconds')
+            await asyncio.sleep(sleep_time)
+            loop_exceptions = 0
         except Exception as e:
             if loop_exceptions > 5:
-                logger.error(f'Main loop has encountered too many exceptions ({loop_exceptions}). Exiting...')
-                send_error_webhook(f'Main loop has encountered too many exceptions last exception was ({e}). Exiting...')
+                logger.error(f'Store task for {url} has encountered too many exceptions ({loop_exceptions}). Exiting...')
+                await asyncio.to_thread(send_error_webhook, f'Store task for {url} has encountered too many exceptions last exception was ({e}). Exiting...')
                 break
-            logger.error(f'Error in Main loop: {e}')
-            logger.debug('Sleeping for 5 seconds before retrying...')
-            time.sleep(5)
+            logger.error(f'Error in store task for {url}: {e}')
+            await asyncio.sleep(5)
             loop_exceptions += 1
-            continue
+
+async def run_async_engine(urls):
+    """Monitor every url from a single event loop, bounded by CRAWL_CONCURRENCY and PER_HOST_CONCURRENCY."""
+    init_db()
+    limits = CrawlLimits()
+    scheduler = StoreScheduler(DB_PATH, writer=state_writer())
+    connector = aiohttp.TCPConnector(limit=CRAWL_CONCURRENCY, ttl_dns_cache=300)
+    async with aiohttp.ClientSession(connector=connector) as session:
+        await asyncio.gather(*(async_monitor_store(session, url, limits, scheduler) for url in urls))
+
+SHARD_MESSAGE_BATCH = 100  # Shard messages the coordinator merges into one write transaction
+
+def apply_shard_messages(messages):
+    """
+    Coordinator side of the shard queue: merge every 'write', 'schedule' and 'backoff' message into one
+    write_product_batch transaction, then pass 'notify' and 'webhook' messages to the local alert pipeline.
+    """
+    writes = ([], [], [], [], [])
+    state_rows = {'schedule': [], 'backoff': []}
+    alerts = []
+    for kind, payload in messages:
+        if kind == 'write':
+            for merged, part in zip(writes, payload):
+                merged.extend(part)
+        elif kind in state_rows:
+            state_rows[kind].append(payload)
+        else:
+            alerts.append((kind, payload))
+    write_product_batch(*writes, schedules=state_rows['schedule'], backoffs=state_rows['backoff'])
+    for kind, payload in alerts:
+        if kind == 'notify':
+            notify_product(*payload)
+        elif kind == 'webhook':
+            send_webhook(*payload)
+        else:
+            logger.error(f'Unknown shard message: {kind}')
+
+def drain_shard_queue(results, timeout=1.0, max_messages=SHARD_MESSAGE_BATCH):
+    """Wait up to timeout for a message, take whatever else is already queued (up to max_messages) and apply them."""
+    try:
+        messages = [results.get(timeout=timeout)]
+    except queue.Empty:
+        return 0
+    while len(messages) < max_messages:
+        try:
+            messages.append(results.get_nowait())
+        except queue.Empty:
+            break
+    try:
+        apply_shard_messages(messages)
+    except Exception as e:
+        logger.error(f'Error applying {len(messages)} shard messages: {e}')
+    return len(messages)
+
+def shard_worker(shard, urls, results, log_queue):
+    """
+    Entry point of a shard worker process: crawl urls with SCRAPER_ENGINE, sending product writes, notifications and
+    log records to the coordinator.
+    """
+    global COORDINATOR_QUEUE
+    COORDINATOR_QUEUE = results
+    for handler in logger.handlers:
+        handler.close()
+    handler = QueueHandler(log_queue)
+
+    def tag_shard(record):
+        record.threadName = f'Shard {shard} {record.threadName}'
+        return True
+
+    handler.addFilter(tag_shard)
+    logger.handlers = [handler]
+    if METRICS_PORT:
+        start_metrics_server(METRICS_PORT + 1 + shard)
+    logger.info(f'Shard {shard} started with {len(urls)} URLs')
+    if SCRAPER_ENGINE == 'asyncio':
+        asyncio.run(run_async_engine(urls))
+        return
+    _, threads = run_thread_engine(urls)
+    for thread in threads:
+        thread.join()
+
+def start_shard(ctx, shard, urls, results, log_queue):
+    process = ctx.Process(target=shard_worker, name=f'Shard {shard}', args=(shard, urls, results, log_queue), daemon=True)
+    process.start()
+    logger.debug(f'Shard {shard} (pid {process.pid}) initialized with {len(urls)} URLs')
+    return process
+
+def run_sharded_engine(urls, processes=SCRAPER_PROCESSES):
+    """
+    Coordinator: split urls across shard worker processes by host on a consistent hash ring, then apply their writes
+    and notifications until interrupted. Crashed workers are restarted after SHARD_RESTART_DELAY seconds.
+    """
+    init_db()
+    ctx = multiprocessing.get_context('spawn')
+    results = ctx.Queue(SHARD_QUEUE_SIZE)
+    log_queue = ctx.Queue()
+    listener = QueueListener(log_queue, *logger.handlers)
+    listener.start()
+    shards = HashRing(range(processes)).partition(urls, key=lambda u: urlparse(u).netloc)
+    workers = {shard: start_shard(ctx, shard, shard_urls, results, log_queue) for shard, shard_urls in sorted(shards.items())}
+    restart_at = {}
+    try:
+        while workers:
+            drain_shard_queue(results)
+            maybe_compact_history()
+            maybe_run_maintenance()
+            now = time.monotonic()
+            for shard, process in list(workers.items()):
+                if process.is_alive():
+                    continue
+                if shard not in restart_at:
+                    logger.error(f'Shard {shard} exited with code {process.exitcode}, restarting it in {SHARD_RESTART_DELAY:.0f} seconds')
+                    restart_at[shard] = now + SHARD_RESTART_DELAY
+                elif now >= restart_at[shard]:
+                    del restart_at[shard]
+                    workers[shard] = start_shard(ctx, shard, shards[shard], results, log_queue)
+    finally:
+        for process in workers.values():
+            process.terminate()
+        NOTIFIER.flush(timeout=10)
+        listener.stop()
+
 if __name__ == "__main__":
     logger.info('SScraper 1.0')
+    start_metrics_server()
     #choice = input('Enter any key to initialize scraper$* (Press \'Q\' to quit) ')
     #choice = (choice.lower())
     #if choice == ('q'):
@@ -537,15 +1843,19 @@ if __name__ == "__main__":
     # Grab links from text file to initialize threads.
     urls = [u.strip() for u in SHOPIFY_URLS if u.strip()]
 
-    # Initializes threads to monitor multiple websites at once.
-    for x in range(len(urls)):
-        logger.debug(f'Initializing threads for url: {urls[x]}')
-        #proxy_threads = threading.Thread(target=getProxies, name='getProxy Thread {}'.format(x))
-        #content_threads = threading.Thread(target=getContent, name='getContent Thread {}'.format(x), args= (urls[x],))
-        #product_threads = threading.Thread(target=getProducts, name='getProduct Thread {}'.format(x), args= (urls[x],))
-        main_threads = threading.Thread(target=Main, name='Main Thread {}'.format(x), args= (urls[x],))
-        #content_threads.start()
-        #product_threads.start()
-        main_threads.start()
-        logger.debug(f'{main_threads.name} initialized')
-    send_error_webhook(f'SScraper 1.0 initialized with {len(urls)} URLs')
\ No newline at end of file
+    if SCRAPER_PROCESSES > 1:
+        logger.debug(f'Starting {SCRAPER_PROCESSES} shard worker processes ({SCRAPER_ENGINE} engine) for {len(urls)} URLs')
+        send_error_webhook(f'SScraper 1.0 initialized with {len(urls)} URLs in {SCRAPER_PROCESSES} processes')
+        run_sharded_engine(urls)
+        raise SystemExit(0)
+
+    if SCRAPER_ENGINE == 'asyncio':
+        logger.debug(f'Starting asyncio engine for {len(urls)} URLs (concurrency {CRAWL_CONCURRENCY}, per host {PER_HOST_CONCURRENCY})')
+        send_error_webhook(f'SScraper 1.0 initialized with {len(urls)} URLs')
+        asyncio.run(run_async_engine(urls))
+        raise SystemExit(0)
+
+    # Worker threads poll the stores as they come due
+    logger.debug(f'Starting thread engine for {len(urls)} URLs')
+    run_thread_engine(urls)
+    send_error_webhook(f'SScraper 1.0 initialized with {len(urls)} URLs')
@@ -0,0 +1,102 @@
+"""
+Concurrent read/write throughput of products.db: connect-per-operation with the default rollback journal
+(the old behaviour) versus the shared db.py layer (long-lived connections, WAL, tuned pragmas).
+
+One writer process upserts batches of products the way the scraper does while reader processes run the
+web UI's list query. Run from the repo root:
+
+    python benchmarks/bench_db_concurrency.py --rows 20000 --readers 4 --seconds 10
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import random
+import sqlite3
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import db
+
+UPSERT_SQL = '''INSERT INTO products (id, title, available, last_seen, price, original_json, input_url)
+                VALUES (?, ?, ?, CURRENT_TIMESTAMP, ?, ?, ?)
+                ON CONFLICT(id, input_url) DO UPDATE SET title=excluded.title, available=excluded.available,
+                last_seen=CURRENT_TIMESTAMP, price=excluded.price, original_json=excluded.original_json'''
+READ_SQL = 'SELECT id, title, price, available, input_url, last_seen FROM products ORDER BY last_seen DESC LIMIT 500'
+
+def open_conn(path, mode):
+    if mode == 'legacy':
+        return sqlite3.connect(path, timeout=30)
+    return db.get_connection(path)
+
+def setup(path, rows):
+    conn = sqlite3.connect(path)
+    conn.execute('PRAGMA journal_mode=DELETE')
+    conn.execute('''CREATE TABLE products (id INTEGER, title TEXT, available INTEGER, last_seen TIMESTAMP,
+                    price TEXT, original_json TEXT, input_url TEXT, PRIMARY KEY (id, input_url))''')
+    conn.executemany(UPSERT_SQL, [make_row(i) for i in range(rows)])
+    conn.commit()
+    conn.close()
+
+def make_row(i):
+    payload = json.dumps({'id': i, 'body_html': 'x' * 400, 'variants': [{'price': '10.00'}]})
+    return (i, f'Product {i}', random.randint(0, 1), f'{random.randint(10, 99)}.00', payload, 'https://store.example/')
+
+def writer(path, mode, rows, deadline, counter):
+    done = 0
+    while time.time() < deadline:
+        batch = [make_row(random.randrange(rows)) for _ in range(200)]
+        if mode == 'legacy':
+            # Old write path: one connection and commit per product
+            for row in batch:
+                conn = open_conn(path, mode)
+                conn.execute(UPSERT_SQL, row)
+                conn.commit()
+                conn.close()
+        else:
+            conn = open_conn(path, mode)
+            with conn:
+                conn.executemany(UPSERT_SQL, batch)
+        done += len(batch)
+    counter.value += done
+
+def reader(path, mode, deadline, counter):
+    done = 0
+    while time.time() < deadline:
+        conn = open_conn(path, mode)
+        try:
+            conn.execute(READ_SQL).fetchall()
+            done += 1
+        except sqlite3.OperationalError:
+            pass  # database is locked: the reader lost to the writer
+        if mode == 'legacy':
+            conn.close()
+    counter.value += done
+
+def run(mode, rows, readers, seconds):
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'products.db')
+        setup(path, rows)
+        if mode == 'pooled':
+            db.connect(path).close()  # switch the file to WAL before the workers start
+        writes = multiprocessing.Value('i', 0)
+        reads = multiprocessing.Value('i', 0)
+        deadline = time.time() + seconds
+        procs = [multiprocessing.Process(target=writer, args=(path, mode, rows, deadline, writes))]
+        procs += [multiprocessing.Process(target=reader, args=(path, mode, deadline, reads)) for _ in range(readers)]
+        for p in procs:
+            p.start()
+        for p in procs:
+            p.join()
+        print(f'{mode:>7}: {writes.value / seconds:10.1f} product writes/s  {reads.value / seconds:8.1f} list reads/s')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=20000)
+    parser.add_argument('--readers', type=int, default=4)
+    parser.add_argument('--seconds', type=float, default=10)
+    args = parser.parse_args()
+    for mode in ('legacy', 'pooled'):
+        run(mode, args.rows, args.readers, args.seconds)
@@ -0,0 +1,64 @@
+"""
+Cost of the product_events history at scale: insert throughput through the scraper's batch writer, storage per
+event, one product's series (/api/products/<id>/history), a one-day range (/api/history) and a retention run.
+Run from the repo root:
+
+    python benchmarks/bench_history.py --events 2000000
+"""
+import argparse
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import SScraper
+import history
+
+DAY = 86400
+
+def timed(label, fn, repeat=1):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        result = fn()
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f'{label:>28}: {elapsed * 1000:9.2f} ms')
+    return result
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--events', type=int, default=2000000)
+    parser.add_argument('--products', type=int, default=20000)
+    parser.add_argument('--stores', type=int, default=20)
+    parser.add_argument('--days', type=int, default=400)
+    args = parser.parse_args()
+    rng = random.Random(1)
+    with tempfile.TemporaryDirectory() as tmp:
+        SScraper.DB_PATH = os.path.join(tmp, 'products.db')
+        SScraper.init_db()
+        conn = SScraper.get_connection(SScraper.DB_PATH)
+        now = int(time.time())
+        start = time.perf_counter()
+        stores = [f'https://store{s}.example/' for s in range(args.stores)]
+        batch = []
+        for i in range(args.events):
+            ts = now - int(args.days * DAY * (1 - i / args.events))
+            batch.append((rng.randrange(args.products), rng.choice(stores), ts, 10.0, 10.0, 1, rng.randint(0, 1)))
+            if len(batch) >= SScraper.WRITE_BATCH_SIZE:
+                SScraper.write_product_batch([], events=batch)
+                batch = []
+        SScraper.write_product_batch([], events=batch)
+        elapsed = time.perf_counter() - start
+        print(f'{"insert":>28}: {args.events / elapsed:9.0f} events/s')
+        size = os.path.getsize(SScraper.DB_PATH) + os.path.getsize(SScraper.DB_PATH + '-wal')
+        print(f'{"storage":>28}: {size / args.events:9.1f} bytes/event (with indexes)')
+        sid = history.store_id(conn, stores[0])
+        timed('one product series', lambda: conn.execute(
+            'SELECT ts, new_price, new_available FROM product_events WHERE product_id = ? AND store_id = ? ORDER BY ts',
+            (rng.randrange(args.products), sid)).fetchall(), repeat=100)
+        timed('one day, newest 1000', lambda: conn.execute(
+            'SELECT * FROM product_events WHERE ts >= ? AND ts <= ? ORDER BY ts DESC LIMIT 1000', (now - 2 * DAY, now - DAY)).fetchall(), repeat=20)
+        deleted, merged = timed('retention run', lambda: history.compact_events(conn, now=now))
+        print(f'{"":>28}  deleted {deleted}, merged {merged}')
+        timed('retention run (again)', lambda: history.compact_events(conn, now=now))
@@ -0,0 +1,59 @@
+"""
+load_product_availability (one store's ids, availability, price and fingerprints) on a synthetic products.db with and
+without the covering idx_products_store index, the incremental StoreState.refresh that replaced periodic reloads, and
+what a maintenance run costs and reports. Run from the repo root:
+
+    python benchmarks/bench_indexes.py --rows 500000 --stores 100
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import SScraper
+import maintenance
+
+def build(path, rows, stores):
+    SScraper.DB_PATH = path
+    SScraper.init_db()
+    conn = SScraper.get_connection(path)
+    start = time.perf_counter()
+    with conn:
+        conn.executemany('INSERT INTO products (id, title, available, price, input_url, fingerprint) VALUES (?, ?, ?, ?, ?, ?)',
+                         ((i, f'Bourbon {i}', i % 2, f'{i % 90 + 10}.00', f'https://store{i % stores}.example/', f'{i:016x}') for i in range(rows)))
+    print(f'built {rows} rows in {stores} stores in {time.perf_counter() - start:.1f}s')
+    return conn
+
+def time_loads(label, stores, repeat):
+    start = time.perf_counter()
+    for i in range(repeat):
+        SScraper.load_product_availability(f'https://store{i % stores}.example/')
+    print(f'{label:>24}: {(time.perf_counter() - start) / repeat * 1000:8.2f} ms per store')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--stores', type=int, default=100)
+    parser.add_argument('--repeat', type=int, default=50)
+    args = parser.parse_args()
+    SScraper.logger.handlers = []
+    with tempfile.TemporaryDirectory() as tmp:
+        conn = build(os.path.join(tmp, 'products.db'), args.rows, args.stores)
+        time_loads('idx_products_store', args.stores, args.repeat)
+        conn.execute('DROP INDEX idx_products_store')
+        conn.execute('DROP INDEX idx_products_store_changes')
+        time_loads('table scan', args.stores, args.repeat)
+        SScraper.init_indexes(conn.cursor())
+        SScraper.init_change_counter(conn)
+        state = SScraper.StoreState('https://store0.example/')
+        start = time.perf_counter()
+        for i in range(args.repeat):
+            with conn:  # A web UI edit between cycles
+                conn.execute('UPDATE products SET ignore_notifications = 1 WHERE id = ?', (i * args.stores,))
+            state.refresh()
+        print(f"{'refresh (1 edit)':>24}: {(time.perf_counter() - start) / args.repeat * 1000:8.2f} ms per store")
+        report = maintenance.run_maintenance(conn, stale_days=0)
+        print(f"maintenance run: {report['seconds']:.1f}s")
+        print(maintenance.format_footprint(report['footprint'][:8]))
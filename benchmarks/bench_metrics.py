@@ -0,0 +1,38 @@
+"""
+Overhead of the scraper's metrics on the hot loop: the raw cost of a counter increment and a histogram observation,
+next to the get_alcohol_type memo-hit path they are added to. Run from the repo root:
+
+    python benchmarks/bench_metrics.py --calls 1000000
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import SScraper
+from metrics import Registry, Counter, Histogram
+
+def per_call(label, fn, calls):
+    start = time.perf_counter()
+    for _ in range(calls):
+        fn()
+    elapsed = time.perf_counter() - start
+    print(f'{label:>32}: {elapsed / calls * 1e9:8.0f} ns/call')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--calls', type=int, default=1000000)
+    args = parser.parse_args()
+    registry = Registry()
+    counter = Counter('bench_total', 'Benchmark counter', ('source',), registry=registry).labels('memo')
+    labelled = Counter('bench_labelled_total', 'Benchmark counter', ('host',), registry=registry)
+    histogram = Histogram('bench_seconds', 'Benchmark histogram', registry=registry).labels()
+    product = {'id': 1, 'updated_at': '2024-01-01T00:00:00-05:00', 'title': 'Bourbon', 'tags': [], 'product_type': ''}
+    SScraper.get_alcohol_type(product)  # Memoized from here on
+    per_call('empty loop', lambda: None, args.calls)
+    per_call('counter.inc()', counter.inc, args.calls)
+    per_call('labels(host).inc()', lambda: labelled.labels('store.example').inc(), args.calls)
+    per_call('histogram.observe()', lambda: histogram.observe(0.003), args.calls)
+    per_call('perf_counter() x2 + observe()', lambda: histogram.observe(time.perf_counter() - time.perf_counter()), args.calls)
+    per_call('get_alcohol_type (memo hit)', lambda: SScraper.get_alcohol_type(product), args.calls)
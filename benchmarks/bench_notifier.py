@@ -0,0 +1,57 @@
+"""
+Throughput of Discord notifications against a local stub webhook with Discord's per-webhook limit (5 per 2s).
+
+Compares the original synchronous path (a new dhooks Webhook per event, sent inline) with the background
+WebhookDispatcher. For each, reports how long the store loop is blocked and how long until everything is
+delivered. Run from the repo root:
+
+    python benchmarks/bench_notifier.py --notifications 50
+"""
+import argparse
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+from dhooks import Webhook, Embed
+from notifier import WebhookDispatcher
+from webhook_stub import WebhookStub
+
+DISCORD_URL = 'https://discord.com/api/webhooks/1/token'
+
+def make_embed(i):
+    embed = Embed(description='***Available Product again!***', color=0x00ff00)
+    embed.add_field(name='Product Name', value=f'Bourbon {i}')
+    embed.add_field(name='Price', value='49.99')
+    return embed
+
+def legacy(stub, n):
+    start = time.perf_counter()
+    for i in range(n):
+        hook = Webhook(DISCORD_URL)
+        hook.url = stub.url  # dhooks only accepts discord.com URLs
+        hook.send(embed=make_embed(i))
+    elapsed = time.perf_counter() - start
+    return elapsed, elapsed
+
+def dispatcher(stub, n):
+    d = WebhookDispatcher(batch_wait=0.05)
+    start = time.perf_counter()
+    for i in range(n):
+        d.submit('notify', stub.url, embed=make_embed(i).to_dict())
+    blocked = time.perf_counter() - start
+    d.flush()
+    return blocked, time.perf_counter() - start
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--notifications', type=int, default=50)
+    parser.add_argument('--latency', type=float, default=0.05, help='stub response time in seconds')
+    args = parser.parse_args()
+    for label, fn in (('legacy', legacy), ('dispatcher', dispatcher)):
+        stub = WebhookStub(limit=5, window=2.0, latency=args.latency)
+        blocked, total = fn(stub, args.notifications)
+        print(f'{label:>10}: loop blocked {blocked:7.3f}s  delivered in {total:7.3f}s  '
+              f'{len(stub.embeds):4d} embeds in {len(stub.messages):3d} messages  {stub.rate_limited:3d} x 429')
+        stub.close()
@@ -0,0 +1,92 @@
+"""
+Search latency on a synthetic products.db: the original LIKE scan (title/vendor/alcohol_type/original_json with a
+leading wildcard, run twice for the page and the COUNT) versus the products_fts index behind /api/products/search.
+Run from the repo root:
+
+    python benchmarks/bench_search.py --rows 500000
+"""
+import argparse
+import json
+import os
+import random
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+import SScraper
+import db
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'webapp'))
+import web_ui
+
+WORDS = ('small batch aged charred oak barrels caramel vanilla baking spice limited release cask strength '
+         'gift box single barrel straight wheated high rye sherry finish peated islay highland reserve').split()
+TYPES = ('Bourbon', 'Rye', 'Scotch', 'Tequila', 'Gin', 'Rum', 'Wine', 'Other')
+QUERIES = ('bourbon', 'cask strength', 'sherry fin', 'Distillery 42', 'nonexistent')
+
+LEGACY_SQL = ('SELECT id, title, price, available, vendor, alcohol_type, original_json FROM products '
+              'WHERE title LIKE ? OR vendor LIKE ? OR alcohol_type LIKE ? OR original_json LIKE ? '
+              'ORDER BY last_seen DESC LIMIT ? OFFSET ?')
+LEGACY_COUNT_SQL = 'SELECT COUNT(*) FROM products WHERE title LIKE ? OR vendor LIKE ? OR alcohol_type LIKE ? OR original_json LIKE ?'
+
+def make_product(rng, i):
+    alcohol_type = rng.choice(TYPES)
+    body = ' '.join(rng.choice(WORDS) for _ in range(rng.randint(20, 80)))
+    tags = rng.sample(WORDS, 3)
+    return {
+        'id': i, 'title': f'{rng.choice(WORDS).title()} {rng.choice(WORDS).title()} {alcohol_type} {i}',
+        'vendor': f'Distillery {rng.randrange(500)}', 'product_type': alcohol_type, 'tags': tags,
+        'body_html': f'<p>{body}</p>', 'variants': [{'price': f'{rng.randint(10, 300)}.00', 'available': True}],
+    }, alcohol_type
+
+def build(path, rows, seed=1):
+    SScraper.DB_PATH = path
+    SScraper.init_db()
+    rng = random.Random(seed)
+    conn = db.connect(path)
+    start = time.perf_counter()
+    batch = []
+    for i in range(rows):
+        product, alcohol_type = make_product(rng, i)
+        _, _, tags, product_type = db.project_product(product)
+        batch.append((i, product['title'], product['vendor'], alcohol_type, tags, product_type, db.product_body_text(product),
+                      product['variants'][0]['price'], 'https://store.example/', json.dumps(product)))
+        if len(batch) == 5000 or i == rows - 1:
+            with conn:
+                conn.executemany('''INSERT INTO products (id, title, vendor, alcohol_type, tags, product_type, body_text, price, input_url, original_json)
+                                    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)''', batch)
+            batch = []
+    print(f'built {rows} rows (FTS kept in sync by triggers) in {time.perf_counter() - start:.1f}s')
+    conn.close()
+
+def legacy_search(conn, q, per_page=500):
+    like = f'%{q}%'
+    conn.execute(LEGACY_SQL, (like, like, like, like, per_page, 0)).fetchall()
+    return conn.execute(LEGACY_COUNT_SQL, (like, like, like, like)).fetchone()[0]
+
+def fts_search(client, q):
+    web_ui.invalidate_cached_queries()  # measure cold counts, not the TTL cache
+    return client.get(f'/api/products/search?q={q}&per_page=500').get_json()['total']
+
+def timed(label, fn, arg, q, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        total = fn(arg, q)
+    elapsed = (time.perf_counter() - start) / repeat
+    print(f'{label:>7} {q!r:>16}: {elapsed * 1000:9.1f} ms/query  {total:8d} matches')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=500000)
+    parser.add_argument('--repeat', type=int, default=3)
+    args = parser.parse_args()
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'products.db')
+        build(path, args.rows)
+        web_ui.DB_PATH = path
+        conn = db.connect(path)
+        with web_ui.app.test_client() as client:
+            for q in QUERIES:
+                timed('LIKE', legacy_search, conn, q, args.repeat)
+                timed('FTS5', fts_search, client, q, args.repeat)
+        conn.close()
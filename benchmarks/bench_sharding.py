@@ -0,0 +1,68 @@
+"""
+Scaling of the sharded engine's CPU-bound work with processes: each shard worker parses its stores' products.json
+pages, classifies and runs change detection, while the coordinator applies the writes. Network fetching is left
+out so the numbers show the GIL-bound part. Run from the repo root:
+
+    python benchmarks/bench_sharding.py --stores 8 --products 5000 --processes 1 2 4
+"""
+import argparse
+import json
+import multiprocessing
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'tests'))
+import SScraper
+from test_db_writer import make_product
+
+def page_bodies(store, products):
+    items = [make_product(store * 1000000 + i, title=f'Bourbon Whiskey {i}', price=f'{i % 90 + 10}.00') for i in range(products)]
+    return [json.dumps({'products': items[i:i + 200]}) for i in range(0, products, 200)]
+
+def worker(db_path, stores, products, results):
+    SScraper.DB_PATH = db_path
+    SScraper.COORDINATOR_QUEUE = results
+    SScraper.logger.handlers = []
+    for store in stores:
+        bodies = page_bodies(store, products)
+        state = SScraper.StoreState(f'https://store{store}.example/')
+        SScraper.process_products(state, (p for body in bodies for p in json.loads(body)['products']))
+    results.put(('done', ()))
+
+def run(processes, stores, products):
+    with tempfile.TemporaryDirectory() as tmp:
+        SScraper.DB_PATH = os.path.join(tmp, 'products.db')
+        SScraper.init_db()
+        ctx = multiprocessing.get_context('spawn')
+        results = ctx.Queue(1000)
+        start = time.perf_counter()
+        shards = [list(range(stores))[i::processes] for i in range(processes)]
+        workers = [ctx.Process(target=worker, args=(SScraper.DB_PATH, shard, products, results)) for shard in shards]
+        for w in workers:
+            w.start()
+        done = 0
+        while done < processes:
+            message = results.get()
+            if message[0] == 'done':
+                done += 1
+            else:
+                SScraper.apply_shard_messages([message])
+        elapsed = time.perf_counter() - start
+        for w in workers:
+            w.join()
+        count = SScraper.get_connection(SScraper.DB_PATH).execute('SELECT COUNT(*) FROM products').fetchone()[0]
+        print(f'{processes:>3} processes: {count / elapsed:9.0f} products/s ({count} products in {elapsed:.1f}s)')
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--stores', type=int, default=8)
+    parser.add_argument('--products', type=int, default=5000, help='products per store')
+    parser.add_argument('--processes', type=int, nargs='+', default=[1, 2, 4])
+    args = parser.parse_args()
+    SScraper.logger.handlers = []
+    print(f'{os.cpu_count()} CPUs')
+    for n in args.processes:
+        run(n, args.stores, args.products)
@@ -0,0 +1,51 @@
+"""
+Throughput and bytes on the wire of the web UI's list endpoints on a synthetic products.db: a cold page (query and
+serialization), a repeat of it served from the response cache, gzip, and an If-None-Match revalidation (304).
+Uses the Flask test client, so the numbers leave out the network and the WSGI server. Run from the repo root:
+
+    python benchmarks/bench_web_json.py --rows 100000 --limit 500
+"""
+import argparse
+import os
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..', 'webapp'))
+import web_ui
+from bench_search import build
+
+def measure(label, client, url, headers, seconds, clear=False):
+    requests = 0
+    size = 0
+    start = time.perf_counter()
+    while time.perf_counter() - start < seconds:
+        if clear:
+            with web_ui._response_cache_lock:
+                web_ui._response_cache.clear()
+        res = client.get(url, headers=headers)
+        size = len(res.data)
+        requests += 1
+    elapsed = time.perf_counter() - start
+    print(f'{label:>28}: {requests / elapsed:8.1f} req/s  {size:>10} bytes  (HTTP {res.status_code})')
+    return res
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--rows', type=int, default=100000)
+    parser.add_argument('--limit', type=int, default=500, help='products per page')
+    parser.add_argument('--seconds', type=float, default=3)
+    args = parser.parse_args()
+    print(f"JSON encoder: {'orjson' if web_ui.orjson else 'json'}; brotli: {'yes' if web_ui.brotli else 'not installed'}")
+    with tempfile.TemporaryDirectory() as tmp:
+        path = os.path.join(tmp, 'products.db')
+        build(path, args.rows)
+        web_ui.DB_PATH = path
+        client = web_ui.app.test_client()
+        for url in (f'/api/products?limit={args.limit}', '/api/stats', '/api/products/search?q=bourbon&per_page=100'):
+            print(url)
+            measure('uncached, identity', client, url, {}, args.seconds, clear=True)
+            measure('cached, identity', client, url, {}, args.seconds)
+            res = measure('cached, gzip', client, url, {'Accept-Encoding': 'gzip'}, args.seconds)
+            measure('If-None-Match (304)', client, url, {'Accept-Encoding': 'gzip', 'If-None-Match': res.headers['ETag']}, args.seconds)
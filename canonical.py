@@ -0,0 +1,178 @@
+"""
+Cross-store product identity.
+
+Many stores carry the same bottles. canonical_key() maps a Shopify product to a store-independent key: the first
+variant barcode with a valid GS1 check digit (SKUs are store-internal and never used), otherwise the normalized vendor, title and variant sizes.
+CanonicalIndex is shared by every store worker and remembers, per canonical product, its classification and a
+representative image so those are computed once no matter how many stores list it. AlertAggregator holds
+'available'/'new' alerts for a short window so a bottle restocking at several stores produces one
+"available at N stores" webhook instead of one per store.
+"""
+import hashlib
+import heapq
+import html
+import logging
+import os
+import re
+import threading
+import time
+import unicodedata
+from collections import OrderedDict
+
+CANONICAL_DEDUP = os.getenv('CANONICAL_DEDUP', '1') == '1'  # Classify and pick images once per canonical product
+CANONICAL_INDEX_SIZE = int(os.getenv('CANONICAL_INDEX_SIZE', '200000'))  # Max canonical products kept in memory
+AGGREGATE_ALERTS = os.getenv('AGGREGATE_ALERTS', '0') == '1'  # Merge the same product's alerts across stores
+AGGREGATE_WINDOW = float(os.getenv('AGGREGATE_WINDOW', '120'))  # Seconds to collect stores before sending a merged alert
+AGGREGATE_EVENTS = ('available', 'new')
+
+logger = logging.getLogger('scraper')
+
+_GTIN_RE = re.compile(r'^\d{8,14}$')
+_WORD_RE = re.compile(r'[a-z0-9]+')
+_STOPWORDS = frozenset(('the', 'a', 'an', 'and', 'of'))
+
+def normalize_text(value):
+    """Lowercase ASCII words of value with accents, entities, punctuation and filler words removed."""
+    value = unicodedata.normalize('NFKD', html.unescape(str(value or ''))).encode('ascii', 'ignore').decode('ascii').lower()
+    return ' '.join(w for w in _WORD_RE.findall(value) if w not in _STOPWORDS)
+
+def valid_gtin(code):
+    """True if code (8 to 14 digits) ends in a correct GS1 check digit."""
+    if not _GTIN_RE.match(code) or not code.strip('0'):
+        return False
+    digits = [int(d) for d in reversed(code)]
+    return sum(d * (3 if i % 2 else 1) for i, d in enumerate(digits)) % 10 == 0
+
+def product_gtin(product):
+    """The first valid variant barcode (UPC/EAN/GTIN) with leading zeros stripped. None if there is none."""
+    for v in product.get('variants') or []:
+        code = str(v.get('barcode') or '').strip()
+        if valid_gtin(code):
+            return code.lstrip('0')
+    return None
+
+def canonical_key(product):
+    """
+    Store-independent identity of a product: 'gtin:<code>' when a barcode is known, else a digest of the normalized
+    vendor, title (without a leading vendor name) and sorted variant titles. None for products without a title.
+    """
+    gtin = product_gtin(product)
+    if gtin:
+        return f'gtin:{gtin}'
+    title = normalize_text(product.get('title'))
+    if not title:
+        return None
+    vendor = normalize_text(product.get('vendor'))
+    if vendor and title.startswith(vendor + ' '):
+        title = title[len(vendor) + 1:]
+    sizes = sorted(normalize_text(v.get('title')) for v in product.get('variants') or [])
+    digest = hashlib.blake2b('|'.join([vendor, title] + sizes).encode('utf-8'), digest_size=8).hexdigest()
+    return f'name:{digest}'
+
+class CanonicalProduct:
+    __slots__ = ('key', 'alcohol_type', 'image_url')
+
+    def __init__(self, key):
+        self.key = key
+        self.alcohol_type = None
+        self.image_url = None
+
+class CanonicalIndex:
+    """Bounded, thread-safe map of canonical key -> CanonicalProduct, least recently used evicted first."""
+
+    def __init__(self, size=CANONICAL_INDEX_SIZE):
+        self.size = size
+        self.entries = OrderedDict()
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    def entry_locked(self, key):
+        entry = self.entries.get(key)
+        if entry is None:
+            entry = self.entries[key] = CanonicalProduct(key)
+            if len(self.entries) > self.size:
+                self.entries.popitem(last=False)
+        else:
+            self.entries.move_to_end(key)
+        return entry
+
+    def alcohol_type(self, key, classify):
+        """The canonical product's classification, calling classify() only the first time key is seen."""
+        with self.lock:
+            entry = self.entry_locked(key)
+            if entry.alcohol_type is not None:
+                self.hits += 1
+                return entry.alcohol_type
+            self.misses += 1
+        alcohol_type = classify()
+        with self.lock:
+            entry.alcohol_type = alcohol_type
+        return alcohol_type
+
+    def image_url(self, key, image_url):
+        """Remember the first image seen for key and return it for stores whose listing has none."""
+        with self.lock:
+            entry = self.entry_locked(key)
+            if entry.image_url is None and image_url:
+                entry.image_url = image_url
+            return image_url or entry.image_url
+
+    def clear_types(self):
+        """Forget classifications (alcohol_types.json changed); images are kept."""
+        with self.lock:
+            for entry in self.entries.values():
+                entry.alcohol_type = None
+
+class AlertAggregator:
+    """
+    Collects alerts per (canonical key, event) for window seconds, then calls send(event_type, [(url, product), ...]).
+    The first store's alert opens the window; later stores join it. Thread-safe. The windows' deadlines are kept in a
+    heap that one flusher thread drains, however many products are pending.
+    """
+
+    def __init__(self, send, window=AGGREGATE_WINDOW):
+        self.send = send
+        self.window = window
+        self.pending = {}  # (key, event_type) -> OrderedDict(url -> product)
+        self.deadlines = []  # heap of (monotonic deadline, (key, event_type))
+        self.cond = threading.Condition()
+        self.thread = None
+
+    def add(self, key, event_type, url, product):
+        with self.cond:
+            stores = self.pending.get((key, event_type))
+            if stores is None:
+                stores = self.pending[(key, event_type)] = OrderedDict()
+                heapq.heappush(self.deadlines, (time.monotonic() + self.window, (key, event_type)))
+                if self.thread is None:
+                    self.thread = threading.Thread(target=self.run, name='Alert aggregator', daemon=True)
+                    self.thread.start()
+                self.cond.notify()
+            stores[url] = product
+
+    def run(self):
+        """Flusher thread: send each window as its deadline passes."""
+        while True:
+            with self.cond:
+                while not self.deadlines or self.deadlines[0][0] > time.monotonic():
+                    self.cond.wait(self.deadlines[0][0] - time.monotonic() if self.deadlines else None)
+                _, pending_key = heapq.heappop(self.deadlines)
+                stores = self.pending.pop(pending_key, None)
+            if stores:
+                self.deliver(pending_key, stores)
+
+    def deliver(self, pending_key, stores):
+        try:
+            self.send(pending_key[1], list(stores.items()))
+        except Exception as e:
+            logger.error(f'Error sending aggregated {pending_key[1]} alert: {e}')
+
+    def flush(self):
+        """Send everything still pending now (shutdown and tests)."""
+        with self.cond:
+            pending = list(self.pending.items())
+            self.pending.clear()
+            self.deadlines.clear()
+        for pending_key, stores in pending:
+            self.deliver(pending_key, stores)
@@ -0,0 +1,145 @@
+"""
+Shared SQLite access layer for the scraper (SScraper.py) and the web UI (webapp/web_ui.py).
+
+Connections are long-lived and configured for WAL journaling so web UI reads and scraper
+writes no longer block each other. The scraper keeps one connection per thread via
+get_connection(); the web UI borrows connections from a ConnectionPool per request because
+the Flask server may use a fresh thread for every request.
+"""
+import html
+import json
+import os
+import queue
+import re
+import sqlite3
+import threading
+import zlib
+
+DB_CACHE_SIZE_KB = int(os.getenv('DB_CACHE_SIZE_KB', '65536'))  # Page cache per connection (64 MB)
+DB_MMAP_SIZE = int(os.getenv('DB_MMAP_SIZE', str(256 * 1024 * 1024)))  # Memory-mapped I/O window (256 MB)
+DB_BUSY_TIMEOUT_MS = int(os.getenv('DB_BUSY_TIMEOUT_MS', '10000'))  # Wait this long for a competing writer
+DB_POOL_SIZE = int(os.getenv('DB_POOL_SIZE', '8'))  # Idle connections kept by a ConnectionPool
+RAW_JSON_COMPRESSION_LEVEL = int(os.getenv('RAW_JSON_COMPRESSION_LEVEL', '6'))  # zlib level for product_raw blobs
+BODY_TEXT_LIMIT = int(os.getenv('BODY_TEXT_LIMIT', '2000'))  # Characters of stripped body_html kept for full-text search
+
+_TAG_RE = re.compile(r'<[^>]+>')
+_SPACE_RE = re.compile(r'\s+')
+
+_local = threading.local()
+
+def configure_connection(conn):
+    """Apply the journaling and performance pragmas every connection to products.db should use."""
+    # Only takes effect on a new file (WAL would fix the mode first); maintenance.py converts older files with VACUUM
+    conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.execute(f'PRAGMA cache_size=-{DB_CACHE_SIZE_KB}')
+    conn.execute(f'PRAGMA mmap_size={DB_MMAP_SIZE}')
+    conn.execute(f'PRAGMA busy_timeout={DB_BUSY_TIMEOUT_MS}')
+    conn.execute('PRAGMA temp_store=MEMORY')
+    return conn
+
+def connect(db_path, row_factory=None):
+    """Open a new configured connection. The caller owns it and must close it."""
+    conn = sqlite3.connect(db_path, timeout=DB_BUSY_TIMEOUT_MS / 1000, check_same_thread=False)
+    if row_factory is not None:
+        conn.row_factory = row_factory
+    return configure_connection(conn)
+
+def get_connection(db_path, row_factory=None):
+    """Return the calling thread's long-lived connection to db_path, opening it on first use."""
+    conns = getattr(_local, 'conns', None)
+    if conns is None:
+        conns = _local.conns = {}
+    key = (os.path.abspath(db_path), row_factory)
+    conn = conns.get(key)
+    if conn is None:
+        conn = conns[key] = connect(db_path, row_factory)
+    return conn
+
+def close_connections():
+    """Close every connection opened by get_connection() on the calling thread."""
+    conns = getattr(_local, 'conns', None) or {}
+    for conn in conns.values():
+        try:
+            conn.close()
+        except Exception:
+            pass
+    conns.clear()
+
+class ConnectionPool:
+    """Bounded pool of configured connections to one database, for callers that don't own a long-lived thread."""
+
+    def __init__(self, db_path, row_factory=None, size=DB_POOL_SIZE):
+        self.db_path = db_path
+        self.row_factory = row_factory
+        self.idle = queue.LifoQueue(maxsize=size)
+
+    def acquire(self):
+        try:
+            return self.idle.get_nowait()
+        except queue.Empty:
+            return connect(self.db_path, self.row_factory)
+
+    def release(self, conn):
+        if conn.in_transaction:
+            conn.rollback()
+        try:
+            self.idle.put_nowait(conn)
+        except queue.Full:
+            conn.close()
+
+    def close(self):
+        while True:
+            try:
+                self.idle.get_nowait().close()
+            except queue.Empty:
+                break
+
+def project_product(product):
+    """Slim columns stored alongside each product row: (image_url, variant_count, tags, product_type)."""
+    image_url = None
+    images = product.get('images') or []
+    if images and isinstance(images[0], dict):
+        image_url = images[0].get('src')
+    tags = product.get('tags') or []
+    if isinstance(tags, list):
+        tags = ', '.join(str(t) for t in tags)
+    return image_url, len(product.get('variants') or []), tags, product.get('product_type') or ''
+
+def product_body_text(product):
+    """body_html with tags and entities stripped, whitespace collapsed and truncated to BODY_TEXT_LIMIT, for the search index."""
+    body = product.get('body_html') or ''
+    if not body:
+        return ''
+    text = html.unescape(_TAG_RE.sub(' ', body))
+    return _SPACE_RE.sub(' ', text).strip()[:BODY_TEXT_LIMIT]
+
+def fts_query(q):
+    """
+    Turn free text into an FTS5 MATCH expression: every word must match, as a prefix.
+    Words are quoted so user input can never be parsed as FTS5 syntax.
+    """
+    terms = re.findall(r'\w+', q)
+    return ' '.join('"' + t.replace('"', '""') + '"*' for t in terms)
+
+def change_seq(conn):
+    """
+    products change counter maintained by the triggers SScraper.init_db creates: it goes up on every insert, update
+    and delete from any process, so caches keyed on it are invalidated by scraper writes too. None on an old schema.
+    """
+    try:
+        row = conn.execute("SELECT value FROM db_meta WHERE key = 'change_seq'").fetchone()
+    except sqlite3.OperationalError:
+        return None
+    return row[0] if row else None
+
+def pack_json(value):
+    """Compress a JSON document (a dict or an already serialized string) for the product_raw table."""
+    if not isinstance(value, str):
+        value = json.dumps(value, separators=(',', ':'))
+    return zlib.compress(value.encode('utf-8'), RAW_JSON_COMPRESSION_LEVEL)
+
+def unpack_json(blob):
+    """Inverse of pack_json, returning the JSON text."""
+    return zlib.decompress(blob).decode('utf-8') if blob is not None else None
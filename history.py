@@ -0,0 +1,128 @@
+"""
+Price and availability history.
+
+product_events is an append-only, change-only log: a row is written only when a product first appears or its
+price or availability changes, so an unchanged catalog adds nothing per cycle. Rows are kept compact: the store is
+a small integer from the stores table and the time is integer epoch seconds. Two indexes cover the two query shapes,
+one product's series and everything in a time range.
+
+compact_events() is the retention job. Events older than HISTORY_RAW_DAYS are downsampled to at most one per product,
+store and day, keeping the first old value and the last new value of the day. Events older than HISTORY_KEEP_DAYS
+are deleted. It writes in batches of COMPACT_BATCH, one transaction each, so the scraper (which runs it on a
+background thread) holds db_lock for one batch at a time.
+"""
+import datetime
+import os
+import time
+from contextlib import nullcontext
+
+HISTORY_RAW_DAYS = int(os.getenv('HISTORY_RAW_DAYS', '30'))  # Keep every event this many days, then one per product per day
+HISTORY_KEEP_DAYS = int(os.getenv('HISTORY_KEEP_DAYS', '365'))  # Delete events older than this (0 keeps them forever)
+HISTORY_COMPACT_INTERVAL = float(os.getenv('HISTORY_COMPACT_INTERVAL', '21600'))  # Seconds between retention runs (6 hours, 0 disables)
+COMPACT_LOOKBACK_DAYS = 7  # Each run only downsamples days this close to the raw cutoff; older days were done by earlier runs
+COMPACT_BATCH = 1000  # Expired events, or product days merged, per transaction
+
+EVENT_INSERT_SQL = '''INSERT INTO product_events (product_id, store_id, ts, old_price, new_price, old_available, new_available)
+                      VALUES (?, ?, ?, ?, ?, ?, ?)'''
+
+def create_history_tables(c):
+    """Create the stores and product_events tables and their indexes (called from SScraper.init_db)."""
+    c.execute('''CREATE TABLE IF NOT EXISTS stores (
+        store_id INTEGER PRIMARY KEY,
+        input_url TEXT UNIQUE NOT NULL
+    )''')
+    c.execute('''CREATE TABLE IF NOT EXISTS product_events (
+        event_id INTEGER PRIMARY KEY,
+        product_id INTEGER NOT NULL,
+        store_id INTEGER NOT NULL,
+        ts INTEGER NOT NULL,  -- epoch seconds
+        old_price REAL,  -- NULL on a product's first event
+        new_price REAL,
+        old_available INTEGER,
+        new_available INTEGER
+    )''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_product_events_product ON product_events (product_id, store_id, ts)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_product_events_ts ON product_events (ts)')
+
+def store_id(conn, input_url):
+    """Integer id of input_url in the stores table, created on first use."""
+    conn.execute('INSERT OR IGNORE INTO stores (input_url) VALUES (?)', (input_url,))
+    return conn.execute('SELECT store_id FROM stores WHERE input_url = ?', (input_url,)).fetchone()[0]
+
+def compact_events(conn, now=None, raw_days=HISTORY_RAW_DAYS, keep_days=HISTORY_KEEP_DAYS, lock=None):
+    """
+    Retention job: drop events older than keep_days and merge each product's events older than raw_days into one
+    per day. Only the COMPACT_LOOKBACK_DAYS before the cutoff are scanned, so a run stays cheap on a large table.
+    Each COMPACT_BATCH is one transaction taken under lock. Returns (deleted, merged) row counts.
+    """
+    now = int(now or time.time())
+    lock = lock or nullcontext()
+    deleted = merged = 0
+    if keep_days:
+        while True:
+            with lock, conn:
+                n = conn.execute('''DELETE FROM product_events WHERE event_id IN
+                                    (SELECT event_id FROM product_events WHERE ts < ? LIMIT ?)''', (now - keep_days * 86400, COMPACT_BATCH)).rowcount
+            deleted += n
+            if n < COMPACT_BATCH:
+                break
+    cutoff = now - raw_days * 86400
+    # Days with more than one event for a product: keep the first event's old values and the last event's new values.
+    # Finding them only reads products.db (the temp table is this connection's own), so it runs without the lock.
+    conn.execute('DROP TABLE IF EXISTS temp.event_days')
+    conn.execute('''CREATE TEMP TABLE event_days AS
+        SELECT product_id, store_id, ts / 86400 AS day, MIN(event_id) AS first_id, MAX(event_id) AS last_id
+        FROM product_events WHERE ts >= ? AND ts < ?
+        GROUP BY product_id, store_id, ts / 86400 HAVING COUNT(*) > 1''', (cutoff - COMPACT_LOOKBACK_DAYS * 86400, cutoff))
+    conn.commit()
+    last_rowid = 0
+    while True:
+        days = conn.execute('SELECT rowid, product_id, store_id, day, first_id, last_id FROM temp.event_days WHERE rowid > ? ORDER BY rowid LIMIT ?',
+                            (last_rowid, COMPACT_BATCH)).fetchall()
+        if not days:
+            break
+        with lock, conn:
+            conn.executemany('''UPDATE product_events SET
+                    new_price = (SELECT new_price FROM product_events WHERE event_id = ?),
+                    new_available = (SELECT new_available FROM product_events WHERE event_id = ?)
+                WHERE event_id = ?''', [(last_id, last_id, first_id) for _, _, _, _, first_id, last_id in days])
+            merged += conn.executemany('''DELETE FROM product_events
+                WHERE product_id = ? AND store_id = ? AND ts >= ? AND ts < ? AND event_id != ?''',
+                [(product_id, store_id, day * 86400, (day + 1) * 86400, first_id) for _, product_id, store_id, day, first_id, _ in days]).rowcount
+        last_rowid = days[-1][0]
+    conn.execute('DROP TABLE temp.event_days')
+    return deleted, merged
+
+def availability_periods(events, now=None):
+    """
+    Turn a product's events (dicts with ts, new_available, in time order) into in-stock periods:
+    [{'start': ts, 'end': ts or None, 'seconds': int}], the open period (still in stock) last with end None.
+    """
+    now = int(now or time.time())
+    periods = []
+    start = None
+    for e in events:
+        if e['new_available'] and start is None:
+            start = e['ts']
+        elif not e['new_available'] and start is not None:
+            periods.append({'start': start, 'end': e['ts'], 'seconds': e['ts'] - start})
+            start = None
+    if start is not None:
+        periods.append({'start': start, 'end': None, 'seconds': now - start})
+    return periods
+
+def utc_iso(epoch):
+    return datetime.datetime.utcfromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S') if epoch is not None else None
+
+def parse_time(value):
+    """Epoch seconds from an API parameter given as epoch seconds or an ISO 8601 date/time (UTC if no offset). None if empty."""
+    if value in (None, ''):
+        return None
+    try:
+        return int(float(value))
+    except ValueError:
+        pass
+    dt = datetime.datetime.fromisoformat(value)
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=datetime.timezone.utc)
+    return int(dt.timestamp())
@@ -0,0 +1,184 @@
+"""
+Periodic products.db maintenance.
+
+run_maintenance() is the job SScraper runs every MAINTENANCE_INTERVAL on a background thread with its own connection
+(see SScraper.maybe_run_maintenance). Each write step takes the scraper's db_lock (the lock argument) only for a
+short transaction, so store workers keep writing between steps:
+
+- Products a store has not listed for STALE_PRODUCT_DAYS are moved to products_archive (or deleted). Deletes go
+  through the products triggers, so the search index and the change feed see them like any other delete.
+- Free pages are given back to the filesystem with incremental vacuum, VACUUM_STEP_PAGES at a time. A database
+  created before auto_vacuum was enabled (see db.configure_connection) needs one full VACUUM to convert. That holds
+  SQLite's write lock for the whole rewrite, longer than writers wait (DB_BUSY_TIMEOUT_MS) on a large file, so the
+  scheduled job only does it with MAINTENANCE_FULL_VACUUM=1; otherwise run it by hand with the scraper stopped.
+- PRAGMA optimize refreshes the query planner statistics (ANALYZE the first time), sampling at most ANALYSIS_LIMIT
+  rows per index so it stays short.
+- The size of every table and index is measured with the dbstat virtual table (a read, no lock) and logged.
+
+Run it by hand from the repo root with python maintenance.py [path/to/products.db] [--report | --vacuum].
+"""
+import argparse
+import datetime
+import logging
+import os
+import sqlite3
+import time
+from contextlib import nullcontext
+
+from db import connect
+
+MAINTENANCE_INTERVAL = float(os.getenv('MAINTENANCE_INTERVAL', '86400'))  # Seconds between maintenance runs (0 disables)
+STALE_PRODUCT_DAYS = float(os.getenv('STALE_PRODUCT_DAYS', '0'))  # Prune products no store has listed for this many days (0 keeps them)
+STALE_PRODUCT_ACTION = os.getenv('STALE_PRODUCT_ACTION', 'archive')  # archive: move them to products_archive; delete: drop them
+VACUUM_FREE_PERCENT = float(os.getenv('VACUUM_FREE_PERCENT', '10'))  # Reclaim free pages once they are this share of the file
+MAINTENANCE_FULL_VACUUM = os.getenv('MAINTENANCE_FULL_VACUUM', '0') == '1'  # Let the scheduled job convert an old file with a full VACUUM
+VACUUM_STEP_PAGES = 1000  # Free pages released per incremental_vacuum transaction
+ANALYSIS_LIMIT = 1000  # Rows ANALYZE samples per index
+PRUNE_BATCH = 1000  # Products archived per transaction, so the web UI and the scraper are not blocked for long
+
+logger = logging.getLogger('scraper')
+
+def ensure_archive_table(conn):
+    """
+    Create products_archive with the current products columns plus the compressed raw JSON and archived_at, and add
+    any products column added by a later migration.
+    """
+    columns = [(row[1], row[2]) for row in conn.execute('PRAGMA table_info(products)')]
+    archived = {row[1] for row in conn.execute('PRAGMA table_info(products_archive)')}
+    if not archived:
+        definitions = ', '.join(f'{name} {column_type}' for name, column_type in columns)
+        conn.execute(f'CREATE TABLE products_archive ({definitions}, json_z BLOB, archived_at TEXT, PRIMARY KEY (id, input_url))')
+    else:
+        for name, column_type in columns:
+            if name not in archived:
+                conn.execute(f'ALTER TABLE products_archive ADD COLUMN {name} {column_type}')
+    return [name for name, _ in columns]
+
+def prune_stale_products(conn, days=STALE_PRODUCT_DAYS, action=STALE_PRODUCT_ACTION, now=None, lock=None):
+    """
+    Archive or delete products whose last_seen is more than days old, PRUNE_BATCH per transaction, with their
+    product_raw rows. A pruned product a store lists again is stored (and alerted on) as new. Returns the rows removed.
+    """
+    if not days:
+        return 0
+    if action not in ('archive', 'delete'):
+        raise ValueError(f'STALE_PRODUCT_ACTION must be archive or delete, not {action}')
+    now = now or time.time()
+    # last_seen is SQLite's CURRENT_TIMESTAMP text (UTC); the comparison uses the idx_products_last_seen expression
+    cutoff = datetime.datetime.fromtimestamp(now - days * 86400, datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')
+    stale_sql = "SELECT rowid FROM products WHERE COALESCE(last_seen, '') < ? AND last_seen IS NOT NULL LIMIT ?"
+    lock = lock or nullcontext()
+    pruned = 0
+    with lock, conn:
+        columns = ensure_archive_table(conn) if action == 'archive' else None
+    while True:
+        with lock, conn:
+            rowids = [r[0] for r in conn.execute(stale_sql, (cutoff, PRUNE_BATCH)).fetchall()]
+            if not rowids:
+                break
+            marks = ', '.join('?' * len(rowids))
+            if columns:
+                names = ', '.join(columns)
+                selected = ', '.join(f'p.{c}' for c in columns)
+                conn.execute(f'''INSERT OR REPLACE INTO products_archive ({names}, json_z, archived_at)
+                                 SELECT {selected}, r.json_z, datetime('now') FROM products p
+                                 LEFT JOIN product_raw r ON r.id = p.id AND r.input_url = p.input_url
+                                 WHERE p.rowid IN ({marks})''', rowids)
+            conn.execute(f'''DELETE FROM product_raw WHERE (id, input_url) IN
+                             (SELECT id, input_url FROM products WHERE rowid IN ({marks}))''', rowids)
+            pruned += conn.execute(f'DELETE FROM products WHERE rowid IN ({marks})', rowids).rowcount
+    return pruned
+
+def reclaim_free_pages(conn, free_percent=VACUUM_FREE_PERCENT, lock=None, full_vacuum=MAINTENANCE_FULL_VACUUM):
+    """
+    Give free pages back once they make up free_percent of the file: PRAGMA incremental_vacuum in VACUUM_STEP_PAGES
+    steps, or, on a file not yet in auto_vacuum=INCREMENTAL and only with full_vacuum, a full VACUUM that converts it.
+    Returns the bytes reclaimed.
+    """
+    lock = lock or nullcontext()
+    page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+    pages = conn.execute('PRAGMA page_count').fetchone()[0]
+    free = conn.execute('PRAGMA freelist_count').fetchone()[0]
+    if not pages or free * 100 < pages * free_percent:
+        return 0
+    if conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2:
+        while free:
+            with lock:
+                conn.execute(f'PRAGMA incremental_vacuum({VACUUM_STEP_PAGES})').fetchall()
+                remaining = conn.execute('PRAGMA freelist_count').fetchone()[0]
+            if remaining >= free:
+                break
+            free = remaining
+    elif not full_vacuum:
+        logger.info(f'{free * page_size / 1048576:.1f} MB of products.db is free space; run python maintenance.py --vacuum '
+                    'with the scraper stopped to reclaim it and switch the file to incremental auto-vacuum')
+        return 0
+    else:
+        conn.execute('PRAGMA auto_vacuum=INCREMENTAL')
+        conn.execute('VACUUM')
+        # VACUUM may renumber the rowids of products (it has no INTEGER PRIMARY KEY), which products_fts points at
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone():
+            with conn:
+                conn.execute("INSERT INTO products_fts(products_fts) VALUES ('rebuild')")
+        logger.info('Converted products.db to incremental auto-vacuum')
+    return (pages - conn.execute('PRAGMA page_count').fetchone()[0]) * page_size
+
+def optimize(conn, lock=None):
+    """Refresh planner statistics: ANALYZE on a database that has none yet, PRAGMA optimize after that."""
+    with lock or nullcontext():
+        conn.execute(f'PRAGMA analysis_limit={ANALYSIS_LIMIT}')
+        if conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone():
+            conn.execute('PRAGMA optimize')
+        else:
+            conn.execute('ANALYZE')
+        conn.commit()
+
+def db_footprint(conn):
+    """
+    [{'name', 'kind' (table or index), 'table', 'bytes', 'pages'}] for every table and index, largest first, or []
+    when SQLite was built without the dbstat table.
+    """
+    try:
+        rows = conn.execute('''SELECT d.name, COALESCE(m.type, 'table'), COALESCE(m.tbl_name, d.name), SUM(d.pgsize), COUNT(*)
+                               FROM dbstat d LEFT JOIN sqlite_master m ON m.name = d.name
+                               GROUP BY d.name ORDER BY SUM(d.pgsize) DESC''').fetchall()
+    except sqlite3.OperationalError:
+        return []
+    return [{'name': name, 'kind': kind, 'table': table, 'bytes': size, 'pages': pages} for name, kind, table, size, pages in rows]
+
+def format_footprint(footprint):
+    lines = [f"{'name':<40} {'kind':<6} {'table':<24} {'MB':>9}"]
+    for row in footprint:
+        lines.append(f"{row['name']:<40} {row['kind']:<6} {row['table']:<24} {row['bytes'] / 1048576:9.2f}")
+    total = sum(row['bytes'] for row in footprint)
+    lines.append(f"{'total':<72} {total / 1048576:9.2f}")
+    return '\n'.join(lines)
+
+def run_maintenance(conn, stale_days=STALE_PRODUCT_DAYS, action=STALE_PRODUCT_ACTION, now=None, lock=None, full_vacuum=MAINTENANCE_FULL_VACUUM):
+    """
+    Prune stale products, reclaim free pages, refresh statistics and measure the file. lock is held around each write
+    step. Returns a summary dict.
+    """
+    start = time.monotonic()
+    pruned = prune_stale_products(conn, stale_days, action, now, lock)
+    reclaimed = reclaim_free_pages(conn, lock=lock, full_vacuum=full_vacuum)
+    optimize(conn, lock)
+    footprint = db_footprint(conn)
+    report = {'pruned': pruned, 'reclaimed_bytes': reclaimed, 'footprint': footprint, 'seconds': time.monotonic() - start}
+    total = sum(row['bytes'] for row in footprint)
+    largest = ', '.join(f"{row['name']} {row['bytes'] / 1048576:.1f} MB" for row in footprint[:5])
+    logger.info(f"DB maintenance {'archived' if action == 'archive' else 'deleted'} {pruned} stale products, reclaimed "
+                f"{reclaimed / 1048576:.1f} MB and took {report['seconds']:.1f}s; {total / 1048576:.1f} MB in use, largest: {largest}")
+    return report
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description='Run products.db maintenance, or only print its table and index sizes.')
+    parser.add_argument('db_path', nargs='?', default=os.path.join('data', 'products.db'))
+    parser.add_argument('--report', action='store_true', help='only print the table and index sizes')
+    parser.add_argument('--vacuum', action='store_true', help='allow the full VACUUM that converts an older file (stop the scraper first)')
+    args = parser.parse_args()
+    logging.basicConfig(level=logging.INFO, format='%(message)s')
+    conn = connect(args.db_path)
+    if not args.report:
+        run_maintenance(conn, full_vacuum=args.vacuum or MAINTENANCE_FULL_VACUUM)
+    print(format_footprint(db_footprint(conn)))
@@ -0,0 +1,378 @@
+"""
+Scraper metrics.
+
+Counters, gauges and histograms live in the scraper process and are served by start_metrics_server() on
+METRICS_PORT: /metrics in the Prometheus text format for scraping, and /metrics.json as a compact summary
+(histograms reduced to count, average and estimated quantiles) that the web UI's /api/metrics passes through,
+since the web UI runs as a separate process. With SCRAPER_PROCESSES > 1 every shard worker serves its own on
+METRICS_PORT + 1 + N, and the web UI adds them to the coordinator's with merge_summaries().
+
+Recording is meant for the hot loop: a labelled child is looked up in a dict and cached, and counters and histograms
+add to a per-thread cell without taking a lock (scrapes sum the cells). Callers only time work that is already
+expensive (a request, a write transaction, an actual classification). Values the scraper already keeps (queue depth, cache sizes) are
+exposed through callback metrics that are read at scrape time and cost nothing in between.
+"""
+import bisect
+import json
+import logging
+import math
+import os
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from threading import get_ident
+
+METRICS_PORT = int(os.getenv('METRICS_PORT', '9108'))  # Port of the scraper's /metrics endpoint (0 disables it)
+METRICS_HOST = os.getenv('METRICS_HOST', '127.0.0.1')  # Interface it listens on; 0.0.0.0 to scrape from another host
+
+# Seconds; covers a cached page (ms) up to a slow paged fetch
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SUMMARY_QUANTILES = (0.5, 0.95, 0.99)
+
+logger = logging.getLogger('scraper')
+
+class Registry:
+    """The metrics of one process, rendered in registration order."""
+
+    def __init__(self):
+        self.metrics = {}
+        self.lock = threading.Lock()
+
+    def register(self, metric):
+        with self.lock:
+            if metric.name in self.metrics:
+                raise ValueError(f'Metric {metric.name} is already registered')
+            self.metrics[metric.name] = metric
+
+    def render(self):
+        """Every metric in the Prometheus text exposition format (version 0.0.4)."""
+        lines = []
+        for metric in list(self.metrics.values()):
+            lines.append(f'# HELP {metric.name} {escape_help(metric.help)}')
+            lines.append(f'# TYPE {metric.name} {metric.type}')
+            for suffix, labels, value in metric.samples():
+                lines.append(f'{metric.name}{suffix}{format_labels(labels)} {format_value(value)}')
+        return '\n'.join(lines) + '\n'
+
+    def summary(self):
+        """
+        {name: {'type', 'help', 'series': [...]}} with histograms summarized by summarize_histogram. Histograms also
+        carry their bucket bounds and per-series bucket counts, so merge_summaries can combine processes exactly.
+        """
+        out = {}
+        for metric in list(self.metrics.values()):
+            out[metric.name] = {'type': metric.type, 'help': metric.help, 'series': metric.summary()}
+            if metric.type == 'histogram':
+                out[metric.name]['buckets'] = list(metric.buckets)
+        return {'generated_at': time.time(), 'metrics': out}
+
+REGISTRY = Registry()
+
+def escape_help(text):
+    return text.replace('\\', '\\\\').replace('\n', '\\n')
+
+def format_labels(labels):
+    if not labels:
+        return ''
+    escaped = ('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')) for k, v in labels)
+    return '{' + ','.join(escaped) + '}'
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value)
+
+class Metric:
+    """A named metric with optional labels; labels(*values) returns the child that holds one series."""
+
+    type = 'untyped'
+
+    def __init__(self, name, help, labelnames=(), registry=REGISTRY):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self.children = {}
+        self.lock = threading.Lock()
+        if registry is not None:
+            registry.register(self)
+
+    def labels(self, *values):
+        child = self.children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f'{self.name} expects labels {self.labelnames}, got {values}')
+            with self.lock:
+                child = self.children.setdefault(tuple(str(v) for v in values) if values else (), self.child())
+                self.children[values] = child
+        return child
+
+    def series(self):
+        """(label pairs, child) of each distinct series, first seen first."""
+        seen = set()
+        with self.lock:
+            items = list(self.children.items())
+        for values, child in items:
+            if id(child) in seen:
+                continue
+            seen.add(id(child))
+            yield tuple(zip(self.labelnames, (str(v) for v in values))), child
+
+    def summary(self):
+        return [{'labels': dict(labels), 'value': value} for _, labels, value in self.samples()]
+
+class CounterChild:
+    """
+    Each thread adds to its own cell, so inc() takes no lock; value sums the cells. A thread id reused after its
+    thread exits simply continues the old cell.
+    """
+
+    __slots__ = ('cells',)
+
+    def __init__(self):
+        self.cells = {}
+
+    def inc(self, amount=1):
+        cell = self.cells.get(get_ident())
+        if cell is None:
+            cell = self.cells.setdefault(get_ident(), [0])
+        cell[0] += amount
+
+    @property
+    def value(self):
+        return sum(cell[0] for cell in list(self.cells.values()))
+
+class Counter(Metric):
+    type = 'counter'
+    child = CounterChild
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for labels, child in self.series():
+            yield '', labels, child.value
+
+class GaugeChild:
+    __slots__ = ('value', 'lock')
+
+    def __init__(self):
+        self.value = 0
+        self.lock = threading.Lock()
+
+    def set(self, value):
+        self.value = value
+
+    def inc(self, amount=1):
+        with self.lock:
+            self.value += amount
+
+    def dec(self, amount=1):
+        self.inc(-amount)
+
+class Gauge(Metric):
+    type = 'gauge'
+    child = GaugeChild
+
+    def set(self, value):
+        self.labels().set(value)
+
+    def inc(self, amount=1):
+        self.labels().inc(amount)
+
+    def samples(self):
+        for labels, child in self.series():
+            yield '', labels, child.value
+
+class HistogramChild:
+    """Per-thread cells like CounterChild: each holds the count of every bucket (the last is +Inf) and then the sum."""
+
+    __slots__ = ('buckets', 'cells')
+
+    def __init__(self, buckets):
+        self.buckets = buckets
+        self.cells = {}
+
+    def observe(self, value):
+        cell = self.cells.get(get_ident())
+        if cell is None:
+            cell = self.cells.setdefault(get_ident(), [0] * (len(self.buckets) + 1) + [0.0])
+        cell[bisect.bisect_left(self.buckets, value)] += 1
+        cell[-1] += value
+
+    def time(self):
+        return Timer(self)
+
+    def snapshot(self):
+        """(per-bucket counts, sum, count) over every thread's cell."""
+        counts = [0] * (len(self.buckets) + 1)
+        total = 0.0
+        for cell in list(self.cells.values()):
+            for i in range(len(counts)):
+                counts[i] += cell[i]
+            total += cell[-1]
+        return counts, total, sum(counts)
+
+    @property
+    def count(self):
+        return self.snapshot()[2]
+
+class Timer:
+    """with histogram.time(): ... observes the block's duration in seconds."""
+
+    __slots__ = ('child', 'start')
+
+    def __init__(self, child):
+        self.child = child
+
+    def __enter__(self):
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.child.observe(time.perf_counter() - self.start)
+
+class Histogram(Metric):
+    type = 'histogram'
+
+    def __init__(self, name, help, labelnames=(), buckets=DEFAULT_BUCKETS, registry=REGISTRY):
+        self.buckets = tuple(sorted(float(b) for b in buckets))
+        super().__init__(name, help, labelnames, registry)
+
+    def child(self):
+        return HistogramChild(self.buckets)
+
+    def observe(self, value):
+        self.labels().observe(value)
+
+    def time(self):
+        return Timer(self.labels())
+
+    def samples(self):
+        for labels, child in self.series():
+            counts, total, count = child.snapshot()
+            cumulative = 0
+            for upper, n in zip(self.buckets + (math.inf,), counts):
+                cumulative += n
+                yield '_bucket', labels + (('le', format_value(upper)),), cumulative
+            yield '_sum', labels, total
+            yield '_count', labels, count
+
+    def summary(self):
+        out = []
+        for labels, child in self.series():
+            counts, total, count = child.snapshot()
+            out.append(dict({'labels': dict(labels), 'counts': counts}, **summarize_histogram(self.buckets, counts, total, count)))
+        return out
+
+def summarize_histogram(buckets, counts, total, count):
+    """count, sum, avg and p50/p95/p99 estimated by interpolating within the bucket that holds each quantile."""
+    summary = {'count': count, 'sum': total, 'avg': total / count if count else None}
+    for q in SUMMARY_QUANTILES:
+        summary[f'p{round(q * 100)}'] = histogram_quantile(q, buckets, counts) if count else None
+    return summary
+
+def histogram_quantile(q, buckets, counts):
+    rank = q * sum(counts)
+    cumulative = 0
+    for i, n in enumerate(counts):
+        if n and cumulative + n >= rank:
+            if i == len(buckets):
+                return buckets[-1]  # Beyond the last bucket the upper bound is unknown
+            lower = buckets[i - 1] if i else 0.0
+            return lower + (buckets[i] - lower) * (rank - cumulative) / n
+        cumulative += n
+    return buckets[-1]
+
+def merge_summaries(summaries):
+    """
+    One Registry.summary() out of several processes' (the sharded scraper's coordinator and workers): series with the
+    same labels are added up (histograms bucket by bucket, with the quantiles estimated again from the sums).
+    """
+    merged = {}
+    for summary in summaries:
+        for name, metric in summary.get('metrics', {}).items():
+            target = merged.setdefault(name, {'type': metric['type'], 'help': metric['help'], 'series': {}})
+            if 'buckets' in metric:
+                target['buckets'] = metric['buckets']
+            for series in metric['series']:
+                key = tuple(sorted(series['labels'].items()))
+                existing = target['series'].get(key)
+                if existing is None:
+                    target['series'][key] = dict(series)
+                elif 'counts' in series and 'counts' in existing:
+                    existing['counts'] = [a + b for a, b in zip(existing['counts'], series['counts'])]
+                    existing['sum'] += series['sum']
+                    existing['count'] += series['count']
+                elif 'value' in series:
+                    existing['value'] += series['value']
+    for metric in merged.values():
+        series = list(metric['series'].values())
+        if 'buckets' in metric:
+            for row in series:
+                if 'counts' in row:
+                    row.update(summarize_histogram(metric['buckets'], row['counts'], row['sum'], row['count']))
+        metric['series'] = series
+    generated = [summary['generated_at'] for summary in summaries if 'generated_at' in summary]
+    return {'generated_at': max(generated) if generated else time.time(), 'metrics': merged}
+
+class CallbackMetric(Metric):
+    """
+    A value read from fn() at scrape time. fn returns a number, or {label values tuple: number} when labelnames are
+    given. type is 'gauge' or 'counter'.
+    """
+
+    def __init__(self, name, help, fn, labelnames=(), type='gauge', registry=REGISTRY):
+        self.fn = fn
+        self.type = type
+        super().__init__(name, help, labelnames, registry)
+
+    def samples(self):
+        try:
+            values = self.fn()
+        except Exception as e:
+            logger.debug(f'Metric {self.name} callback failed: {e}')
+            return
+        if not self.labelnames:
+            values = {(): values}
+        for label_values, value in values.items():
+            yield '', tuple(zip(self.labelnames, (str(v) for v in label_values))), value
+
+class MetricsHandler(BaseHTTPRequestHandler):
+    registry = REGISTRY
+
+    def do_GET(self):
+        path = self.path.split('?', 1)[0]
+        if path == '/metrics':
+            body = self.registry.render().encode('utf-8')
+            content_type = 'text/plain; version=0.0.4; charset=utf-8'
+        elif path == '/metrics.json':
+            body = json.dumps(self.registry.summary()).encode('utf-8')
+            content_type = 'application/json'
+        else:
+            self.send_error(404)
+            return
+        self.send_response(200)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass  # Keep every scrape out of scraper.log
+
+def start_metrics_server(port=METRICS_PORT, host=METRICS_HOST, registry=REGISTRY):
+    """Serve registry on host:port from a daemon thread. Returns the server, or None if port is 0 or already in use."""
+    if not port:
+        return None
+    handler = type('MetricsHandler', (MetricsHandler,), {'registry': registry})
+    try:
+        server = ThreadingHTTPServer((host, port), handler)
+    except OSError as e:
+        logger.error(f'Could not serve metrics on {host}:{port}: {e}')
+        return None
+    server.daemon_threads = True
+    threading.Thread(target=server.serve_forever, name='Metrics server', daemon=True).start()
+    logger.info(f'Serving metrics on http://{host}:{port}/metrics')
+    return server
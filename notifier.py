@@ -0,0 +1,247 @@
+"""
+Background Discord webhook dispatcher.
+
+Store workers hand notification events to a bounded queue and carry on with change detection. One dispatcher
+thread drains the queue, packs up to NOTIFY_BATCH_SIZE embeds for the same webhook into one message (and no more than
+Discord's 6000 characters of embed text), and posts
+through a single pooled requests.Session. Discord's rate-limit headers are honoured per webhook: a message waits
+when X-RateLimit-Remaining hits 0 and is retried after a 429. Messages that still fail after NOTIFY_MAX_ATTEMPTS,
+or that Discord rejects outright, are written to the webhook_dead_letters table instead of being lost.
+"""
+import datetime
+import json
+import logging
+import os
+import queue
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+from db import get_connection
+from metrics import Counter, Histogram
+
+NOTIFY_QUEUE_SIZE = int(os.getenv('NOTIFY_QUEUE_SIZE', '1000'))  # Pending notifications before submit() blocks
+NOTIFY_QUEUE_TIMEOUT = float(os.getenv('NOTIFY_QUEUE_TIMEOUT', '5'))  # Seconds submit() blocks on a full queue before dead-lettering
+NOTIFY_BATCH_SIZE = min(int(os.getenv('NOTIFY_BATCH_SIZE', '10')), 10)  # Embeds per webhook message (Discord allows 10)
+NOTIFY_BATCH_WAIT = float(os.getenv('NOTIFY_BATCH_WAIT', '1'))  # Seconds to wait for more embeds before sending a partial batch
+NOTIFY_MAX_ATTEMPTS = int(os.getenv('NOTIFY_MAX_ATTEMPTS', '5'))  # Tries per message before it is dead-lettered
+NOTIFY_RETRY_BASE = float(os.getenv('NOTIFY_RETRY_BASE', '2'))  # Seconds before the first retry of a failed send; doubles per attempt
+NOTIFY_TIMEOUT = float(os.getenv('NOTIFY_TIMEOUT', '10'))  # Seconds per webhook request
+EMBED_TEXT_LIMIT = 6000  # Discord rejects a message whose embeds add up to more characters than this
+
+DEAD_LETTER_SQL = '''
+    INSERT INTO webhook_dead_letters (webhook_type, payload, status, error, attempts, created_at)
+    VALUES (?, ?, ?, ?, ?, ?)
+'''
+
+logger = logging.getLogger('scraper')
+
+WEBHOOK_SEND_SECONDS = Histogram('scraper_webhook_send_seconds', 'Time to deliver or give up on a webhook message, including rate-limit waits and retries', ('type',))
+WEBHOOK_DELAY_SECONDS = Histogram('scraper_webhook_delay_seconds', 'Time from queueing a notification to its delivery', ('type',),
+                                  buckets=(0.1, 0.5, 1, 2.5, 5, 10, 30, 60, 120, 300, 600))
+WEBHOOK_MESSAGES = Counter('scraper_webhook_messages_total', 'Webhook messages by outcome (sent or dead)', ('type', 'result'))
+
+def embed_length(embed):
+    """Characters of an embed that count towards EMBED_TEXT_LIMIT: title, description, field names and values, footer and author."""
+    size = len(embed.get('title') or '') + len(embed.get('description') or '')
+    for field in embed.get('fields') or ():
+        size += len(field.get('name') or '') + len(field.get('value') or '')
+    size += len((embed.get('footer') or {}).get('text') or '')
+    size += len((embed.get('author') or {}).get('name') or '')
+    return size
+
+class Notification:
+    """One queued message: an embed (dict) or plain content for a webhook."""
+
+    __slots__ = ('webhook_type', 'url', 'embed', 'content', 'queued_at')
+
+    def __init__(self, webhook_type, url, embed=None, content=None):
+        self.webhook_type = webhook_type
+        self.url = url
+        self.embed = embed
+        self.content = content
+        self.queued_at = time.monotonic()
+
+class WebhookDispatcher:
+    """Bounded queue of notifications drained by one background thread. Thread-safe; start() is idempotent."""
+
+    def __init__(self, db_path=None, batch_size=NOTIFY_BATCH_SIZE, batch_wait=NOTIFY_BATCH_WAIT, queue_size=NOTIFY_QUEUE_SIZE):
+        self.db_path = db_path
+        self.batch_size = batch_size
+        self.batch_wait = batch_wait
+        self.queue = queue.Queue(maxsize=queue_size)
+        self.pending = []  # Notifications taken off the queue but not yet sent (other webhooks' leftovers)
+        self.ready_at = {}  # webhook url -> monotonic time its rate-limit bucket refills
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=4, pool_maxsize=4)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+        self.thread = None
+        self.lock = threading.Lock()
+        self.stats = {'queued': 0, 'messages': 0, 'embeds': 0, 'retries': 0, 'dead': 0}
+
+    def start(self):
+        with self.lock:
+            if self.thread is None or not self.thread.is_alive():
+                self.thread = threading.Thread(target=self.run, name='Webhook dispatcher', daemon=True)
+                self.thread.start()
+
+    def submit(self, webhook_type, url, embed=None, content=None):
+        """Queue a notification. Returns False (and dead-letters it) if the queue stays full for NOTIFY_QUEUE_TIMEOUT."""
+        self.start()
+        item = Notification(webhook_type, url, embed, content)
+        try:
+            self.queue.put(item, timeout=NOTIFY_QUEUE_TIMEOUT)
+        except queue.Full:
+            logger.error(f'Notification queue is full, dead-lettering {webhook_type} notification')
+            self.dead_letter(webhook_type, self.payload([item]), None, 'queue full', 0)
+            return False
+        self.stats['queued'] += 1
+        return True
+
+    def flush(self, timeout=None):
+        """Block until every queued notification has been sent or dead-lettered. Returns False on timeout."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.queue.all_tasks_done:
+            while self.queue.unfinished_tasks:
+                remaining = deadline - time.monotonic() if deadline is not None else None
+                if remaining is not None and remaining <= 0:
+                    return False
+                self.queue.all_tasks_done.wait(remaining)
+        return True
+
+    def run(self):
+        while True:
+            batch = self.next_batch()
+            try:
+                self.send(batch)
+            except Exception as e:
+                logger.error(f'Webhook dispatcher error: {e}')
+            finally:
+                for _ in batch:
+                    self.queue.task_done()
+
+    def next_batch(self):
+        """
+        The oldest notification plus up to batch_size - 1 more embeds for the same webhook, waiting up to batch_wait
+        for them, as long as the embeds stay within EMBED_TEXT_LIMIT together. Plain content is always sent on its own.
+        """
+        first = self.pending.pop(0) if self.pending else self.queue.get()
+        batch = [first]
+        if first.embed is None:
+            return batch
+        size = embed_length(first.embed)
+        full = False
+        keep = []
+        for item in self.pending:
+            if not full and item.url == first.url and item.embed is not None:
+                if size + embed_length(item.embed) <= EMBED_TEXT_LIMIT:
+                    batch.append(item)
+                    size += embed_length(item.embed)
+                    full = len(batch) >= self.batch_size
+                    continue
+                full = True  # Keep the order: later embeds wait for the next message too
+            keep.append(item)
+        self.pending = keep
+        deadline = time.monotonic() + self.batch_wait
+        while not full and len(batch) < self.batch_size:
+            try:
+                item = self.queue.get(timeout=max(deadline - time.monotonic(), 0))
+            except queue.Empty:
+                break
+            if item.url == first.url and item.embed is not None and size + embed_length(item.embed) <= EMBED_TEXT_LIMIT:
+                batch.append(item)
+                size += embed_length(item.embed)
+            else:
+                self.pending.append(item)
+                full = item.url == first.url and item.embed is not None
+        return batch
+
+    @staticmethod
+    def payload(batch):
+        if batch[0].embed is None:
+            return {'content': batch[0].content}
+        return {'embeds': [item.embed for item in batch]}
+
+    def send(self, batch):
+        first = batch[0]
+        payload = self.payload(batch)
+        status = error = None
+        started = time.perf_counter()
+        for attempt in range(1, NOTIFY_MAX_ATTEMPTS + 1):
+            wait = self.ready_at.get(first.url, 0) - time.monotonic()
+            if wait > 0:
+                time.sleep(wait)
+            try:
+                resp = self.session.post(first.url, json=payload, timeout=NOTIFY_TIMEOUT)
+                status, error = resp.status_code, None
+            except requests.RequestException as e:
+                status, error = None, str(e)
+                resp = None
+            if resp is not None:
+                self.track_rate_limit(first.url, resp)
+            if status is not None and 200 <= status < 300:
+                self.stats['messages'] += 1
+                self.stats['embeds'] += len(payload.get('embeds', ()))
+                WEBHOOK_SEND_SECONDS.labels(first.webhook_type).observe(time.perf_counter() - started)
+                WEBHOOK_MESSAGES.labels(first.webhook_type, 'sent').inc()
+                queue_delay = WEBHOOK_DELAY_SECONDS.labels(first.webhook_type)
+                now = time.monotonic()
+                for item in batch:
+                    queue_delay.observe(now - item.queued_at)
+                return True
+            if status == 429:
+                logger.debug(f'Discord rate limited the {first.webhook_type} webhook, retrying (attempt {attempt})')
+            elif status == 400 and len(batch) > 1:
+                # One embed can make Discord reject the whole message: send them one by one so only that one is lost
+                logger.warning(f'Discord rejected a {first.webhook_type} message with {len(batch)} embeds, sending them separately: {resp.text[:200]}')
+                return all([self.send([item]) for item in batch])
+            elif status is not None and 400 <= status < 500:
+                # Malformed payload or a deleted webhook: retrying won't help
+                error = resp.text[:500]
+                break
+            else:
+                delay = NOTIFY_RETRY_BASE * 2 ** (attempt - 1) * random.uniform(1, 1.25)
+                self.ready_at[first.url] = max(self.ready_at.get(first.url, 0), time.monotonic() + delay)
+                logger.debug(f'{first.webhook_type} webhook failed ({status or error}), retrying in {delay:.1f}s')
+            self.stats['retries'] += 1
+        logger.error(f'Giving up on {first.webhook_type} webhook message with {len(batch)} notification(s): {status} {error or ""}')
+        WEBHOOK_SEND_SECONDS.labels(first.webhook_type).observe(time.perf_counter() - started)
+        self.dead_letter(first.webhook_type, payload, status, error, attempt)
+        return False
+
+    def track_rate_limit(self, url, resp):
+        """Remember when url's rate-limit bucket allows the next message, from Discord's headers or a 429 body."""
+        headers = resp.headers
+        wait = None
+        if resp.status_code == 429:
+            wait = headers.get('Retry-After')
+            if wait is None:
+                try:
+                    wait = resp.json().get('retry_after')
+                except ValueError:
+                    wait = None
+            wait = wait if wait is not None else NOTIFY_RETRY_BASE
+        elif headers.get('X-RateLimit-Remaining') == '0':
+            wait = headers.get('X-RateLimit-Reset-After')
+        try:
+            wait = float(wait) if wait is not None else None
+        except ValueError:
+            wait = None
+        if wait:
+            self.ready_at[url] = max(self.ready_at.get(url, 0), time.monotonic() + wait)
+
+    def dead_letter(self, webhook_type, payload, status, error, attempts):
+        self.stats['dead'] += 1
+        WEBHOOK_MESSAGES.labels(webhook_type, 'dead').inc()
+        if not self.db_path:
+            return
+        try:
+            conn = get_connection(self.db_path)
+            with conn:
+                conn.execute(DEAD_LETTER_SQL, (webhook_type, json.dumps(payload), status, error, attempts, datetime.datetime.now(datetime.timezone.utc).strftime('%Y-%m-%d %H:%M:%S')))
+        except Exception as e:
+            logger.error(f'Could not store dead-lettered {webhook_type} webhook: {e}')
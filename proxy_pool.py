@@ -0,0 +1,206 @@
+"""
+Shared proxy manager for every store the scraper polls.
+
+Each proxy (or the direct connection when PROXIES is empty) keeps success, latency and 429 statistics.
+Proxies that keep failing are circuit-broken for an increasing cooldown. A token bucket per proxy and host pair
+spaces out requests, and a 429 pauses that pair only. Requests go through one persistent requests.Session per
+proxy so connections are reused across pages, cycles and stores.
+"""
+import os
+import random
+import threading
+import time
+
+import requests
+from requests.adapters import HTTPAdapter
+
+PROXY_HOST_RATE = float(os.getenv('PROXY_HOST_RATE', '0.5'))  # Requests per second per proxy and host
+PROXY_HOST_BURST = float(os.getenv('PROXY_HOST_BURST', '3'))  # Requests a proxy and host pair may send back to back
+PROXY_FAILURE_THRESHOLD = int(os.getenv('PROXY_FAILURE_THRESHOLD', '3'))  # Consecutive failures that open a proxy's circuit
+PROXY_COOLDOWN = float(os.getenv('PROXY_COOLDOWN', '300'))  # Seconds a tripped proxy rests; doubles on every repeat trip
+PROXY_MAX_COOLDOWN = float(os.getenv('PROXY_MAX_COOLDOWN', '3600'))
+PROXY_429_COOLDOWN = float(os.getenv('PROXY_429_COOLDOWN', '180'))  # Seconds a proxy and host pair rests after a 429 without Retry-After
+PROXY_SESSION_POOL_SIZE = int(os.getenv('PROXY_SESSION_POOL_SIZE', '16'))  # Keep-alive connections per proxy session
+STATS_ALPHA = 0.2  # Weight of the newest request in the success and latency averages
+
+DIRECT = None  # Pool key of the direct connection
+
+class TokenBucket:
+    """Classic token bucket: rate tokens per second up to capacity. Not thread-safe; the owner holds a lock."""
+
+    def __init__(self, rate, capacity):
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.blocked_until = 0.0  # No tokens are handed out before this time (429 cooldown)
+
+    def refill(self, now):
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def wait_time(self, now):
+        """Seconds until a token is available (0 if one is available now)."""
+        self.refill(now)
+        wait = max(self.blocked_until - now, 0.0)
+        if self.tokens < 1:
+            wait = max(wait, (1 - self.tokens) / self.rate if self.rate > 0 else float('inf'))
+        return wait
+
+    def take(self, now):
+        self.refill(now)
+        self.tokens -= 1
+
+class ProxyStats:
+    """Health of one proxy across every host it is used for."""
+
+    def __init__(self, proxy):
+        self.proxy = proxy
+        self.requests = 0
+        self.successes = 0
+        self.failures = 0
+        self.throttled = 0  # 429 responses
+        self.success_rate = 1.0  # EWMA over recent requests
+        self.latency = 1.0  # EWMA seconds to response headers
+        self.consecutive_failures = 0
+        self.trips = 0
+        self.open_until = 0.0  # Circuit open (proxy skipped) until this time
+
+    def weight(self):
+        return max(self.success_rate, 0.05) / max(self.latency, 0.05)
+
+    def as_dict(self, now):
+        return {
+            'proxy': self.proxy or 'direct',
+            'requests': self.requests,
+            'successes': self.successes,
+            'failures': self.failures,
+            'throttled': self.throttled,
+            'success_rate': round(self.success_rate, 3),
+            'latency': round(self.latency, 3),
+            'circuit_open_for': round(max(self.open_until - now, 0), 1),
+        }
+
+class ProxyLease:
+    """One request's proxy choice: use lease.session, then report the outcome to the pool."""
+
+    def __init__(self, pool, proxy, host, session):
+        self.pool = pool
+        self.proxy = proxy
+        self.host = host
+        self.session = session
+        self.started = time.monotonic()
+
+    def report(self, status=None, error=None, retry_after=None):
+        self.pool.report(self, status=status, error=error, retry_after=retry_after)
+
+class ProxyPool:
+    """Weighted, rate-limited and circuit-broken proxy selection shared by all store workers."""
+
+    def __init__(self, proxies, host_rate=PROXY_HOST_RATE, host_burst=PROXY_HOST_BURST):
+        self.proxies = list(proxies) or [DIRECT]
+        self.host_rate = host_rate
+        self.host_burst = host_burst
+        self.stats = {p: ProxyStats(p) for p in self.proxies}
+        self.buckets = {}  # (proxy, host) -> TokenBucket
+        self.sessions = {}
+        self.lock = threading.Lock()
+
+    def bucket(self, proxy, host):
+        bucket = self.buckets.get((proxy, host))
+        if bucket is None:
+            bucket = self.buckets[(proxy, host)] = TokenBucket(self.host_rate, self.host_burst)
+        return bucket
+
+    def session(self, proxy):
+        session = self.sessions.get(proxy)
+        if session is None:
+            session = self.sessions[proxy] = requests.Session()
+            adapter = HTTPAdapter(pool_connections=PROXY_SESSION_POOL_SIZE, pool_maxsize=PROXY_SESSION_POOL_SIZE)
+            session.mount('http://', adapter)
+            session.mount('https://', adapter)
+            if proxy is not DIRECT:
+                session.proxies = {'http': f'http://{proxy}', 'https': f'https://{proxy}'}
+        return session
+
+    def choose(self, host):
+        """
+        Pick a proxy for host, weighted by success rate over latency among proxies whose circuit is closed and whose
+        bucket for host has a token. Returns (lease, 0) on success or (None, seconds until one could be available).
+        """
+        with self.lock:
+            now = time.monotonic()
+            ready = []
+            soonest = float('inf')
+            for proxy in self.proxies:
+                stats = self.stats[proxy]
+                wait = max(stats.open_until - now, self.bucket(proxy, host).wait_time(now))
+                if wait <= 0:
+                    ready.append(proxy)
+                else:
+                    soonest = min(soonest, wait)
+            if not ready:
+                return None, soonest
+            proxy = random.choices(ready, weights=[self.stats[p].weight() for p in ready])[0]
+            self.bucket(proxy, host).take(now)
+            self.stats[proxy].requests += 1
+            return ProxyLease(self, proxy, host, self.session(proxy)), 0.0
+
+    def acquire(self, host, max_wait=None):
+        """choose() that sleeps until a proxy is available, or returns None once max_wait seconds would be exceeded."""
+        deadline = time.monotonic() + max_wait if max_wait is not None else None
+        while True:
+            lease, wait = self.choose(host)
+            if lease is not None:
+                return lease
+            if deadline is not None and time.monotonic() + wait > deadline:
+                return None
+            time.sleep(wait)
+
+    def report(self, lease, status=None, error=None, retry_after=None):
+        """Record a request's outcome: 2xx/304 count as success, 429 pauses the proxy and host pair, anything else is a failure."""
+        latency = time.monotonic() - lease.started
+        with self.lock:
+            now = time.monotonic()
+            stats = self.stats[lease.proxy]
+            ok = error is None and status is not None and (200 <= status < 300 or status == 304)
+            if status == 429:
+                stats.throttled += 1
+                cooldown = retry_after if retry_after is not None else PROXY_429_COOLDOWN
+                bucket = self.bucket(lease.proxy, lease.host)
+                bucket.blocked_until = max(bucket.blocked_until, now + cooldown)
+            if error is None:
+                stats.latency += STATS_ALPHA * (latency - stats.latency)
+            stats.success_rate += STATS_ALPHA * ((1.0 if ok else 0.0) - stats.success_rate)
+            if ok:
+                stats.successes += 1
+                stats.consecutive_failures = 0
+                stats.trips = 0
+            elif status != 429:
+                stats.failures += 1
+                stats.consecutive_failures += 1
+                if stats.consecutive_failures >= PROXY_FAILURE_THRESHOLD:
+                    # Open (or, after a failed half-open trial, re-open) the circuit with an exponential cooldown
+                    stats.open_until = now + min(PROXY_COOLDOWN * 2 ** stats.trips, PROXY_MAX_COOLDOWN)
+                    stats.trips += 1
+
+    def available(self, host, exclude=()):
+        """Number of proxies (other than exclude) whose circuit is closed and that aren't paused for host."""
+        if not isinstance(exclude, (tuple, list, set)):
+            exclude = (exclude,)
+        with self.lock:
+            now = time.monotonic()
+            return sum(1 for p in self.proxies if p not in exclude and self.stats[p].open_until <= now and self.bucket(p, host).blocked_until <= now)
+
+    def snapshot(self):
+        with self.lock:
+            now = time.monotonic()
+            return [self.stats[p].as_dict(now) for p in self.proxies]
+
+def retry_after_seconds(headers):
+    """Retry-After header as seconds, or None when absent or given as an HTTP date."""
+    value = (headers or {}).get('Retry-After')
+    try:
+        return max(float(value), 0.0) if value is not None else None
+    except ValueError:
+        return None
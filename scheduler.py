@@ -0,0 +1,411 @@
+"""
+Adaptive polling schedule and per-host backoff shared by every store the scraper monitors.
+
+Each store's change rate (restocks/sell-outs, new products and updated listings per hour) is learned from the
+products table history at startup and then from every scan cycle. The polling interval is the time in which
+POLL_TARGET_CHANGES changes are expected, clamped to [POLL_MIN_INTERVAL, POLL_MAX_INTERVAL]: busy stores are
+polled often, quiet ones back off. The schedule is persisted to the store_schedule table so it survives restarts
+and the web UI can show which stores are due next.
+
+Rate limiting and backoff are per host (HostBackoff): a token bucket paces requests, and 429s or errors push the
+host's ready time out exponentially. Workers never sleep through a backoff; the fetch ends early and the store is
+rescheduled for when its host is ready, so the worker moves on to other stores. Backoff state is persisted to the
+host_backoff table.
+
+Both classes take a writer(kind, params) that, when given, receives each store_schedule ('schedule') or host_backoff
+('backoff') row instead of it being written here: a shard worker passes them to the coordinator's single writer.
+"""
+import datetime
+import heapq
+import math
+import os
+import random
+import threading
+import time
+
+from db import get_connection
+from proxy_pool import TokenBucket
+
+POLL_MIN_INTERVAL = float(os.getenv('POLL_MIN_INTERVAL', '120'))  # Seconds between polls of the busiest stores
+POLL_MAX_INTERVAL = float(os.getenv('POLL_MAX_INTERVAL', '900'))  # Seconds between polls of stores that never change
+POLL_DEFAULT_INTERVAL = float(os.getenv('POLL_DEFAULT_INTERVAL', '300'))  # Interval for stores without any history
+POLL_TARGET_CHANGES = float(os.getenv('POLL_TARGET_CHANGES', '1'))  # Expected changes per poll the interval aims for
+CHANGE_RATE_HALF_LIFE = float(os.getenv('CHANGE_RATE_HALF_LIFE', '3600'))  # Seconds for an observation to lose half its weight
+CHANGE_HISTORY_HOURS = float(os.getenv('CHANGE_HISTORY_HOURS', '168'))  # History window used to seed rates at startup
+POLL_JITTER = 0.1  # +/- fraction applied to each interval so stores don't fall into lockstep
+HOST_RATE = float(os.getenv('HOST_RATE', '0.2'))  # Requests per second to one host, across proxies and stores
+HOST_BURST = float(os.getenv('HOST_BURST', '3'))
+PAGE_JITTER = float(os.getenv('PAGE_JITTER', '2'))  # Up to this many random seconds added to each paced request
+MAX_INLINE_WAIT = float(os.getenv('MAX_INLINE_WAIT', '10'))  # Longer waits end the fetch and reschedule the store instead
+BACKOFF_BASE = float(os.getenv('BACKOFF_BASE', '180'))  # First backoff after a 429 or error, doubled per consecutive failure
+BACKOFF_MAX = float(os.getenv('BACKOFF_MAX', '1800'))
+BACKOFF_429_LIMIT = 5  # Consecutive 429s after which a host rests for BACKOFF_MAX
+
+# Weight of each kind of change in a store's rate: availability flips are what alerts are about
+FLIP_WEIGHT = 1.0
+NEW_WEIGHT = 1.0
+UPDATE_WEIGHT = 0.5
+
+HISTORY_SQL = '''SELECT
+        SUM(COALESCE(datetime(became_available_at) > datetime('now', :window), 0)
+            + COALESCE(datetime(became_unavailable_at) > datetime('now', :window), 0)),
+        SUM(COALESCE(datetime(date_added) > datetime('now', :window)
+            AND datetime(date_added) > datetime(first_seen.t, '+1 hour'), 0)),
+        SUM(COALESCE(datetime(updated_at) > datetime('now', :window), 0))
+    FROM products, (SELECT MIN(date_added) AS t FROM products WHERE input_url = :url) AS first_seen
+    WHERE input_url = :url'''
+SCHEDULE_UPSERT_SQL = '''INSERT INTO store_schedule (input_url, interval_seconds, change_rate, next_due_at, last_polled_at, last_changes, polls)
+                         VALUES (?, ?, ?, ?, ?, ?, ?)
+                         ON CONFLICT(input_url) DO UPDATE SET
+                            interval_seconds=excluded.interval_seconds,
+                            change_rate=excluded.change_rate,
+                            next_due_at=excluded.next_due_at,
+                            last_polled_at=excluded.last_polled_at,
+                            last_changes=excluded.last_changes,
+                            polls=excluded.polls'''
+BACKOFF_UPSERT_SQL = '''INSERT INTO host_backoff (host, throttled, failures, backoff_seconds, ready_at, last_status, updated_at)
+                        VALUES (?, ?, ?, ?, ?, ?, CURRENT_TIMESTAMP)
+                        ON CONFLICT(host) DO UPDATE SET
+                           throttled=excluded.throttled,
+                           failures=excluded.failures,
+                           backoff_seconds=excluded.backoff_seconds,
+                           ready_at=excluded.ready_at,
+                           last_status=excluded.last_status,
+                           updated_at=CURRENT_TIMESTAMP'''
+
+def change_score(flips=0, new=0, updated=0):
+    """Weighted number of changes seen in one scan cycle."""
+    return flips * FLIP_WEIGHT + new * NEW_WEIGHT + updated * UPDATE_WEIGHT
+
+def interval_for_rate(rate_per_hour, min_interval=POLL_MIN_INTERVAL, max_interval=POLL_MAX_INTERVAL):
+    """Seconds in which POLL_TARGET_CHANGES changes are expected at rate_per_hour, clamped to the bounds."""
+    if rate_per_hour is None:
+        return min(max(POLL_DEFAULT_INTERVAL, min_interval), max_interval)
+    if rate_per_hour <= 0:
+        return max_interval
+    return min(max(POLL_TARGET_CHANGES * 3600 / rate_per_hour, min_interval), max_interval)
+
+def history_rate(conn, url, hours=CHANGE_HISTORY_HOURS):
+    """Weighted changes per hour for url over the last hours, from the products table, or None without history."""
+    row = conn.execute(HISTORY_SQL, {'url': url, 'window': f'-{hours} hours'}).fetchone()
+    if row is None or row[0] is None:
+        return None
+    flips, new, updated = (v or 0 for v in row)
+    return change_score(flips, new, updated) / hours
+
+def utc_iso(epoch):
+    return datetime.datetime.utcfromtimestamp(epoch).strftime('%Y-%m-%d %H:%M:%S')
+
+class StoreSchedule:
+    """Polling state of one store."""
+
+    def __init__(self, url, rate=None):
+        self.url = url
+        self.rate = rate  # Weighted changes per hour, None until known
+        self.interval = interval_for_rate(rate)
+        self.due_at = time.time()
+        self.last_polled_at = None
+        self.last_changes = 0.0
+        self.polls = 0
+        self.running = False
+
+    def as_dict(self):
+        return {
+            'input_url': self.url,
+            'interval_seconds': round(self.interval, 1),
+            'change_rate': round(self.rate, 4) if self.rate is not None else None,
+            'next_due_at': utc_iso(self.due_at),
+            'last_polled_at': utc_iso(self.last_polled_at) if self.last_polled_at else None,
+            'last_changes': self.last_changes,
+            'polls': self.polls,
+            'running': self.running,
+        }
+
+class StoreScheduler:
+    """
+    Due-time queue of stores. Worker threads call next_due() to take the store whose poll is due first and
+    record() when the cycle finishes, which updates the store's change rate and puts it back on the queue.
+    """
+
+    def __init__(self, db_path=None, min_interval=POLL_MIN_INTERVAL, max_interval=POLL_MAX_INTERVAL, writer=None):
+        self.db_path = db_path
+        self.writer = writer
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.stores = {}
+        self.heap = []  # (due_at, url); stale entries are skipped when popped
+        self.cond = threading.Condition()
+
+    def add(self, url, rate=None, due_at=None, stagger=0.0):
+        """
+        Schedule url. The rate comes from the persisted schedule if there is one, else from products history.
+        stagger spreads the first polls out over that many seconds, including stores that became due while stopped.
+        """
+        entry = StoreSchedule(url, rate)
+        if rate is None and self.db_path:
+            entry.rate, persisted_due = self.load(url)
+            entry.interval = self.bounded(interval_for_rate(entry.rate, self.min_interval, self.max_interval))
+            if due_at is None and persisted_due is not None:
+                due_at = persisted_due
+        entry.due_at = max(due_at or 0, time.time() + random.uniform(0, stagger))
+        with self.cond:
+            self.stores[url] = entry
+            heapq.heappush(self.heap, (entry.due_at, url))
+            self.cond.notify()
+        return entry
+
+    def load(self, url):
+        """(rate, due_at) for url from store_schedule, falling back to history_rate when the store was never scheduled."""
+        conn = get_connection(self.db_path)
+        row = conn.execute("SELECT change_rate, strftime('%s', next_due_at) FROM store_schedule WHERE input_url = ?", (url,)).fetchone()
+        if row is not None and row[0] is not None:
+            return row[0], float(row[1]) if row[1] is not None else None
+        return history_rate(conn, url), None
+
+    def bounded(self, interval):
+        return min(max(interval, self.min_interval), self.max_interval)
+
+    def next_due(self, timeout=None):
+        """Block until a store is due and return its url (marked running), or None after timeout seconds or once no store is left."""
+        deadline = time.monotonic() + timeout if timeout is not None else None
+        with self.cond:
+            while True:
+                if not self.stores:
+                    return None
+                while self.heap:
+                    due_at, url = self.heap[0]
+                    entry = self.stores.get(url)
+                    if entry is None or entry.running or entry.due_at != due_at:
+                        heapq.heappop(self.heap)  # removed, already taken or rescheduled
+                        continue
+                    break
+                wait = None
+                if self.heap:
+                    wait = self.heap[0][0] - time.time()
+                    if wait <= 0:
+                        _, url = heapq.heappop(self.heap)
+                        self.stores[url].running = True
+                        return url
+                if deadline is not None:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        return None
+                    wait = remaining if wait is None else min(wait, remaining)
+                self.cond.wait(wait)
+
+    def record(self, url, changes, polled_at=None, not_before=None):
+        """
+        Fold a finished cycle's weighted change count into url's rate and schedule its next poll, no earlier than
+        not_before (epoch seconds, e.g. when the store's host is backing off). Returns seconds until the next poll.
+        """
+        polled_at = polled_at or time.time()
+        with self.cond:
+            entry = self.stores.get(url) or StoreSchedule(url)
+            self.stores[url] = entry
+            if entry.last_polled_at is not None:
+                elapsed = max(polled_at - entry.last_polled_at, 1.0)
+                observed = changes * 3600 / elapsed
+                if entry.rate is None:
+                    entry.rate = observed
+                else:
+                    # Time-weighted EWMA: a long gap counts for more than a quick re-poll
+                    alpha = 1 - math.exp(-math.log(2) * elapsed / CHANGE_RATE_HALF_LIFE)
+                    entry.rate += alpha * (observed - entry.rate)
+            # The first cycle after startup is measured against a DB snapshot of unknown age, so it only sets the baseline
+            entry.last_polled_at = polled_at
+            entry.last_changes = changes
+            entry.polls += 1
+            entry.interval = self.bounded(interval_for_rate(entry.rate, self.min_interval, self.max_interval))
+            due_at = polled_at + entry.interval * random.uniform(1 - POLL_JITTER, 1 + POLL_JITTER)
+            self.reschedule_locked(entry, max(due_at, not_before or 0))
+            delay = entry.due_at - polled_at
+        self.persist(entry)
+        return delay
+
+    def reschedule_locked(self, entry, due_at):
+        entry.due_at = due_at
+        entry.running = False
+        heapq.heappush(self.heap, (due_at, entry.url))
+        self.cond.notify()
+
+    def reschedule(self, url, delay):
+        """Put url back on the queue delay seconds from now without touching its rate (errors, manual pokes)."""
+        with self.cond:
+            entry = self.stores.get(url)
+            if entry is None:
+                return
+            self.reschedule_locked(entry, time.time() + delay)
+        self.persist(entry)
+
+    def remove(self, url):
+        with self.cond:
+            self.stores.pop(url, None)
+            self.cond.notify()
+
+    def persist(self, entry):
+        if not self.db_path and self.writer is None:
+            return
+        row = entry.as_dict()
+        params = (row['input_url'], row['interval_seconds'], row['change_rate'], row['next_due_at'], row['last_polled_at'], row['last_changes'], row['polls'])
+        if self.writer is not None:
+            self.writer('schedule', params)
+            return
+        conn = get_connection(self.db_path)
+        with conn:
+            conn.execute(SCHEDULE_UPSERT_SQL, params)
+
+    def snapshot(self):
+        """Every scheduled store as a dict, next due first."""
+        with self.cond:
+            entries = sorted(self.stores.values(), key=lambda e: e.due_at)
+            return [e.as_dict() for e in entries]
+
+class HostState:
+    """Pacing and backoff of one host."""
+
+    def __init__(self, host, rate=HOST_RATE, burst=HOST_BURST):
+        self.host = host
+        self.bucket = TokenBucket(rate, burst)
+        self.throttled = 0  # Consecutive 429s
+        self.failures = 0  # Consecutive errors other than 429
+        self.backoff = 0.0  # Seconds of the current backoff
+        self.ready_at = 0.0  # Epoch seconds before which the host must not be contacted
+        self.last_status = None
+
+    def as_dict(self, now=None):
+        now = now or time.time()
+        return {
+            'host': self.host,
+            'throttled': self.throttled,
+            'failures': self.failures,
+            'backoff_seconds': round(self.backoff, 1),
+            'ready_at': utc_iso(self.ready_at) if self.ready_at > now else None,
+            'last_status': self.last_status,
+        }
+
+class HostBackoff:
+    """
+    Per-host token buckets and exponential backoff shared by all workers. wait() says how long a request to a host
+    must wait; throttled()/failed() push the host's ready time out and succeeded() resets it.
+    """
+
+    def __init__(self, db_path=None, rate=HOST_RATE, burst=HOST_BURST, writer=None):
+        self.db_path = db_path
+        self.writer = writer
+        self.rate = rate
+        self.burst = burst
+        self.hosts = {}
+        self.lock = threading.Lock()
+        self.loaded = False
+
+    def state(self, host):
+        state = self.hosts.get(host)
+        if state is None:
+            state = self.hosts[host] = HostState(host, self.rate, self.burst)
+        return state
+
+    def load(self):
+        """Restore backoffs that were still running when the scraper stopped."""
+        if not self.db_path:
+            return
+        rows = get_connection(self.db_path).execute(
+            "SELECT host, throttled, failures, backoff_seconds, strftime('%s', ready_at), last_status FROM host_backoff").fetchall()
+        with self.lock:
+            for host, throttled, failures, backoff, ready_at, last_status in rows:
+                state = self.state(host)
+                state.throttled, state.failures, state.backoff, state.last_status = throttled or 0, failures or 0, backoff or 0.0, last_status
+                state.ready_at = float(ready_at) if ready_at else 0.0
+
+    def ready_at(self, host):
+        """Epoch seconds when host may be contacted again (in the past when it is not backing off)."""
+        with self.lock:
+            return self.state(host).ready_at
+
+    def wait(self, host):
+        """Seconds until a request to host is allowed: the remaining backoff or the time to the next token."""
+        with self.lock:
+            state = self.state(host)
+            return max(state.ready_at - time.time(), state.bucket.wait_time(time.monotonic()))
+
+    def try_acquire(self, host):
+        """Take a request slot for host if one is free. Returns 0 on success, else the seconds to wait (nothing taken)."""
+        with self.lock:
+            state = self.state(host)
+            now = time.monotonic()
+            wait = max(state.ready_at - time.time(), state.bucket.wait_time(now))
+            if wait <= 0:
+                state.bucket.take(now)
+                return 0.0
+            return wait
+
+    def acquire(self, host, max_wait=MAX_INLINE_WAIT):
+        """
+        Take a request slot for host, sleeping up to max_wait seconds (plus PAGE_JITTER) for it.
+        Returns False without waiting when the host needs longer; the caller should give up and reschedule.
+        """
+        while True:
+            wait = self.try_acquire(host)
+            if wait <= 0:
+                break
+            if wait > max_wait:
+                return False
+            time.sleep(wait)
+        if PAGE_JITTER > 0:
+            time.sleep(random.uniform(0, PAGE_JITTER))
+        return True
+
+    def throttled(self, host, retry_after=None):
+        """Record a 429. Returns the backoff in seconds."""
+        with self.lock:
+            state = self.state(host)
+            state.throttled += 1
+            state.last_status = 429
+            if state.throttled >= BACKOFF_429_LIMIT:
+                backoff = BACKOFF_MAX
+                state.throttled = 0
+            else:
+                backoff = min(BACKOFF_BASE * 2 ** (state.throttled - 1), BACKOFF_MAX)
+            backoff = max(backoff * random.uniform(1, 1.1), retry_after or 0)
+            return self.back_off_locked(state, backoff)
+
+    def failed(self, host, status=None):
+        """Record an error response or exception (status None). Returns the backoff in seconds."""
+        with self.lock:
+            state = self.state(host)
+            state.failures += 1
+            state.last_status = status
+            backoff = min(BACKOFF_BASE * 2 ** (state.failures - 1), BACKOFF_MAX) * random.uniform(1, 1.1)
+            return self.back_off_locked(state, backoff)
+
+    def back_off_locked(self, state, backoff):
+        state.backoff = backoff
+        state.ready_at = max(state.ready_at, time.time() + backoff)
+        self.persist(state)
+        return backoff
+
+    def succeeded(self, host, status=200):
+        with self.lock:
+            state = self.state(host)
+            recovering = state.throttled or state.failures or state.backoff
+            state.throttled = state.failures = 0
+            state.backoff = 0.0
+            state.last_status = status
+            if recovering:
+                self.persist(state)
+
+    def persist(self, state):
+        if not self.db_path and self.writer is None:
+            return
+        row = state.as_dict()
+        params = (row['host'], row['throttled'], row['failures'], row['backoff_seconds'], row['ready_at'], row['last_status'])
+        if self.writer is not None:
+            self.writer('backoff', params)
+            return
+        conn = get_connection(self.db_path)
+        with conn:
+            conn.execute(BACKOFF_UPSERT_SQL, params)
+
+    def snapshot(self):
+        with self.lock:
+            now = time.time()
+            return [s.as_dict(now) for s in self.hosts.values()]
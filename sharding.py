@@ -0,0 +1,38 @@
+"""
+Store sharding across worker processes.
+
+With SCRAPER_PROCESSES > 1, SScraper runs as a coordinator and that many shard worker processes. Stores are assigned
+to shards on a consistent hash ring keyed by host, so every store of a host lands in the same process (HostBackoff
+pacing is per process) and changing the number of processes only moves about 1/N of the hosts. Workers fetch,
+parse, classify and run change detection; the coordinator owns the single batched SQLite writer and the webhook
+dispatcher, and applies what workers send over a multiprocessing queue (see SScraper.run_sharded_engine).
+"""
+import bisect
+import hashlib
+import os
+
+SCRAPER_PROCESSES = int(os.getenv('SCRAPER_PROCESSES', '0'))  # Shard worker processes; 0 or 1 runs everything in one process
+SHARD_VNODES = int(os.getenv('SHARD_VNODES', '160'))  # Ring points per shard; more points spread hosts more evenly
+SHARD_QUEUE_SIZE = int(os.getenv('SHARD_QUEUE_SIZE', '1000'))  # Messages workers may queue before they block on the coordinator
+SHARD_RESTART_DELAY = float(os.getenv('SHARD_RESTART_DELAY', '30'))  # Seconds before a crashed shard worker is restarted
+
+def hash64(value):
+    return int.from_bytes(hashlib.blake2b(str(value).encode('utf-8'), digest_size=8).digest(), 'big')
+
+class HashRing:
+    """Consistent hash ring: each node owns vnodes points, and a key belongs to the first point at or after its hash."""
+
+    def __init__(self, nodes, vnodes=SHARD_VNODES):
+        self.points = sorted((hash64(f'{node}#{i}'), node) for node in nodes for i in range(vnodes))
+        self.hashes = [h for h, _ in self.points]
+
+    def node_for(self, key):
+        i = bisect.bisect_left(self.hashes, hash64(key))
+        return self.points[i % len(self.points)][1]
+
+    def partition(self, items, key=str):
+        """{node: [item, ...]} for every node that owns at least one item, keeping the items' order."""
+        shards = {}
+        for item in items:
+            shards.setdefault(self.node_for(key(item)), []).append(item)
+        return shards
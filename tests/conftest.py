@@ -0,0 +1,8 @@
+import os
+import tempfile
+
+# Importing SScraper opens logs/scraper.log; keep the test runs' log out of the tree
+os.environ.setdefault('LOG_DIR', tempfile.mkdtemp(prefix='scraper-test-logs-'))
+# The scheduled maintenance and history retention threads would otherwise start on the first scan of a test and race later tests
+os.environ.setdefault('MAINTENANCE_INTERVAL', '0')
+os.environ.setdefault('HISTORY_COMPACT_INTERVAL', '0')
@@ -33,3 +33,13 @@ def test_soda_detection():
 def test_other_detection():
     product = {'title': 'Mystery Drink', 'product_type': '', 'body_html': '', 'tags': []}
     assert get_alcohol_type(product) == 'Other'
+
+def test_memo_skips_unchanged_products():
+    import SScraper
+    product = {'id': 987654321, 'updated_at': '2025-01-01', 'title': 'Rare Bourbon', 'product_type': '', 'body_html': '', 'tags': []}
+    assert get_alcohol_type(product) == 'Bourbon'
+    # Same id and updated_at: served from the memo without rescanning the text
+    assert get_alcohol_type(dict(product, title='Vodka')) == 'Bourbon'
+    # A newer updated_at is reclassified
+    assert get_alcohol_type(dict(product, title='Vodka', updated_at='2025-01-02')) == 'Vodka'
+    assert (987654321, '2025-01-02') in SScraper.ALCOHOL_TYPE_MEMO
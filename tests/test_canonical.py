@@ -0,0 +1,113 @@
+import os
+import sys
+import sqlite3
+import threading
+import pytest
+
+# Ensure SScraper.py and canonical.py are importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import SScraper
+from canonical import CanonicalIndex, AlertAggregator, canonical_key
+from test_db_writer import make_product
+
+OTHER = 'https://other.example/'
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'products.db')
+    monkeypatch.setattr(SScraper, 'DB_PATH', path)
+    monkeypatch.setattr(SScraper, 'CANONICAL', CanonicalIndex())
+    SScraper.ALCOHOL_TYPE_MEMO.clear()
+    SScraper.init_db()
+    return path
+
+def test_same_bottle_gets_the_same_key():
+    a = make_product(1, title='Distillery Rare Bourbon')
+    b = make_product(2, title='Rare  Bourbon!')
+    b['vendor'] = 'DISTILLERY'
+    assert canonical_key(a) == canonical_key(b)
+    # A different size is a different product
+    c = make_product(3, title='Rare Bourbon')
+    c['variants'][0]['title'] = '1.75L'
+    assert canonical_key(c) != canonical_key(a)
+    # A barcode wins over the name
+    a['variants'][0]['barcode'] = '0012345678905'
+    c['variants'][0]['barcode'] = '12345678905'
+    assert canonical_key(a) == canonical_key(c) == 'gtin:12345678905'
+    assert canonical_key({'title': ''}) is None
+
+def test_skus_and_bad_barcodes_are_not_gtins():
+    # Unrelated products that share a numeric store SKU
+    bourbon = make_product(1, title="Blanton's Single Barrel Bourbon")
+    vodka = make_product(2, title="Tito's Handmade Vodka")
+    bourbon['variants'][0]['sku'] = vodka['variants'][0]['sku'] = '10000001'
+    assert canonical_key(bourbon) != canonical_key(vodka)
+    assert canonical_key(bourbon).startswith('name:')
+    # A barcode with a wrong check digit is ignored too
+    bourbon['variants'][0]['barcode'] = '012345678904'
+    assert canonical_key(bourbon).startswith('name:')
+
+def test_classification_and_image_are_shared_across_stores(db, monkeypatch):
+    calls = []
+    classify = SScraper.classify_alcohol_type
+    monkeypatch.setattr(SScraper, 'classify_alcohol_type', lambda product, keywords: calls.append(product['id']) or classify(product, keywords))
+    first = make_product(1)
+    second = make_product(7)
+    second['images'] = []
+    assert SScraper.get_alcohol_type(first) == SScraper.get_alcohol_type(second) == 'Bourbon'
+    assert calls == [1]
+    for url, p in (('https://store.example/', first), (OTHER, second)):
+        batch = SScraper.ProductWriteBatch(url)
+        batch.add_product(p['id'], p['handle'], p['title'], True, p)
+        batch.flush()
+    rows = sqlite3.connect(db).execute('SELECT input_url, image_url, canonical_key FROM products ORDER BY input_url').fetchall()
+    assert rows[0][1] == rows[1][1] == 'https://cdn.example/1.jpg'
+    assert rows[0][2] == rows[1][2] == canonical_key(first)
+
+def test_alerts_are_merged_across_stores(db, monkeypatch):
+    sent = []
+    aggregator = AlertAggregator(lambda event_type, stores: sent.append((event_type, [url for url, _ in stores])), window=60)
+    monkeypatch.setattr(SScraper, 'AGGREGATE_ALERTS', True)
+    monkeypatch.setattr(SScraper, 'ALERT_AGGREGATOR', aggregator)
+    monkeypatch.setattr(SScraper, 'send_webhook_notification', lambda product, url, event_type: sent.append((event_type, url)))
+    states = [SScraper.StoreState(url) for url in ('https://store.example/', OTHER)]
+    for state in states:
+        SScraper.process_products(state, [make_product(1, available=False)])
+    for state in states:
+        SScraper.process_products(state, [make_product(1, available=True), make_product(2, title='Wheated Bourbon', available=True)])
+    # Both restocks are held for the window (product 2 is new, but a store's first scan only seeds the DB)
+    assert sent == []
+    aggregator.flush()
+    assert sent == [('available', ['https://store.example/', OTHER])]
+
+def test_alert_windows_share_one_flusher_thread():
+    sent = []
+    done = threading.Event()
+
+    def send(event_type, stores):
+        sent.append((event_type, [url for url, _ in stores]))
+        if len(sent) == 300:
+            done.set()
+    aggregator = AlertAggregator(send, window=0.2)
+    threads = threading.active_count()
+    for i in range(300):
+        aggregator.add(f'gtin:{i}', 'available', 'https://store.example/', {})
+        aggregator.add(f'gtin:{i}', 'available', OTHER, {})
+    assert threading.active_count() == threads + 1
+    assert done.wait(5)
+    assert sent[0] == ('available', ['https://store.example/', OTHER])
+
+def test_sku_keys_from_version_1_are_rekeyed(db, monkeypatch):
+    monkeypatch.setattr(SScraper, 'STORE_RAW_JSON', True)
+    p = make_product(9, title="Tito's Handmade Vodka")
+    p['variants'][0]['sku'] = '10000001'
+    batch = SScraper.ProductWriteBatch(OTHER)
+    batch.add_product(9, p['handle'], p['title'], True, p)
+    batch.flush()
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE products SET canonical_key = 'gtin:10000001'")
+    conn.execute('PRAGMA user_version = 1')
+    conn.commit()
+    SScraper.init_db()
+    assert conn.execute('SELECT canonical_key FROM products').fetchone()[0] == canonical_key(p)
+    assert conn.execute('PRAGMA user_version').fetchone()[0] == SScraper.SCHEMA_VERSION
@@ -0,0 +1,163 @@
+import os
+import sys
+import sqlite3
+import json
+import pytest
+
+# Ensure SScraper.py is importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import SScraper
+from SScraper import ProductWriteBatch, init_db, load_product_availability
+from db import unpack_json
+
+STORE = 'https://store.example/'
+
+def make_product(id_val, title='Rare Bourbon', price='50.00', available=True, updated_at='2025-01-01T00:00:00-05:00'):
+    return {
+        'id': id_val, 'handle': f'p-{id_val}', 'title': title, 'vendor': 'Distillery',
+        'product_type': '', 'body_html': '', 'tags': [], 'updated_at': updated_at,
+        'variants': [{'id': id_val * 10, 'title': '750ml', 'price': price, 'available': available}],
+        'images': [{'src': f'https://cdn.example/{id_val}.jpg'}],
+    }
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'products.db')
+    monkeypatch.setattr(SScraper, 'DB_PATH', path)
+    init_db()
+    return path
+
+def fetch(db, sql, params=()):
+    conn = sqlite3.connect(db)
+    try:
+        return conn.execute(sql, params).fetchall()
+    finally:
+        conn.close()
+
+def test_batch_upserts_in_one_flush(db):
+    batch = ProductWriteBatch(STORE)
+    for i in range(1, 51):
+        p = make_product(i)
+        batch.add_product(i, p['handle'], p['title'], True, p)
+    assert len(batch) == 50
+    batch.flush()
+    assert len(batch) == 0
+    assert fetch(db, 'SELECT COUNT(*) FROM products WHERE input_url = ?', (STORE,))[0][0] == 50
+    assert len(load_product_availability(STORE)) == 50
+
+def test_batch_keeps_unwanted_override(db):
+    p = make_product(1)
+    batch = ProductWriteBatch(STORE)
+    batch.add_product(1, p['handle'], p['title'], True, p)
+    batch.flush()
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE products SET alcohol_type = 'unwanted' WHERE id = 1")
+    conn.commit()
+    conn.close()
+    batch.add_product(1, p['handle'], 'Rare Bourbon 2', True, p)
+    batch.flush()
+    assert fetch(db, 'SELECT title, alcohol_type FROM products WHERE id = 1') == [('Rare Bourbon 2', 'unwanted')]
+
+def test_batch_availability_timestamps(db):
+    p = make_product(1)
+    batch = ProductWriteBatch(STORE)
+    batch.add_product(1, p['handle'], p['title'], True, p)
+    batch.add_availability_timestamps(1, became_available_at='2025-01-01T00:00:00')
+    batch.flush()
+    batch.add_availability_timestamps(1, became_unavailable_at='2025-01-02T00:00:00')
+    batch.flush()
+    assert fetch(db, 'SELECT became_available_at, became_unavailable_at FROM products WHERE id = 1') == [('2025-01-01T00:00:00', '2025-01-02T00:00:00')]
+
+def test_process_products_detects_restock(db, monkeypatch):
+    sent = []
+    monkeypatch.setattr(SScraper, 'send_webhook_notification', lambda product, url, event_type: sent.append((product['id'], event_type)))
+    state = SScraper.StoreState(STORE)
+    SScraper.process_products(state, [make_product(1, available=False)])
+    assert sent == []  # first scan of an empty store only seeds the DB
+    SScraper.process_products(state, [make_product(1, available=True)])
+    assert sent == [(1, 'available')]
+    assert fetch(db, 'SELECT available, became_available_at IS NOT NULL FROM products WHERE id = 1') == [(1, 1)]
+
+def test_unchanged_products_are_not_rewritten(db, monkeypatch):
+    monkeypatch.setattr(SScraper, 'send_webhook_notification', lambda *args: None)
+    state = SScraper.StoreState(STORE)
+    SScraper.process_products(state, [make_product(1)])
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE products SET title = 'sentinel' WHERE id = 1")
+    conn.commit()
+    conn.close()
+    SScraper.process_products(state, [make_product(1)])
+    assert fetch(db, 'SELECT title FROM products WHERE id = 1') == [('sentinel',)]
+    SScraper.process_products(state, [make_product(1, price='45.00', updated_at='2025-01-02T00:00:00-05:00')])
+    assert fetch(db, 'SELECT title, price FROM products WHERE id = 1') == [('Rare Bourbon', '45.00')]
+
+def test_legacy_original_json_is_migrated(db, monkeypatch):
+    monkeypatch.setattr(SScraper, 'STORE_RAW_JSON', True)
+    conn = sqlite3.connect(db)
+    product = make_product(7)
+    conn.execute('INSERT INTO products (id, input_url, title, original_json) VALUES (?, ?, ?, ?)', (7, STORE, 'Legacy', json.dumps(product)))
+    conn.execute('PRAGMA user_version = 0')
+    conn.commit()
+    conn.close()
+    init_db()
+    assert fetch(db, 'SELECT image_url, variant_count, original_json FROM products WHERE id = 7') == [('https://cdn.example/7.jpg', 1, None)]
+    blob = fetch(db, 'SELECT json_z FROM product_raw WHERE id = 7')[0][0]
+    assert json.loads(unpack_json(blob)) == product
+
+def test_search_index_is_built_for_existing_rows(db):
+    # A DB from before products_fts/body_text: drop both and let init_db rebuild them from product_raw
+    conn = sqlite3.connect(db)
+    product = make_product(8, title='Old Rye')
+    product['body_html'] = '<p>Bottled in bond &amp; aged four years</p>'
+    conn.execute('INSERT INTO products (id, input_url, title) VALUES (?, ?, ?)', (8, STORE, 'Old Rye'))
+    conn.execute('INSERT INTO product_raw (id, input_url, json_z) VALUES (?, ?, ?)', (8, STORE, SScraper.pack_json(product)))
+    for name in ('products_fts_ai', 'products_fts_ad', 'products_fts_au'):
+        conn.execute(f'DROP TRIGGER {name}')
+    conn.execute('DROP TABLE products_fts')
+    conn.execute('ALTER TABLE products DROP COLUMN body_text')
+    conn.execute('PRAGMA user_version = 0')
+    conn.commit()
+    conn.close()
+    init_db()
+    assert fetch(db, 'SELECT body_text FROM products WHERE id = 8') == [('Bottled in bond & aged four years',)]
+    assert fetch(db, "SELECT rowid FROM products_fts WHERE products_fts MATCH 'bond'") == fetch(db, 'SELECT rowid FROM products WHERE id = 8')
+
+def test_schema_is_created_once_per_version(db, monkeypatch):
+    assert fetch(db, 'PRAGMA user_version') == [(SScraper.SCHEMA_VERSION,)]
+    def fail(conn):
+        raise AssertionError('schema already current')
+    monkeypatch.setattr(SScraper, 'create_schema', fail)
+    init_db()
+
+def test_refresh_applies_only_web_ui_edits(db, monkeypatch):
+    sent = []
+    monkeypatch.setattr(SScraper, 'send_webhook_notification', lambda product, url, event_type: sent.append((product['id'], event_type)))
+    state = SScraper.StoreState(STORE)
+    SScraper.process_products(state, [make_product(i, available=False) for i in (1, 2, 3)])
+    state.refresh()
+    touched_at = state.product_availability[3]['touched_at']
+    # Edits made by the web UI between cycles
+    conn = sqlite3.connect(db)
+    conn.execute('UPDATE products SET ignore_notifications = 1 WHERE id = 1')
+    conn.execute('DELETE FROM products WHERE id = 2')
+    conn.commit()
+    conn.close()
+    monkeypatch.setattr(SScraper, 'load_product_availability', lambda url: pytest.fail('refresh reloaded the whole store'))
+    state.refresh()
+    assert state.product_availability[1]['ignore_notifications'] == 1
+    assert 2 not in state.product_availability
+    assert state.product_availability[3]['touched_at'] == touched_at
+    SScraper.process_products(state, [make_product(i, available=True) for i in (1, 2, 3)])
+    assert sent == [(3, 'available')]
+    assert 2 in state.product_availability and fetch(db, 'SELECT COUNT(*) FROM products WHERE id = 2') == [(1,)]
+
+def test_refresh_reloads_when_tombstones_were_pruned(db):
+    state = SScraper.StoreState(STORE)
+    SScraper.process_products(state, [make_product(1)])
+    conn = sqlite3.connect(db)
+    conn.execute("UPDATE db_meta SET value = value + 100 WHERE key IN ('change_seq', 'tombstone_floor')")
+    conn.commit()
+    conn.close()
+    state.product_availability.clear()
+    state.refresh()
+    assert list(state.product_availability) == [1]
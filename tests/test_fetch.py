@@ -0,0 +1,138 @@
+import os
+import sys
+import json
+import asyncio
+import datetime
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+import aiohttp
+import pytest
+
+# Ensure SScraper.py is importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import SScraper
+import scheduler
+
+class FakeShopify:
+    """Minimal products.json server with ETag support, ordered by updated_at descending."""
+
+    def __init__(self, count):
+        newest = datetime.datetime(2025, 1, 28, tzinfo=datetime.timezone.utc)
+        self.products = [{'id': i, 'title': f'Bourbon {i}', 'updated_at': (newest - datetime.timedelta(minutes=i)).isoformat()} for i in range(count)]
+        self.requests = []
+        self.status = 200  # Set to e.g. 429 to fail every request
+        shop = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_GET(self):
+                query = parse_qs(urlparse(self.path).query)
+                page, limit = int(query['page'][0]), int(query['limit'][0])
+                body = json.dumps({'products': shop.products[(page - 1) * limit:page * limit]}).encode()
+                etag = f'"{hash(body)}"'
+                shop.requests.append((page, self.headers.get('If-None-Match') == etag))
+                if shop.status != 200:
+                    self.send_response(shop.status)
+                    self.send_header('Retry-After', '600')
+                    self.send_header('Content-Length', '0')
+                    self.end_headers()
+                    return
+                if self.headers.get('If-None-Match') == etag:
+                    self.send_response(304)
+                    self.end_headers()
+                    return
+                self.send_response(200)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(body)))
+                self.send_header('ETag', etag)
+                self.end_headers()
+                self.wfile.write(body)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+@pytest.fixture
+def shop(monkeypatch):
+    monkeypatch.setattr(SScraper, 'JITTER', 0)
+    monkeypatch.setattr(SScraper, 'PROXIES', [])
+    monkeypatch.setattr(SScraper, 'PROXY_POOL', SScraper.ProxyPool([], host_rate=1000, host_burst=1000))
+    monkeypatch.setattr(SScraper, 'HOST_BACKOFF', SScraper.HostBackoff(rate=1000, burst=1000))
+    monkeypatch.setattr(scheduler, 'PAGE_JITTER', 0)
+    server = FakeShopify(450)
+    yield server
+    server.server.shutdown()
+    for cache in (SScraper.PAGE_CACHE, SScraper.STORE_LATEST_UPDATED_AT, SScraper.STORE_RECENCY_ORDERED):
+        cache.pop(server.url, None)
+
+def test_conditional_requests_reuse_cached_pages(shop):
+    first = SScraper.fetch_all_products_with_paging(shop.url, product_limit=10000)
+    assert len(first) == 450
+    assert shop.requests == [(1, False), (2, False), (3, False)]
+    shop.requests.clear()
+    SScraper.STORE_RECENCY_ORDERED[shop.url] = False  # force every page to be revalidated
+    second = SScraper.fetch_all_products_with_paging(shop.url, product_limit=10000)
+    assert [p['id'] for p in second] == [p['id'] for p in first]
+    assert shop.requests == [(1, True), (2, True), (3, True)]
+
+def test_early_cutoff_on_recency_ordered_store(shop):
+    SScraper.fetch_all_products_with_paging(shop.url, product_limit=10000)
+    assert SScraper.STORE_RECENCY_ORDERED[shop.url]
+    shop.requests.clear()
+    products = SScraper.fetch_all_products_with_paging(shop.url, product_limit=10000)
+    # Page 1 has nothing newer than the last pass, so pages 2 and 3 come from the cache
+    assert shop.requests == [(1, True)]
+    assert len(products) == 450
+
+def test_429_backs_off_host_without_sleeping(shop):
+    shop.status = 429
+    start = time.monotonic()
+    assert SScraper.fetch_all_products_with_paging(shop.url, product_limit=10000) == []
+    assert time.monotonic() - start < 5
+    # Only one proxy (the direct connection), so the pass ends after the first 429 and honours Retry-After
+    assert len(shop.requests) == 1
+    host = urlparse(shop.url).netloc
+    assert SScraper.HOST_BACKOFF.ready_at(host) >= time.time() + 590
+    # The host is skipped until the backoff expires
+    assert SScraper.fetch_all_products_with_paging(shop.url, product_limit=10000) == []
+    assert len(shop.requests) == 1
+
+def test_async_backoff_is_persisted_off_the_event_loop(shop, monkeypatch):
+    shop.status = 429
+    persisted = []
+    monkeypatch.setattr(SScraper.HOST_BACKOFF, 'persist', lambda state: persisted.append(threading.current_thread()))
+
+    async def fetch():
+        async with aiohttp.ClientSession() as session:
+            return await SScraper.async_fetch_all_products_with_paging(session, shop.url, SScraper.CrawlLimits())
+    assert asyncio.run(fetch()) == []
+    assert persisted and threading.main_thread() not in persisted
+    assert SScraper.HOST_BACKOFF.ready_at(urlparse(shop.url).netloc) >= time.time() + 590
+
+def test_stream_parser_handles_arbitrary_chunking():
+    products = [{'id': i, 'title': f'Bourbon "{i}" {{x}}', 'body_html': '<p>[a], {b}</p>' * i, 'tags': ['a,b']} for i in range(20)]
+    body = json.dumps({'products': products}, indent=1)
+    longest = max(len(json.dumps(p, indent=1)) for p in products)
+    for size in (3, 64, len(body)):
+        parser = SScraper.ProductStreamParser()
+        parsed = []
+        for i in range(0, len(body), size):
+            parsed.extend(parser.feed(body[i:i + size]))
+            assert len(parser.buf) <= size + longest + 16
+        parser.close()
+        assert parsed == products
+
+def test_stream_parser_rejects_truncated_body():
+    parser = SScraper.ProductStreamParser()
+    assert parser.feed('{"products": [{"id": 1}, {"id": 2, "ti') == [{'id': 1}]
+    with pytest.raises(ValueError):
+        parser.close()
+
+def test_streaming_fetch_yields_every_product(shop):
+    stream = SScraper.iter_products_with_paging(shop.url, product_limit=10000, stream=True)
+    assert [p['id'] for p in stream] == list(range(450))
+    assert shop.url not in SScraper.PAGE_CACHE
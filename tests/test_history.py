@@ -0,0 +1,85 @@
+import os
+import sys
+import sqlite3
+import pytest
+
+# Ensure SScraper.py and history.py are importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import SScraper
+import history
+from history import compact_events, availability_periods, store_id
+from test_db_writer import STORE, make_product
+
+DAY = 86400
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'products.db')
+    monkeypatch.setattr(SScraper, 'DB_PATH', path)
+    monkeypatch.setattr(SScraper, 'send_webhook_notification', lambda *args: None)
+    SScraper.init_db()
+    return path
+
+def events(db):
+    return sqlite3.connect(db).execute('SELECT product_id, old_price, new_price, old_available, new_available FROM product_events ORDER BY event_id').fetchall()
+
+def test_only_changes_are_recorded(db):
+    state = SScraper.StoreState(STORE)
+    SScraper.process_products(state, [make_product(1, available=False), make_product(2)])
+    SScraper.process_products(state, [make_product(1, available=False), make_product(2)])
+    SScraper.process_products(state, [make_product(1, available=True, updated_at='2025-01-02'), make_product(2, price='40.00', updated_at='2025-01-02')])
+    assert events(db) == [
+        (1, None, 50.0, None, 0), (2, None, 50.0, None, 1),
+        (1, 50.0, 50.0, 0, 1), (2, 50.0, 40.0, 1, 1),
+    ]
+
+@pytest.mark.parametrize('batch', [1000, 1])
+def test_compaction_merges_old_days_and_drops_expired(db, monkeypatch, batch):
+    monkeypatch.setattr(history, 'COMPACT_BATCH', batch)
+    conn = SScraper.get_connection(db)
+    sid = store_id(conn, STORE)
+    now = 100 * DAY
+    rows = [
+        (1, sid, now - 200 * DAY, None, 10.0, None, 1),  # expired
+        (1, sid, now - 33 * DAY + 10, 10.0, 10.0, 1, 0),  # an old flapping day...
+        (1, sid, now - 33 * DAY + 20, 10.0, 10.0, 0, 1),
+        (1, sid, now - 33 * DAY + 30, 10.0, 9.0, 1, 0),
+        (2, sid, now - 33 * DAY + 10, 5.0, 4.0, 1, 1),  # ...another product's single event that day
+        (1, sid, now - DAY, 9.0, 9.0, 0, 1),  # recent, kept as is
+        (1, sid, now - DAY + 5, 9.0, 9.0, 1, 0),
+    ]
+    with conn:
+        conn.executemany('INSERT INTO product_events (product_id, store_id, ts, old_price, new_price, old_available, new_available) VALUES (?, ?, ?, ?, ?, ?, ?)', rows)
+    assert compact_events(conn, now=now, raw_days=30, keep_days=180) == (1, 2)
+    assert events(db) == [(1, 10.0, 9.0, 1, 0), (2, 5.0, 4.0, 1, 1), (1, 9.0, 9.0, 0, 1), (1, 9.0, 9.0, 1, 0)]
+
+def test_retention_runs_on_its_own_thread(db, monkeypatch):
+    conn = SScraper.get_connection(db)
+    with conn:
+        conn.executemany('INSERT INTO product_events (product_id, store_id, ts, old_price, new_price, old_available, new_available) VALUES (?, ?, 0, NULL, 1.0, NULL, 1)',
+                         [(i, store_id(conn, STORE)) for i in range(5)])
+    monkeypatch.setattr(SScraper, 'HISTORY_COMPACT_INTERVAL', 21600.0)
+    monkeypatch.setattr(SScraper, 'HISTORY_COMPACTED_AT', 0.0)
+    monkeypatch.setattr(SScraper, 'TOMBSTONE_PRUNE_BATCH', 2)
+    with SScraper.db_lock:
+        # The caller returns at once; the job waits for db_lock only for each batch it writes
+        SScraper.maybe_compact_history()
+        thread = SScraper.HISTORY_THREAD
+        assert thread.is_alive()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert events(db) == []
+    SScraper.maybe_compact_history()
+    assert SScraper.HISTORY_THREAD is thread
+
+def test_tombstones_are_pruned_in_batches(db, monkeypatch):
+    monkeypatch.setattr(SScraper, 'TOMBSTONE_PRUNE_BATCH', 2)
+    conn = SScraper.get_connection(db)
+    with conn:
+        conn.executemany("INSERT INTO product_tombstones (id, input_url, change_seq, deleted_at) VALUES (?, ?, ?, 0)", [(i, STORE, i) for i in range(1, 6)])
+    assert SScraper.prune_tombstones(conn) == 5
+    assert conn.execute("SELECT value FROM db_meta WHERE key = 'tombstone_floor'").fetchone()[0] == 5
+
+def test_availability_periods():
+    series = [{'ts': 0, 'new_available': 0}, {'ts': 10, 'new_available': 1}, {'ts': 70, 'new_available': 0}, {'ts': 100, 'new_available': 1}]
+    assert availability_periods(series, now=130) == [{'start': 10, 'end': 70, 'seconds': 60}, {'start': 100, 'end': None, 'seconds': 30}]
@@ -0,0 +1,88 @@
+import os
+import sys
+import sqlite3
+import pytest
+
+# Ensure SScraper.py and maintenance.py are importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import SScraper
+import maintenance
+from test_db_writer import STORE, make_product
+
+def write_products(ids):
+    batch = SScraper.ProductWriteBatch(STORE)
+    for i in ids:
+        p = make_product(i, title=f'Bourbon {i}')
+        batch.add_product(i, p['handle'], p['title'], True, p)
+    batch.flush()
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'products.db')
+    monkeypatch.setattr(SScraper, 'DB_PATH', path)
+    SScraper.init_db()
+    return path
+
+def plan(conn, sql, params):
+    return ' '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params))
+
+def test_hot_queries_use_indexes(db):
+    conn = sqlite3.connect(db)
+    assert 'COVERING INDEX idx_products_store' in plan(conn, 'SELECT id, available, price, ignore_notifications, fingerprint FROM products WHERE input_url = ?', (STORE,))
+    assert 'INDEX sqlite_autoindex_products_1 (id=?)' in plan(conn, 'DELETE FROM products WHERE id = ?', (1,))
+    assert 'idx_products_last_seen' in plan(conn, "SELECT id FROM products ORDER BY COALESCE(last_seen, '') DESC LIMIT 10", ())
+
+def test_stale_products_are_archived(db, monkeypatch):
+    monkeypatch.setattr(SScraper, 'STORE_RAW_JSON', True)
+    write_products(range(1, 6))
+    conn = SScraper.get_connection(db)
+    with conn:
+        conn.execute("UPDATE products SET last_seen = datetime('now', '-40 days') WHERE id IN (1, 2)")
+    assert maintenance.prune_stale_products(conn, days=30, action='archive') == 2
+    assert [r[0] for r in conn.execute('SELECT id FROM products ORDER BY id')] == [3, 4, 5]
+    archived = conn.execute('SELECT id, title, json_z IS NOT NULL, archived_at IS NOT NULL FROM products_archive ORDER BY id').fetchall()
+    assert archived == [(1, 'Bourbon 1', 1, 1), (2, 'Bourbon 2', 1, 1)]
+    assert conn.execute('SELECT COUNT(*) FROM product_raw WHERE id IN (1, 2)').fetchone()[0] == 0
+    # Deleted through the triggers: gone from search, and the change feed has their tombstones
+    assert conn.execute("SELECT COUNT(*) FROM products_fts WHERE products_fts MATCH 'bourbon'").fetchone()[0] == 3
+    assert conn.execute('SELECT id FROM product_tombstones ORDER BY id').fetchall() == [(1,), (2,)]
+    assert maintenance.prune_stale_products(conn, days=0) == 0
+
+def test_first_vacuum_converts_and_keeps_search_in_step(tmp_path, monkeypatch):
+    path = str(tmp_path / 'products.db')
+    legacy = sqlite3.connect(path)  # A file created before auto_vacuum was enabled
+    legacy.execute('CREATE TABLE legacy (x)')
+    legacy.close()
+    monkeypatch.setattr(SScraper, 'DB_PATH', path)
+    SScraper.init_db()
+    write_products(range(1, 2001))
+    conn = SScraper.get_connection(path)
+    with conn:
+        conn.execute('DELETE FROM products WHERE id <= 1500')
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+    # The scheduled job leaves the conversion to an explicit full VACUUM
+    assert maintenance.run_maintenance(conn, stale_days=0)['reclaimed_bytes'] == 0
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 0
+    report = maintenance.run_maintenance(conn, stale_days=0, full_vacuum=True)
+    assert report['reclaimed_bytes'] > 0
+    assert conn.execute('PRAGMA auto_vacuum').fetchone()[0] == 2
+    hits = conn.execute("SELECT p.title FROM products_fts JOIN products p ON p.rowid = products_fts.rowid WHERE products_fts MATCH '1999'").fetchall()
+    assert hits == [('Bourbon 1999',)]
+    sizes = {row['name']: row for row in report['footprint']}
+    assert sizes['products']['kind'] == 'table' and sizes['idx_products_store']['table'] == 'products'
+    assert conn.execute("SELECT 1 FROM sqlite_master WHERE name = 'sqlite_stat1'").fetchone()
+
+def test_scraper_runs_maintenance_on_its_interval(db, monkeypatch):
+    monkeypatch.setattr(SScraper, 'MAINTENANCE_RAN_AT', 0.0)
+    monkeypatch.setattr(SScraper, 'MAINTENANCE_INTERVAL', 86400.0)
+    with SScraper.db_lock:
+        # Runs on its own thread: the caller returns at once, and the job waits for db_lock only for its writes
+        SScraper.maybe_run_maintenance()
+        thread = SScraper.MAINTENANCE_THREAD
+        assert thread.is_alive()
+    thread.join(timeout=10)
+    assert not thread.is_alive()
+    assert SScraper.DB_BYTES.labels('products', 'table').value > 0
+    ran_at = SScraper.MAINTENANCE_RAN_AT
+    SScraper.maybe_run_maintenance()
+    assert SScraper.MAINTENANCE_RAN_AT == ran_at and SScraper.MAINTENANCE_THREAD is thread
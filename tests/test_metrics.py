@@ -0,0 +1,120 @@
+import os
+import sys
+import json
+import socket
+import urllib.request
+import pytest
+
+# Ensure SScraper.py and metrics.py are importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import SScraper
+from metrics import Registry, Counter, Histogram, CallbackMetric, start_metrics_server, merge_summaries
+from test_db_writer import STORE, make_product
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'products.db')
+    monkeypatch.setattr(SScraper, 'DB_PATH', path)
+    SScraper.init_db()
+    return path
+
+def test_prometheus_text_format():
+    registry = Registry()
+    responses = Counter('fetch_responses_total', 'Responses by status', ('host', 'status'), registry=registry)
+    latency = Histogram('fetch_seconds', 'Request time', buckets=(0.1, 1), registry=registry)
+    CallbackMetric('queue_depth', 'Queued items', lambda: 3, registry=registry)
+    responses.labels('a.example', 200).inc()
+    responses.labels('a.example', 200).inc(2)
+    responses.labels('b"x', 429).inc()
+    for value in (0.05, 0.5, 5):
+        latency.observe(value)
+    assert registry.render().splitlines() == [
+        '# HELP fetch_responses_total Responses by status',
+        '# TYPE fetch_responses_total counter',
+        'fetch_responses_total{host="a.example",status="200"} 3',
+        'fetch_responses_total{host="b\\"x",status="429"} 1',
+        '# HELP fetch_seconds Request time',
+        '# TYPE fetch_seconds histogram',
+        'fetch_seconds_bucket{le="0.1"} 1',
+        'fetch_seconds_bucket{le="1"} 2',
+        'fetch_seconds_bucket{le="+Inf"} 3',
+        'fetch_seconds_sum 5.55',
+        'fetch_seconds_count 3',
+        '# HELP queue_depth Queued items',
+        '# TYPE queue_depth gauge',
+        'queue_depth 3',
+    ]
+    with pytest.raises(ValueError):
+        Counter('queue_depth', 'Duplicate', registry=registry)
+
+def test_histogram_summary_quantiles():
+    registry = Registry()
+    latency = Histogram('latency_seconds', 'Latency', buckets=(1, 2, 4), registry=registry)
+    for value in [0.5] * 50 + [1.5] * 40 + [3] * 10:
+        latency.observe(value)
+    series = registry.summary()['metrics']['latency_seconds']['series']
+    assert series[0]['count'] == 100
+    assert series[0]['avg'] == pytest.approx(1.15)
+    assert series[0]['p50'] == pytest.approx(1.0)
+    assert series[0]['p95'] == pytest.approx(3.0)
+    empty = Histogram('idle_seconds', 'Nothing yet', registry=registry)
+    empty.labels()
+    assert registry.summary()['metrics']['idle_seconds']['series'][0]['p50'] is None
+
+def test_scraper_hot_paths_are_recorded_and_served(db, monkeypatch):
+    monkeypatch.setattr(SScraper, 'ALCOHOL_TYPE_MEMO', {})
+    monkeypatch.setattr(SScraper, 'CANONICAL', SScraper.CanonicalIndex())
+    monkeypatch.setattr(SScraper, 'STORE_RAW_JSON', True)
+    memo = SScraper.ALCOHOL_TYPE_SOURCES['memo'].value
+    classified = SScraper.ALCOHOL_TYPE_SOURCES['classified'].value
+    classify_count = SScraper.CLASSIFY_SECONDS.labels().count
+    product = make_product(1, title='Bourbon 1')
+    SScraper.get_alcohol_type(product)
+    SScraper.get_alcohol_type(product)
+    assert SScraper.ALCOHOL_TYPE_SOURCES['classified'].value == classified + 1
+    assert SScraper.ALCOHOL_TYPE_SOURCES['memo'].value == memo + 1
+    assert SScraper.CLASSIFY_SECONDS.labels().count == classify_count + 1
+
+    writes = SScraper.DB_WRITE_SECONDS.labels().count
+    SScraper.update_product_in_db(1, product['handle'], product['title'], True, product, STORE)
+    assert SScraper.DB_WRITE_SECONDS.labels().count == writes + 1
+
+    server = start_metrics_server(port=free_port())
+    try:
+        base = f'http://127.0.0.1:{server.server_address[1]}'
+        text = urllib.request.urlopen(f'{base}/metrics').read().decode()
+        assert 'scraper_alcohol_type_lookups_total{source="memo"}' in text
+        assert 'scraper_db_write_seconds_count' in text
+        summary = json.loads(urllib.request.urlopen(f'{base}/metrics.json').read())
+        rows = summary['metrics']['scraper_db_write_rows_total']['series']
+        assert {r['labels']['kind'] for r in rows} >= {'products', 'raw'}
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def shard_registry(fetches, latencies):
+    registry = Registry()
+    responses = Counter('fetch_responses_total', 'Responses by status', ('host',), registry=registry)
+    latency = Histogram('latency_seconds', 'Latency', buckets=(1, 2, 4), registry=registry)
+    for host, n in fetches.items():
+        responses.labels(host).inc(n)
+    for value in latencies:
+        latency.observe(value)
+    return registry
+
+def test_shard_summaries_are_added_up():
+    merged = merge_summaries([shard_registry({'a.example': 2}, [0.5] * 50).summary(),
+                              shard_registry({'a.example': 1, 'b.example': 4}, [1.5] * 40 + [3] * 10).summary()])
+    rows = {r['labels']['host']: r['value'] for r in merged['metrics']['fetch_responses_total']['series']}
+    assert rows == {'a.example': 3, 'b.example': 4}
+    # The quantiles come from the summed buckets, as if one process had observed everything
+    expected = shard_registry({}, [0.5] * 50 + [1.5] * 40 + [3] * 10).summary()['metrics']['latency_seconds']['series']
+    assert merged['metrics']['latency_seconds']['series'] == expected
+
+def test_metrics_server_disabled_by_port_zero():
+    assert start_metrics_server(port=0) is None
@@ -0,0 +1,95 @@
+import os
+import sys
+import json
+import sqlite3
+import pytest
+
+# Ensure SScraper.py and notifier.py are importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import SScraper
+import notifier
+from notifier import WebhookDispatcher
+from webhook_stub import WebhookStub
+
+PRODUCT = {'id': 1, 'handle': 'bourbon', 'title': 'Bourbon', 'variants': [{'id': 11, 'title': '750ml', 'price': '49.99', 'available': True}]}
+
+@pytest.fixture
+def stub():
+    server = WebhookStub(limit=3, window=0.5)
+    yield server
+    server.close()
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'products.db')
+    monkeypatch.setattr(SScraper, 'DB_PATH', path)
+    SScraper.init_db()
+    return path
+
+def test_embeds_are_batched_ten_per_message(stub):
+    dispatcher = WebhookDispatcher(batch_wait=0.2)
+    for i in range(25):
+        dispatcher.submit('notify', stub.url, embed={'description': f'#{i}'})
+    assert dispatcher.flush(timeout=10)
+    assert [len(m['embeds']) for m in stub.messages] == [10, 10, 5]
+    assert [e['description'] for e in stub.embeds] == [f'#{i}' for i in range(25)]
+
+def test_rate_limit_headers_are_respected(stub):
+    dispatcher = WebhookDispatcher(batch_size=1, batch_wait=0)
+    for i in range(8):
+        dispatcher.submit('notify', stub.url, embed={'description': f'#{i}'})
+    assert dispatcher.flush(timeout=10)
+    assert len(stub.messages) == 8
+    # X-RateLimit-Remaining: 0 makes the dispatcher wait for the reset instead of hitting a 429
+    assert stub.rate_limited == 0
+
+def test_429_is_retried(stub):
+    dispatcher = WebhookDispatcher()
+    stub.window_count = stub.limit  # The bucket is already exhausted by someone else
+    dispatcher.submit('error', stub.url, content='hello')
+    assert dispatcher.flush(timeout=10)
+    assert stub.rate_limited == 1
+    assert stub.messages == [{'content': 'hello'}]
+
+def test_failed_messages_are_dead_lettered(stub, db, monkeypatch):
+    monkeypatch.setattr(notifier, 'NOTIFY_MAX_ATTEMPTS', 2)
+    monkeypatch.setattr(notifier, 'NOTIFY_RETRY_BASE', 0.01)
+    dispatcher = WebhookDispatcher(db_path=db, batch_size=1)
+    stub.fail_next = 2
+    dispatcher.submit('notify', stub.url, embed={'description': 'lost'})
+    dispatcher.submit('notify', stub.url, embed={'description': 'kept'})
+    assert dispatcher.flush(timeout=10)
+    rows = sqlite3.connect(db).execute('SELECT webhook_type, payload, status, attempts FROM webhook_dead_letters').fetchall()
+    assert [(t, json.loads(p), s, a) for t, p, s, a in rows] == [('notify', {'embeds': [{'description': 'lost'}]}, 500, 2)]
+    assert [e['description'] for e in stub.embeds] == ['kept']
+
+def test_send_webhook_notification_does_not_block(stub, db, monkeypatch):
+    dispatcher = WebhookDispatcher(batch_wait=0.2)
+    monkeypatch.setattr(SScraper, 'NOTIFIER', dispatcher)
+    monkeypatch.setattr(SScraper, 'NOTIFY_WEBHOOK', stub.url)
+    stub.latency = 0.2
+    for _ in range(3):
+        SScraper.send_webhook_notification(PRODUCT, 'https://store.example/', 'new')
+    assert stub.messages == []
+    assert dispatcher.flush(timeout=10)
+    assert len(stub.messages) == 1
+    fields = {f['name']: f['value'] for f in stub.embeds[0]['fields']}
+    assert fields['Product Link'] == 'https://store.example/products/bourbon'
+
+def test_large_embeds_are_split_not_lost(stub, db):
+    dispatcher = WebhookDispatcher(db_path=db, batch_wait=0.2)
+    stub.limit = 100
+    big = [{'title': f'#{i}', 'fields': [{'name': 'Variants', 'value': 'x' * 1400}]} for i in range(10)]
+    for embed in big:
+        dispatcher.submit('notify', stub.url, embed=embed)
+    assert dispatcher.flush(timeout=10)
+    assert [e['title'] for e in stub.embeds] == [f'#{i}' for i in range(10)]
+    assert all(sum(notifier.embed_length(e) for e in m['embeds']) <= notifier.EMBED_TEXT_LIMIT for m in stub.messages)
+    # A batch Discord still rejects as a whole is re-sent one embed at a time
+    stub.messages.clear()
+    batch = [notifier.Notification('notify', stub.url, embed={'description': 'ok'}),
+             notifier.Notification('notify', stub.url, embed={'description': 'y' * 6001})]
+    assert not dispatcher.send(batch)
+    assert stub.embeds == [{'description': 'ok'}]
+    rows = sqlite3.connect(db).execute('SELECT payload, status FROM webhook_dead_letters').fetchall()
+    assert [(len(json.loads(p)['embeds']), s) for p, s in rows] == [(1, 400)]
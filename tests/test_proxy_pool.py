@@ -0,0 +1,58 @@
+import os
+import sys
+
+# Ensure proxy_pool.py is importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import proxy_pool
+from proxy_pool import ProxyPool, retry_after_seconds
+
+HOST = 'store.example'
+
+def test_failing_proxy_is_circuit_broken(monkeypatch):
+    monkeypatch.setattr(proxy_pool, 'PROXY_FAILURE_THRESHOLD', 2)
+    pool = ProxyPool(['bad:1', 'good:1'], host_rate=1000, host_burst=1000)
+    for _ in range(2):
+        lease, _ = pool.choose(HOST)
+        while lease.proxy != 'bad:1':
+            lease.report(200)
+            lease, _ = pool.choose(HOST)
+        lease.report(error=TimeoutError('timed out'))
+    assert pool.available(HOST) == 1
+    assert {pool.choose(HOST)[0].proxy for _ in range(50)} == {'good:1'}
+    stats = {s['proxy']: s for s in pool.snapshot()}
+    assert stats['bad:1']['failures'] == 2 and stats['bad:1']['circuit_open_for'] > 0
+
+def test_429_pauses_only_that_proxy_and_host():
+    pool = ProxyPool(['a:1', 'b:1'], host_rate=1000, host_burst=1000)
+    lease, _ = pool.choose(HOST)
+    lease.report(429, retry_after=60)
+    other = 'b:1' if lease.proxy == 'a:1' else 'a:1'
+    assert {pool.choose(HOST)[0].proxy for _ in range(20)} == {other}
+    assert pool.available('other.example') == 2
+
+def test_token_bucket_spaces_requests():
+    pool = ProxyPool([], host_rate=1, host_burst=2)
+    assert pool.choose(HOST)[0] is not None
+    assert pool.choose(HOST)[0] is not None
+    lease, wait = pool.choose(HOST)
+    assert lease is None and 0 < wait <= 1
+    # Other hosts have their own bucket
+    assert pool.choose('other.example')[0] is not None
+
+def test_selection_prefers_fast_reliable_proxies():
+    pool = ProxyPool(['fast:1', 'slow:1'], host_rate=1000, host_burst=1000)
+    pool.stats['fast:1'].latency = 0.2
+    pool.stats['slow:1'].latency = 5.0
+    picks = [pool.choose(HOST)[0].proxy for _ in range(400)]
+    assert picks.count('fast:1') > 300
+
+def test_sessions_are_reused_per_proxy():
+    pool = ProxyPool(['a:1'], host_rate=1000, host_burst=1000)
+    first = pool.choose(HOST)[0].session
+    assert pool.choose('other.example')[0].session is first
+    assert first.proxies['https'] == 'https://a:1'
+
+def test_retry_after_parsing():
+    assert retry_after_seconds({'Retry-After': '30'}) == 30
+    assert retry_after_seconds({'Retry-After': 'Wed, 21 Oct 2015 07:28:00 GMT'}) is None
+    assert retry_after_seconds({}) is None
@@ -0,0 +1,111 @@
+import os
+import sys
+import sqlite3
+import threading
+import time
+import pytest
+
+# Ensure SScraper.py and scheduler.py are importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import SScraper
+import scheduler
+from scheduler import StoreScheduler, HostBackoff, interval_for_rate, history_rate
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'products.db')
+    monkeypatch.setattr(SScraper, 'DB_PATH', path)
+    monkeypatch.setattr(scheduler, 'POLL_JITTER', 0)
+    SScraper.init_db()
+    return path
+
+def test_interval_bounds():
+    assert interval_for_rate(0, 60, 900) == 900
+    assert interval_for_rate(1000, 60, 900) == 60
+    assert interval_for_rate(12, 60, 900) == 300  # one expected change every 5 minutes
+    assert 60 <= interval_for_rate(None, 60, 900) <= 900
+
+def test_busy_store_speeds_up_and_quiet_store_backs_off(db):
+    sched = StoreScheduler(db, min_interval=60, max_interval=900)
+    for url in ('https://busy.example/', 'https://quiet.example/'):
+        sched.add(url, due_at=0)
+    t = 1000000.0
+    for _ in range(6):
+        t += 300
+        busy = sched.record('https://busy.example/', 5, polled_at=t)
+        quiet = sched.record('https://quiet.example/', 0, polled_at=t)
+    assert busy == 60
+    assert quiet == 900
+
+def test_next_due_returns_earliest_store(db):
+    sched = StoreScheduler(db)
+    now = time.time()
+    sched.add('https://later.example/', due_at=now + 0.3)
+    sched.add('https://sooner.example/', due_at=now - 1)
+    assert sched.next_due(timeout=1) == 'https://sooner.example/'
+    # The taken store is running and not handed out twice
+    assert sched.next_due(timeout=0.05) is None
+    assert sched.next_due(timeout=1) == 'https://later.example/'
+    assert [e['running'] for e in sched.snapshot()] == [True, True]
+
+def test_record_wakes_waiting_worker(db):
+    sched = StoreScheduler(db, min_interval=0.1, max_interval=0.1)
+    sched.add('https://a.example/', due_at=time.time() + 60)
+    got = []
+    worker = threading.Thread(target=lambda: got.append(sched.next_due(timeout=5)))
+    worker.start()
+    sched.reschedule('https://a.example/', 0)
+    worker.join()
+    assert got == ['https://a.example/']
+
+def test_rate_is_seeded_from_history_and_persisted(db):
+    conn = sqlite3.connect(db)
+    # Initial load three days ago, then 24 restocks and 12 new products over the last day
+    conn.execute("INSERT INTO products (id, input_url, date_added) VALUES (0, 'https://s.example/', datetime('now', '-3 days'))")
+    for i in range(1, 25):
+        conn.execute("INSERT INTO products (id, input_url, date_added, became_available_at) VALUES (?, 'https://s.example/', datetime('now', '-3 days'), datetime('now', '-2 hours'))", (i,))
+    for i in range(25, 37):
+        conn.execute("INSERT INTO products (id, input_url, date_added) VALUES (?, 'https://s.example/', datetime('now', '-1 hours'))", (i,))
+    conn.commit()
+    conn.close()
+    conn = SScraper.get_connection(db)
+    assert history_rate(conn, 'https://s.example/', hours=24) == pytest.approx(36 / 24)
+    assert history_rate(conn, 'https://none.example/', hours=24) is None
+    sched = StoreScheduler(db)
+    sched.add('https://s.example/')
+    sched.record('https://s.example/', 0)
+    row = sqlite3.connect(db).execute('SELECT change_rate, polls FROM store_schedule').fetchone()
+    assert row[1] == 1 and row[0] > 0
+    # A restarted scheduler picks up the persisted rate
+    entry = StoreScheduler(db).add('https://s.example/')
+    assert entry.rate == pytest.approx(row[0], rel=1e-3)
+
+def test_record_respects_not_before(db):
+    sched = StoreScheduler(db, min_interval=60, max_interval=60)
+    sched.add('https://a.example/', due_at=0)
+    assert sched.record('https://a.example/', 0, polled_at=1000.0, not_before=1000.0 + 600) == 600
+
+def test_host_backoff_grows_resets_and_persists(db, monkeypatch):
+    monkeypatch.setattr(scheduler, 'BACKOFF_BASE', 100)
+    backoff = HostBackoff(db)
+    first = backoff.throttled('a.example')
+    second = backoff.throttled('a.example')
+    assert 100 <= first <= 110 and 200 <= second <= 220
+    assert backoff.throttled('a.example', retry_after=5000) == 5000
+    assert backoff.wait('a.example') > 4000
+    # A restarted scraper keeps honouring the backoff
+    restored = HostBackoff(db)
+    restored.load()
+    assert restored.ready_at('a.example') == pytest.approx(backoff.ready_at('a.example'), abs=1)
+    assert restored.acquire('a.example', max_wait=1) is False
+    backoff.succeeded('a.example')
+    assert backoff.state('a.example').throttled == 0
+
+def test_host_rate_limit_returns_instead_of_sleeping(db, monkeypatch):
+    monkeypatch.setattr(scheduler, 'PAGE_JITTER', 0)
+    backoff = HostBackoff(rate=0.01, burst=2)
+    assert backoff.acquire('a.example') and backoff.acquire('a.example')
+    start = time.monotonic()
+    assert backoff.acquire('a.example', max_wait=1) is False
+    assert time.monotonic() - start < 0.5
+    assert backoff.try_acquire('b.example') == 0
@@ -0,0 +1,87 @@
+import os
+import sys
+import queue
+import sqlite3
+import pytest
+
+# Ensure SScraper.py and sharding.py are importable
+sys.path.insert(0, os.path.dirname(os.path.dirname(__file__)))
+import SScraper
+from sharding import HashRing
+from test_db_writer import STORE, make_product
+
+@pytest.fixture
+def db(tmp_path, monkeypatch):
+    path = str(tmp_path / 'products.db')
+    monkeypatch.setattr(SScraper, 'DB_PATH', path)
+    SScraper.init_db()
+    return path
+
+def test_ring_spreads_hosts_and_moves_few_when_resized():
+    hosts = [f'store{i}.example' for i in range(2000)]
+    four = HashRing(range(4))
+    five = HashRing(range(5))
+    sizes = [len(v) for v in four.partition(hosts).values()]
+    assert len(sizes) == 4 and min(sizes) > 350
+    moved = sum(four.node_for(h) != five.node_for(h) for h in hosts)
+    # Only the hosts the new shard takes over move: about 1/5 of them
+    assert moved < len(hosts) * 0.3
+    assert all(five.node_for(h) == 4 for h in hosts if four.node_for(h) != five.node_for(h))
+
+def test_stores_of_a_host_share_a_shard():
+    urls = [f'https://store{i}.example/{path}/' for i in range(50) for path in ('en', 'fr')]
+    shards = HashRing(range(3)).partition(urls, key=lambda u: u.split('/')[2])
+    for shard_urls in shards.values():
+        hosts = {u.split('/')[2] for u in shard_urls}
+        assert all(f'https://{h}/fr/' in shard_urls for h in hosts)
+
+def test_worker_changes_are_applied_by_the_coordinator(db, monkeypatch):
+    results = queue.Queue()
+    notified = []
+    monkeypatch.setattr(SScraper, 'send_webhook_notification', lambda product, url, event_type: notified.append((product['id'], event_type)))
+    # Worker side: nothing touches the DB, writes and alerts are queued
+    monkeypatch.setattr(SScraper, 'COORDINATOR_QUEUE', results)
+    state = SScraper.StoreState(STORE)
+    state.init_product_count = 1
+    SScraper.process_products(state, [make_product(i, title=f'Bourbon {i}') for i in range(1, 4)])
+    assert sqlite3.connect(db).execute('SELECT COUNT(*) FROM products').fetchone()[0] == 0
+    assert sorted({kind for kind, _ in results.queue}) == ['notify', 'write']
+    # Coordinator side
+    monkeypatch.setattr(SScraper, 'COORDINATOR_QUEUE', None)
+    assert SScraper.drain_shard_queue(results, timeout=0) == 4
+    conn = sqlite3.connect(db)
+    assert conn.execute('SELECT id FROM products ORDER BY id').fetchall() == [(1,), (2,), (3,)]
+    assert conn.execute('SELECT COUNT(*) FROM product_events').fetchone()[0] == 3
+    assert notified == [(1, 'new'), (2, 'new'), (3, 'new')]
+
+def test_worker_refresh_keeps_changes_the_coordinator_has_not_applied(db, monkeypatch):
+    monkeypatch.setattr(SScraper, 'send_webhook_notification', lambda *args: None)
+    state = SScraper.StoreState(STORE)
+    SScraper.process_products(state, [make_product(1, available=False)])
+    monkeypatch.setattr(SScraper, 'COORDINATOR_QUEUE', queue.Queue())
+    # The restock is still in the worker's queue; meanwhile the web UI edits the older row
+    SScraper.process_products(state, [make_product(1, price='60.00', available=True)])
+    conn = sqlite3.connect(db)
+    conn.execute('UPDATE products SET ignore_notifications = 1 WHERE id = 1')
+    conn.commit()
+    state.refresh()
+    entry = state.product_availability[1]
+    assert (entry['available'], entry['price'], entry['ignore_notifications']) == (True, 60.0, 1)
+
+def test_worker_schedule_and_backoff_rows_go_through_the_coordinator(db, monkeypatch):
+    results = queue.Queue()
+    monkeypatch.setattr(SScraper, 'COORDINATOR_QUEUE', results)
+    monkeypatch.setattr(SScraper, 'HOST_BACKOFF', SScraper.HostBackoff())
+    SScraper.init_db()
+    scheduler = SScraper.StoreScheduler(db, writer=SScraper.state_writer())
+    scheduler.add(STORE)
+    scheduler.record(scheduler.next_due(timeout=5), changes=1)
+    SScraper.HOST_BACKOFF.failed('store.example', 500)
+    conn = sqlite3.connect(db)
+    assert conn.execute('SELECT COUNT(*) FROM store_schedule').fetchone()[0] == 0
+    assert conn.execute('SELECT COUNT(*) FROM host_backoff').fetchone()[0] == 0
+    assert sorted({kind for kind, _ in results.queue}) == ['backoff', 'schedule']
+    monkeypatch.setattr(SScraper, 'COORDINATOR_QUEUE', None)
+    SScraper.drain_shard_queue(results, timeout=0)
+    assert conn.execute('SELECT input_url FROM store_schedule').fetchall() == [(STORE,)]
+    assert conn.execute('SELECT host, last_status FROM host_backoff').fetchall() == [('store.example', 500)]
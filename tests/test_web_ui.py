@@ -0,0 +1,351 @@
+import os
+import sys
+import sqlite3
+import json
+import time
+import gzip
+import pytest
+
+# Ensure SScraper.py and webapp/web_ui.py are importable
+ROOT = os.path.dirname(os.path.dirname(__file__))
+sys.path.insert(0, ROOT)
+sys.path.insert(0, os.path.join(ROOT, 'webapp'))
+import SScraper
+import web_ui
+from test_db_writer import STORE, make_product
+
+@pytest.fixture
+def client(tmp_path, monkeypatch):
+    path = str(tmp_path / 'products.db')
+    monkeypatch.setattr(SScraper, 'DB_PATH', path)
+    monkeypatch.setattr(web_ui, 'DB_PATH', path)
+    monkeypatch.setattr(SScraper, 'STORE_RAW_JSON', True)
+    SScraper.init_db()
+    batch = SScraper.ProductWriteBatch(STORE)
+    for i in range(1, 6):
+        p = make_product(i, title=f'Bourbon {i}', price=f'{i * 10}.00', available=i % 2 == 1)
+        batch.add_product(i, p['handle'], p['title'], i % 2 == 1, p)
+    batch.flush()
+    web_ui.app.config['TESTING'] = True
+    with web_ui.app.test_client() as client:
+        yield client
+
+def test_list_products(client):
+    data = client.get('/api/products').get_json()
+    assert data['total'] == 5
+    assert {p['title'] for p in data['products']} == {f'Bourbon {i}' for i in range(1, 6)}
+    assert data['products'][0]['image_url'].startswith('https://cdn.example/')
+
+def test_uses_wal_journal(client):
+    client.get('/api/products')
+    conn = sqlite3.connect(web_ui.DB_PATH)
+    assert conn.execute('PRAGMA journal_mode').fetchone()[0] == 'wal'
+    conn.close()
+
+def test_ignore_and_edit_round_trip(client):
+    res = client.post('/api/products/2/ignore', json={'ignore_notifications': 1, 'input_url': STORE})
+    assert res.status_code == 200
+    res = client.post('/products/3/edit', data={'alcohol_type': 'unwanted', 'input_url': STORE})
+    assert res.status_code == 200
+    p2 = client.get(f'/api/products/2?input_url={STORE}').get_json()
+    p3 = client.get(f'/api/products/3?input_url={STORE}').get_json()
+    assert p2['ignore_notifications'] == 1
+    assert p3['alcohol_type'] == 'unwanted'
+
+def test_list_rows_are_slim_and_raw_json_is_on_demand(client):
+    row = client.get('/api/products').get_json()['products'][0]
+    assert 'original_json' not in row
+    assert row['variant_count'] == 1
+    full = client.get(f"/api/products/{row['id']}?input_url={STORE}&include_raw=1").get_json()
+    assert json.loads(full['original_json'])['images'][0]['src'] == row['image_url']
+
+def test_cursor_pages_cover_every_row_once(client):
+    seen = []
+    cursor = None
+    while True:
+        url = '/api/products?sort=price&order=asc&limit=2' + (f'&cursor={cursor}' if cursor else '')
+        data = client.get(url).get_json()
+        seen += [p['price'] for p in data['products']]
+        cursor = data['next_cursor']
+        if not cursor:
+            break
+    assert seen == [f'{i * 10}.00' for i in range(1, 6)]
+
+def test_server_side_filters_and_sort(client):
+    data = client.get('/api/products?available=1&sort=title&order=desc').get_json()
+    assert data['total'] == 3
+    assert [p['title'] for p in data['products']] == ['Bourbon 5', 'Bourbon 3', 'Bourbon 1']
+    data = client.get('/api/products?min_price=20&max_price=40&q=bourbon').get_json()
+    assert sorted(p['price'] for p in data['products']) == ['20.00', '30.00', '40.00']
+    assert client.get('/api/products?sort=original_json').status_code == 400
+    assert client.get('/api/products?cursor=not-a-cursor').status_code == 400
+
+def test_facets(client):
+    data = client.get('/api/products/facets').get_json()
+    assert data['input_urls'] == [STORE]
+    assert data['vendors']
+
+def test_search_is_ranked_prefix_match_with_snippet(client):
+    batch = SScraper.ProductWriteBatch(STORE)
+    p6 = make_product(6, title='Peated Scotch', updated_at='2025-03-01T00:00:00-05:00')
+    p6['body_html'] = '<p>Finished in <em>sherry casks</em> on the coast</p>'
+    p7 = make_product(7, title='Cask Strength Rye', updated_at='2025-03-01T00:00:00-05:00')
+    for p in (p6, p7):
+        batch.add_product(p['id'], p['handle'], p['title'], True, p)
+    batch.flush()
+    data = client.get('/api/products/search?q=cask').get_json()
+    # The title match outranks the description-only match
+    assert [p['id'] for p in data['products']] == [7, 6]
+    assert '<b>casks</b>' in data['products'][1]['snippet']
+    assert client.get('/api/products/search?q=peat scot').get_json()['total'] == 1
+    assert client.get('/api/products/search?q=bourb').get_json()['total'] == 5
+    assert client.get('/api/products/search?q=bourb&per_page=x').status_code == 400
+    assert client.get('/api/products/search?q=bourb&page=2.5').status_code == 400
+    data = client.get('/api/products/search?q=bourb&per_page=-1').get_json()
+    assert len(data['products']) == data['per_page'] == 1
+
+def test_search_index_follows_edits_and_deletes(client):
+    client.post('/products/2/edit', data={'title': 'Wheated Whiskey', 'input_url': STORE})
+    client.delete('/api/products/3')
+    titles = {p['title'] for p in client.get('/api/products/search?q=bourbon').get_json()['products']}
+    assert 'Bourbon 3' not in titles and 'Bourbon 2' not in titles
+    assert [p['id'] for p in client.get('/api/products?q=whea').get_json()['products']] == [2]
+
+def test_deleting_a_product_drops_its_raw_json(client):
+    conn = sqlite3.connect(web_ui.DB_PATH)
+    # A file from before products_raw_ad: its already-deleted products left product_raw rows behind
+    conn.execute('DROP TRIGGER products_raw_ad')
+    conn.execute('DELETE FROM products WHERE id = 4')
+    conn.execute('PRAGMA user_version = 3')
+    conn.commit()
+    SScraper.init_db()
+    assert client.delete('/api/products/3').status_code == 200
+    assert [r[0] for r in conn.execute('SELECT id FROM product_raw ORDER BY id')] == [1, 2, 5]
+
+def test_schedule_endpoint(client):
+    from scheduler import StoreScheduler
+    sched = StoreScheduler(web_ui.DB_PATH)
+    sched.add(STORE)
+    sched.record(STORE, 3)
+    stores = client.get('/api/schedule').get_json()['stores']
+    assert [s['input_url'] for s in stores] == [STORE]
+    assert stores[0]['polls'] == 1
+
+def test_backoff_endpoint(client):
+    from scheduler import HostBackoff
+    HostBackoff(web_ui.DB_PATH).throttled('store.example', retry_after=600)
+    hosts = client.get('/api/backoff').get_json()['hosts']
+    assert [(h['host'], h['throttled'], h['last_status']) for h in hosts] == [('store.example', 1, 429)]
+    assert hosts[0]['ready_at'] is not None
+
+def test_same_product_at_other_stores(client):
+    other = 'https://other.example/'
+    p = make_product(9, title='Bourbon 1', price='5.00')
+    batch = SScraper.ProductWriteBatch(other)
+    batch.add_product(9, p['handle'], p['title'], True, p)
+    batch.flush()
+    listings = client.get(f'/api/products/1/stores?input_url={STORE}').get_json()['products']
+    assert [(r['input_url'], r['price']) for r in listings] == [(other, '5.00'), (STORE, '10.00')]
+    overlap = client.get('/api/canonical').get_json()['products']
+    assert [(c['title'], c['store_count']) for c in overlap] == [('Bourbon 1', 2)]
+
+def test_product_history_endpoint(client):
+    state = SScraper.StoreState(STORE)
+    SScraper.process_products(state, [make_product(1, available=False, updated_at='2025-02-01')])
+    SScraper.process_products(state, [make_product(1, available=True, updated_at='2025-02-02')])
+    data = client.get(f'/api/products/1/history?input_url={STORE}').get_json()
+    assert [(e['old_available'], e['new_available']) for e in data['events']] == [(1, 0), (0, 1)]
+    assert data['periods'][-1]['end'] is None
+    recent = client.get('/api/history?since=2020-01-01').get_json()['events']
+    assert {(e['id'], e['title']) for e in recent} == {(1, 'Rare Bourbon')}
+    assert client.get('/api/history?since=yesterday').status_code == 400
+
+def test_stats_endpoint(client):
+    stats = client.get('/api/stats').get_json()
+    assert (stats['total'], stats['available'], stats['vendors']) == (5, 3, 1)
+    assert (stats['min_price'], stats['max_price'], stats['avg_price']) == (10.0, 50.0, 30.0)
+    assert stats['alcohol_types'] == {'Bourbon': 5}
+    assert stats['top_vendors'] == [['Distillery', 5]]
+    assert stats['last_updated'] == '2025-01-01 05:00:00'
+    assert client.get('/api/stats?available=0').get_json()['total'] == 2
+    # A scraper write bumps the change counter, so the cached figures are recomputed
+    batch = SScraper.ProductWriteBatch(STORE)
+    p = make_product(6, title='Bourbon 6', price='5.00')
+    batch.add_product(6, p['handle'], p['title'], True, p)
+    batch.flush()
+    fresh = client.get('/api/stats').get_json()
+    assert (fresh['total'], fresh['min_price']) == (6, 5.0)
+    assert fresh['change_seq'] > stats['change_seq']
+
+LOG_LINES = [
+    '2025-01-01 00:00:00 [MainThread][Thread-1][INFO] starting',
+    '2025-01-01 00:00:01 [Worker 0][Thread-2][DEBUG] fetched page 1',
+    '2025-01-01 00:00:02 [Worker 1][Thread-3][ERROR] Error getting products',
+    'Traceback (most recent call last):',
+    '  boom',
+    '2025-01-01 00:00:03 [Worker 0][Thread-2][WARNING] backing off',
+]
+
+@pytest.fixture
+def log_file(tmp_path, monkeypatch):
+    path = tmp_path / 'scraper.log'
+    path.write_text('\n'.join(LOG_LINES) + '\n')
+    monkeypatch.setattr(web_ui, 'LOG_PATH', str(path))
+    return path
+
+def test_log_tail_and_filters(client, log_file):
+    data = client.get('/api/logs?limit=2').get_json()
+    assert [r['level'] for r in data['records']] == ['ERROR', 'WARNING']
+    assert data['records'][0]['text'].endswith('  boom')
+    assert [r['level'] for r in client.get('/api/logs?level=warning').get_json()['records']] == ['ERROR', 'WARNING']
+    assert [r['thread'] for r in client.get('/api/logs?thread=Worker 0').get_json()['records']] == ['Worker 0', 'Worker 0']
+    assert [r['level'] for r in client.get('/api/logs?q=PAGE').get_json()['records']] == ['DEBUG']
+    assert client.get('/api/logs?level=loud').status_code == 400
+
+def test_log_cursor_follows_appends_and_rotation(client, log_file):
+    cursor = client.get('/api/logs').get_json()['cursor']
+    with open(log_file, 'a') as f:
+        f.write('2025-01-01 00:00:04 [Worker 0][Thread-2][INFO] one\n2025-01-01 00:00:05 [Worker 0][Thread-2][INFO] partial')
+    data = client.get(f'/api/logs?cursor={cursor}').get_json()
+    assert [r['text'][-3:] for r in data['records']] == ['one']
+    # The handler finishes the line, then rotates: the rest of the old file is read before the new one
+    with open(log_file, 'a') as f:
+        f.write(' line\n')
+    os.rename(log_file, str(log_file) + '.2025-01-01')
+    log_file.write_text('2025-01-02 00:00:00 [MainThread][Thread-1][INFO] new day\n')
+    data = client.get(f"/api/logs?cursor={data['cursor']}").get_json()
+    assert [r['text'][-12:] for r in data['records']] == ['partial line'] and data['more']
+    data = client.get(f"/api/logs?cursor={data['cursor']}").get_json()
+    assert [r['text'][-7:] for r in data['records']] == ['new day']
+
+def test_log_stream_sends_new_records(client, log_file, monkeypatch):
+    monkeypatch.setattr(web_ui, 'LOG_STREAM_POLL', 0.01)
+    res = client.get('/api/logs/stream?level=INFO')
+    assert res.mimetype == 'text/event-stream'
+    stream = res.response
+    assert next(stream).decode().startswith('retry:')
+    with open(log_file, 'a') as f:
+        f.write('2025-01-01 00:00:04 [Worker 0][Thread-2][DEBUG] hidden\n2025-01-01 00:00:05 [Worker 0][Thread-2][INFO] shown\n')
+    event = next(stream).decode()
+    assert event.startswith('id: ') and 'event: logs' in event
+    records = json.loads(event.split('data: ', 1)[1])
+    assert [r['text'][-5:] for r in records] == ['shown']
+    res.close()
+
+def test_sort_keys_and_filters_use_indexes(client):
+    conn = sqlite3.connect(web_ui.DB_PATH)
+    # A file whose vendor index predates the sort key expressions is re-indexed by the migration
+    conn.execute('DROP INDEX idx_products_vendor')
+    conn.execute('CREATE INDEX idx_products_vendor ON products (vendor)')
+    conn.execute('PRAGMA user_version = 2')
+    conn.commit()
+    conn.close()
+    SScraper.init_db()
+    conn = sqlite3.connect(web_ui.DB_PATH)
+
+    def plan(sql, params=()):
+        return ' '.join(row[3] for row in conn.execute(f'EXPLAIN QUERY PLAN {sql}', params))
+    for key, expr in web_ui.SORT_KEYS.items():
+        if key != 'id':
+            assert f'INDEX idx_products_{key}' in plan(f'SELECT id FROM products ORDER BY {expr} DESC, id DESC, input_url DESC LIMIT 10')
+    clauses, params = web_ui.product_filters({'vendor': 'Distillery', 'available': '1'})
+    assert 'INDEX idx_products_' in plan(f'SELECT id FROM products{web_ui.where_sql(clauses)}', params)
+    assert client.get('/api/products?vendor=Distillery').get_json()['total'] == 5
+
+def test_metrics_endpoint(client, monkeypatch):
+    from metrics import start_metrics_server
+    from test_metrics import free_port
+    monkeypatch.setattr(web_ui, 'METRICS_URL', 'http://127.0.0.1:1/metrics.json')
+    assert client.get('/api/metrics').status_code == 503
+    server = start_metrics_server(port=free_port())
+    try:
+        monkeypatch.setattr(web_ui, 'METRICS_URL', f'http://127.0.0.1:{server.server_address[1]}/metrics.json')
+        data = client.get('/api/metrics?prefix=scraper_db_write').get_json()
+        assert set(data['metrics']) == {'scraper_db_write_seconds', 'scraper_db_write_rows_total'}
+        assert data['metrics']['scraper_db_write_seconds']['type'] == 'histogram'
+    finally:
+        server.shutdown()
+        server.server_close()
+
+def test_metrics_of_every_shard_are_added_up(client, monkeypatch):
+    from metrics import start_metrics_server
+    from test_metrics import free_port, shard_registry
+    down = 'http://127.0.0.1:1/metrics.json'
+    monkeypatch.setattr(web_ui, 'METRICS_URL', down)
+    res = client.get('/api/metrics')
+    assert res.status_code == 503 and b'Scraper metrics unreachable' in res.data
+    servers = [start_metrics_server(port=free_port(), registry=shard_registry({'a.example': n}, [0.5] * n)) for n in (1, 2)]
+    try:
+        urls = [f'http://127.0.0.1:{s.server_address[1]}/metrics.json' for s in servers]
+        monkeypatch.setattr(web_ui, 'METRICS_URL', ','.join(urls + [down]))
+        data = client.get('/api/metrics').get_json()
+        assert data['metrics']['fetch_responses_total']['series'][0]['value'] == 3
+        assert data['metrics']['latency_seconds']['series'][0]['count'] == 3
+        assert [u['url'] for u in data['unreachable']] == [down]
+    finally:
+        for server in servers:
+            server.shutdown()
+            server.server_close()
+
+def test_bulk_update(client):
+    keys = [{'id': i, 'input_url': STORE} for i in (1, 2, 3)] + [{'id': 99, 'input_url': STORE}]
+    res = client.post('/api/products/bulk', json={'keys': keys, 'patch': {'alcohol_type': 'unwanted', 'ignore_notifications': 1}})
+    data = res.get_json()
+    assert (data['updated'], data['not_found']) == (3, 1)
+    assert [r['status'] for r in data['results']] == ['updated', 'updated', 'updated', 'not_found']
+    conn = sqlite3.connect(web_ui.DB_PATH)
+    rows = conn.execute('SELECT id, alcohol_type, ignore_notifications FROM products ORDER BY id').fetchall()
+    assert [r for r in rows if r[1] == 'unwanted'] == [(1, 'unwanted', 1), (2, 'unwanted', 1), (3, 'unwanted', 1)]
+    assert client.get('/api/products?show_unwanted=0').get_json()['total'] == 2
+    assert client.post('/api/products/bulk', json={'keys': keys, 'patch': {'id': 5}}).status_code == 400
+    assert client.post('/api/products/bulk', json={'keys': [], 'patch': {'available': 1}}).status_code == 400
+
+def test_change_feed(client, monkeypatch):
+    since = client.get('/api/products?limit=1').get_json()['change_seq']
+    assert client.get(f'/api/products/changes?since={since}').get_json()['changes'] == []
+    batch = SScraper.ProductWriteBatch(STORE)
+    p = make_product(2, title='Bourbon 2', price='15.00')
+    batch.add_product(2, p['handle'], p['title'], True, p)
+    batch.flush()
+    client.delete(f'/api/products/3?input_url={STORE}')
+    client.post('/api/products/bulk', json={'keys': [{'id': 4, 'input_url': STORE}], 'patch': {'ignore_notifications': 1}})
+    data = client.get(f'/api/products/changes?since={since}&limit=1').get_json()
+    assert [(r['id'], r['price']) for r in data['changes']] == [(2, '15.00')]
+    assert data['more'] and data['deleted'] == []
+    data = client.get(f"/api/products/changes?since={data['cursor']}").get_json()
+    assert [(r['id'], r['ignore_notifications']) for r in data['changes']] == [(4, 1)]
+    assert [(d['id'], d['input_url']) for d in data['deleted']] == [(3, STORE)]
+    assert not data['more'] and not data['reset']
+    assert client.get(f"/api/products/changes?since={data['cursor']}").get_json()['changes'] == []
+    # Once the tombstones are pruned, a client that far behind has to reload
+    SScraper.prune_tombstones(SScraper.get_connection(web_ui.DB_PATH), now=time.time() + 30 * 86400)
+    assert client.get(f'/api/products/changes?since={since}').get_json()['reset']
+
+def test_change_stream(client, monkeypatch):
+    monkeypatch.setattr(web_ui, 'CHANGES_STREAM_POLL', 0.01)
+    since = client.get('/api/products?limit=1').get_json()['change_seq']
+    res = client.get(f'/api/products/changes/stream?since={since}')
+    stream = res.response
+    assert next(stream).decode().startswith('retry:')
+    client.post('/api/products/bulk', json={'keys': [{'id': 1, 'input_url': STORE}], 'patch': {'alcohol_type': 'rum'}})
+    event = next(stream).decode()
+    assert event.startswith(f'id: {since + 1}\n') and 'event: changes' in event
+    batch = json.loads(event.split('data: ', 1)[1])
+    assert [(r['id'], r['alcohol_type']) for r in batch['changes']] == [(1, 'rum')]
+    res.close()
+
+def test_list_responses_are_compressed_and_revalidated(client, monkeypatch):
+    monkeypatch.setattr(web_ui, 'COMPRESS_MIN_BYTES', 0)
+    res = client.get('/api/products?limit=3', headers={'Accept-Encoding': 'gzip'})
+    assert res.headers['Content-Encoding'] == 'gzip' and res.headers['Vary'] == 'Accept-Encoding'
+    data = json.loads(gzip.decompress(res.data))
+    assert [p['title'] for p in data['products']] == [p['title'] for p in client.get('/api/products?limit=3').get_json()['products']]
+    etag = res.headers['ETag']
+    assert client.get('/api/products?limit=3', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag}).status_code == 304
+    assert client.get('/api/products?limit=2', headers={'If-None-Match': etag}).status_code == 200
+    # A write moves the change counter, so the old tag no longer matches and the page is rebuilt
+    client.post('/api/products/bulk', json={'keys': [{'id': 5, 'input_url': STORE}], 'patch': {'title': 'Rye 5'}})
+    res = client.get('/api/products?limit=3', headers={'Accept-Encoding': 'gzip', 'If-None-Match': etag})
+    assert res.status_code == 200 and res.headers['ETag'] != etag
+    assert 'Rye 5' in {p['title'] for p in json.loads(gzip.decompress(res.data))['products']}
+    assert client.get('/api/products/facets').get_json()['vendors']
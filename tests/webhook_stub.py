@@ -0,0 +1,80 @@
+"""
+Local stand-in for a Discord webhook, used by the notifier tests and benchmarks/bench_notifier.py.
+
+Accepts JSON posts, records them, and enforces a Discord-style rate limit: `limit` messages per `window`
+seconds, advertised through X-RateLimit-* headers and answered with 429 + retry_after once exceeded.
+Messages with more than 10 embeds or more than 6000 characters of embed text get a 400, as on Discord.
+`fail_next` makes the next N posts return 500.
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+class WebhookStub:
+    def __init__(self, limit=5, window=2.0, latency=0.0):
+        self.limit = limit
+        self.window = window
+        self.latency = latency
+        self.messages = []  # Accepted JSON payloads
+        self.rate_limited = 0
+        self.fail_next = 0
+        self.lock = threading.Lock()
+        self.window_start = time.monotonic()
+        self.window_count = 0
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def log_message(self, *args):
+                pass
+
+            def do_POST(self):
+                body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+                if stub.latency:
+                    time.sleep(stub.latency)
+                status, reply, headers = stub.handle(json.loads(body or b'{}'))
+                data = json.dumps(reply).encode() if reply is not None else b''
+                self.send_response(status)
+                for name, value in headers.items():
+                    self.send_header(name, value)
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+        self.server = ThreadingHTTPServer(('127.0.0.1', 0), Handler)
+        self.url = f'http://127.0.0.1:{self.server.server_port}/api/webhooks/1/token'
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def handle(self, payload):
+        with self.lock:
+            if self.fail_next:
+                self.fail_next -= 1
+                return 500, {'message': 'Internal Server Error'}, {}
+            now = time.monotonic()
+            if now - self.window_start >= self.window:
+                self.window_start, self.window_count = now, 0
+            reset_after = self.window - (now - self.window_start)
+            if self.window_count >= self.limit:
+                self.rate_limited += 1
+                return 429, {'message': 'You are being rate limited.', 'retry_after': round(reset_after, 3), 'global': False}, {}
+            embeds = payload.get('embeds', ())
+            text = sum(len(e.get('title', '')) + len(e.get('description', '')) + sum(len(f['name']) + len(f['value']) for f in e.get('fields', ()))
+                       + len(e.get('footer', {}).get('text', '')) + len(e.get('author', {}).get('name', '')) for e in embeds)
+            if len(embeds) > 10 or text > 6000 or not (embeds or payload.get('content')):
+                return 400, {'message': 'Invalid Form Body'}, {}
+            self.window_count += 1
+            self.messages.append(payload)
+            headers = {
+                'X-RateLimit-Limit': str(self.limit),
+                'X-RateLimit-Remaining': str(self.limit - self.window_count),
+                'X-RateLimit-Reset-After': f'{reset_after:.3f}',
+            }
+            return 204, None, headers
+
+    @property
+    def embeds(self):
+        return [e for m in self.messages for e in m.get('embeds', ())]
+
+    def close(self):
+        self.server.shutdown()
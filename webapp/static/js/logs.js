@@ -1,56 +1,104 @@
 // logs.js - client-side logic for /logs page
-let rawLog = document.getElementById('logContent').textContent;
+// The tail comes from /api/logs and live updates from the /api/logs/stream SSE feed; filtering happens on the server.
 const logContent = document.getElementById('logContent');
 const searchBox = document.getElementById('logSearch');
+const levelFilter = document.getElementById('logLevel');
+const threadFilter = document.getElementById('logThread');
 const autoRefresh = document.getElementById('autoRefresh');
 const logStatus = document.getElementById('logStatus');
-let refreshTimer = null;
+const TAIL_LINES = 1000;
+const MAX_RECORDS = 5000;  // Oldest records are dropped from the page beyond this
+let records = [];
+let cursor = null;
+let source = null;
+let filterTimer = null;
 
 function scrollLogToBottom() {
     logContent.parentElement.scrollTop = logContent.parentElement.scrollHeight;
 }
 
-function filterLog() {
-    const q = searchBox.value.toLowerCase();
-    if (!q) {
-        logContent.textContent = rawLog;
-        logStatus.textContent = '';
-        scrollLogToBottom();
-        return;
-    }
-    const lines = rawLog.split('\n');
-    const filtered = lines.filter(line => line.toLowerCase().includes(q));
-    logContent.textContent = filtered.join('\n');
-    logStatus.textContent = `${filtered.length} of ${lines.length} lines shown`;
+function filterParams() {
+    const params = new URLSearchParams();
+    if (searchBox.value.trim()) params.set('q', searchBox.value.trim());
+    if (levelFilter.value) params.set('level', levelFilter.value);
+    if (threadFilter.value.trim()) params.set('thread', threadFilter.value.trim());
+    return params;
+}
+
+function renderLog() {
+    logContent.textContent = records.map(r => r.text).join('\n');
+    const filtered = filterParams().toString() !== '';
+    logStatus.textContent = `${records.length} ${filtered ? 'matching ' : ''}records` + (source ? ' - live' : '');
     scrollLogToBottom();
 }
 
-searchBox.addEventListener('input', filterLog);
+function appendRecords(newRecords) {
+    if (!newRecords.length) return;
+    records = records.concat(newRecords);
+    if (records.length > MAX_RECORDS) records = records.slice(records.length - MAX_RECORDS);
+    renderLog();
+}
+
+async function loadTail() {
+    const params = filterParams();
+    params.set('limit', TAIL_LINES);
+    try {
+        const res = await fetch(`/api/logs?${params}`);
+        if (!res.ok) throw new Error('Failed to load logs');
+        const data = await res.json();
+        records = data.records;
+        cursor = data.cursor;
+        if (!cursor) {
+            logContent.textContent = 'Log file not found.';
+            return;
+        }
+        renderLog();
+    } catch (err) {
+        logStatus.textContent = err.message;
+    }
+}
+
+function startStream() {
+    stopStream();
+    const params = filterParams();
+    if (cursor) params.set('cursor', cursor);
+    source = new EventSource(`/api/logs/stream?${params}`);
+    source.addEventListener('logs', e => {
+        cursor = e.lastEventId;
+        appendRecords(JSON.parse(e.data));
+    });
+    renderLog();
+}
+
+function stopStream() {
+    if (source) {
+        source.close();
+        source = null;
+    }
+}
 
-function fetchLog() {
-    fetch(window.location.pathname)
-        .then(r => r.text())
-        .then(html => {
-            // Extract log_content from the HTML (simple, not robust to template changes)
-            const match = html.match(/<pre id="logContent"[^>]*>([\s\S]*?)<\/pre>/);
-            if (match) {
-                rawLog = match[1].replace(/&lt;/g, '<').replace(/&gt;/g, '>').replace(/&amp;/g, '&');
-                filterLog();
-            }
-        });
+async function reload() {
+    stopStream();
+    await loadTail();
+    if (autoRefresh.checked) startStream();
 }
 
+function onFilterChange() {
+    clearTimeout(filterTimer);
+    filterTimer = setTimeout(reload, 300);
+}
+
+searchBox.addEventListener('input', onFilterChange);
+threadFilter.addEventListener('input', onFilterChange);
+levelFilter.addEventListener('change', reload);
+
 autoRefresh.addEventListener('change', function() {
     if (autoRefresh.checked) {
-        refreshTimer = setInterval(fetchLog, 5000);
-        logStatus.textContent = 'Auto-refreshing every 5s';
+        startStream();
     } else {
-        clearInterval(refreshTimer);
-        logStatus.textContent = '';
+        stopStream();
+        renderLog();
     }
 });
 
-// Scroll to bottom on initial load
-window.onload = function() {
-    scrollLogToBottom();
-};
+window.onload = reload;
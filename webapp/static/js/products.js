@@ -1,44 +1,79 @@
+// Rows are filtered, sorted and paged by /api/products; only the visible page is held in memory.
 let products = [];
-let filtered = [];
-let sortKey = 'id';
-let sortAsc = true;
+// (id, input_url) key -> row of the visible page, rebuilt whenever products is replaced
+let productIndex = new Map();
+let sortKey = 'last_seen';
+let sortAsc = false;
 const perPage = 50;
-const backendChunkSize = 5000;
 let currentPage = 1;
 let totalPages = 1;
 let totalRecords = 0;
-let allDataLoaded = false;
+// cursors[i] is the keyset cursor that loads page i + 1 (page 1 needs none)
+let cursors = [null];
+let facets = { vendors: [], alcohol_types: [], input_urls: [] };
+let searchTimer = null;
 
 // --- Bulk selection state ---
-let selectedProductIds = new Set();
+// key -> {id, input_url}; keeps the store of products selected on other pages
+let selectedProducts = new Map();
 
-async function fetchProducts(page = 1, append = false) {
+function productKey(p) {
+    return `${parseInt(p.id, 10)}|${p.input_url || ''}`;
+}
+
+function indexProducts() {
+    productIndex = new Map(products.map(p => [productKey(p), p]));
+}
+
+function filterParams() {
+    const params = new URLSearchParams();
+    const q = document.getElementById('searchInput').value.trim();
+    if (q) params.set('q', q);
+    [['vendor', 'vendorFilter'], ['alcohol_type', 'typeFilter'], ['available', 'availableFilter'],
+     ['input_url', 'inputUrlFilter'], ['ignore_notifications', 'ignoreFilter']].forEach(([name, id]) => {
+        const value = document.getElementById(id).value;
+        if (value !== '') params.set(name, value);
+    });
+    if (!document.getElementById('showUnwantedCheckbox').checked) params.set('show_unwanted', '0');
+    params.set('sort', sortKey);
+    params.set('order', sortAsc ? 'asc' : 'desc');
+    return params;
+}
+
+async function fetchPage(params, cursor, limit) {
+    params = new URLSearchParams(params);
+    params.set('limit', limit);
+    if (cursor) params.set('cursor', cursor);
+    const res = await fetch(`/api/products?${params}`);
+    if (!res.ok) throw new Error('Failed to fetch products');
+    return res.json();
+}
+
+async function fetchProducts(page = 1) {
     document.getElementById('loading').style.display = '';
     document.getElementById('errorMsg').style.display = 'none';
     try {
-        const chunkPage = Math.floor((products.length) / backendChunkSize) + 1;
-        const res = await fetch(`/api/products?page=${chunkPage}&per_page=${backendChunkSize}`);
-        if (!res.ok) throw new Error('Failed to fetch products');
-        const data = await res.json();
-        if (append) {
-            products = products.concat(data.products);
+        // Keyset cursors only reach the page after one already visited; jump with an offset otherwise
+        const params = filterParams();
+        let data;
+        if (page <= cursors.length && (page === 1 || cursors[page - 1])) {
+            data = await fetchPage(params, cursors[page - 1], perPage);
         } else {
-            products = data.products;
+            params.set('page', page);
+            data = await fetchPage(params, null, perPage);
         }
-        filtered = [...products];
+        products = data.products;
+        indexProducts();
+        offPageChanges = 0;
+        document.getElementById('liveNotice').style.display = 'none';
+        followChanges(data.change_seq);
+        cursors[page] = data.next_cursor;
+        currentPage = page;
         totalRecords = data.total;
         totalPages = Math.ceil(totalRecords / perPage) || 1;
-        if (products.length < totalRecords) {
-            // Continue loading next chunk in background
-            fetchProducts(page, true).then(() => {
-                populateFilters();
-                filterTable();
-            });
-        } else {
-            allDataLoaded = true;
-        }
-        populateFilters();
-        filterTable();
+        renderTable();
+        renderPagination();
+        saveState();
     } catch (err) {
         document.getElementById('errorMsg').textContent = err.message;
         document.getElementById('errorMsg').style.display = '';
@@ -47,55 +82,92 @@ async function fetchProducts(page = 1, append = false) {
     }
 }
 
-function computeStats(list) {
-    const total = list.length;
-    const available = list.filter(p => p.available).length;
-    const vendors = [...new Set(list.map(p => p.vendor).filter(Boolean))];
-    const alcoholTypes = {};
-    list.forEach(p => {
-        if (p.alcohol_type) alcoholTypes[p.alcohol_type] = (alcoholTypes[p.alcohol_type]||0)+1;
-    });
-    const prices = list.map(p => parseFloat(p.price)).filter(x => !isNaN(x));
-    const minPrice = prices.length ? Math.min(...prices) : null;
-    const maxPrice = prices.length ? Math.max(...prices) : null;
-    const avgPrice = prices.length ? (prices.reduce((a,b)=>a+b,0)/prices.length) : null;
-    const vendorCounts = {};
-    list.forEach(p => { if (p.vendor) vendorCounts[p.vendor]=(vendorCounts[p.vendor]||0)+1; });
-    const mostPopularVendors = Object.entries(vendorCounts).sort((a,b)=>b[1]-a[1]).slice(0,3);
-    const lastUpdated = list.length ? list.map(p => p.updated_at).filter(Boolean).sort().reverse()[0] : null;
-    return {
-        total, available, vendors, alcoholTypes, minPrice, maxPrice, avgPrice, mostPopularVendors, lastUpdated
-    };
+async function fetchFacets() {
+    try {
+        const res = await fetch('/api/products/facets');
+        if (!res.ok) throw new Error('Failed to fetch filter values');
+        facets = await res.json();
+        populateFilters();
+    } catch (err) {
+        console.warn(err.message);
+    }
 }
 
-function renderStatsPanel() {
-    const stats = computeStats(filtered);
-    const allStats = computeStats(products);
-    let html = '';
-    html += `<div><b>Total Products:</b> ${allStats.total}</div>`;
-    html += `<div><b>Available:</b> ${allStats.available}</div>`;
-    html += `<div><b>Unique Vendors:</b> ${allStats.vendors.length}</div>`;
-    html += `<div><b>Last Updated:</b> ${allStats.lastUpdated ? formatDate(allStats.lastUpdated) : '-'}</div>`;
-    html += `<div><b>Alcohol Types:</b> ` + Object.entries(allStats.alcoholTypes).map(([k,v])=>`${k} (${v})`).join(', ') + `</div>`;
-    html += `<div><b>Price:</b> Min ${allStats.minPrice!==null?allStats.minPrice.toFixed(2):'-'}, Max ${allStats.maxPrice!==null?allStats.maxPrice.toFixed(2):'-'}, Avg ${allStats.avgPrice!==null?allStats.avgPrice.toFixed(2):'-'}</div>`;
-    html += `<div><b>Top Vendors:</b> ` + (allStats.mostPopularVendors.length ? allStats.mostPopularVendors.map(([v,c])=>`${v} (${c})`).join(', ') : '-') + `</div>`;
-    html += `<div><b>Showing:</b> ${filtered.length} of ${products.length} products</div>`;
-    document.getElementById('statsPanel').innerHTML = html;
+// Stats for the current filters come from /api/stats; refetched only when the filters change or data is edited
+let stats = null;
+let statsQuery = null;
+
+async function fetchStats() {
+    const params = filterParams();
+    params.delete('sort');
+    params.delete('order');
+    const query = params.toString();
+    if (stats && query === statsQuery) return stats;
+    const res = await fetch(`/api/stats?${query}`);
+    if (!res.ok) throw new Error('Failed to fetch stats');
+    stats = await res.json();
+    statsQuery = query;
+    return stats;
+}
+
+function invalidateStats() {
+    statsQuery = null;
+}
+
+// --- Live updates: /api/products/changes/stream patches the visible page in place ---
+let changeStream = null;
+let offPageChanges = 0;
+
+function followChanges(cursor) {
+    if (changeStream || cursor === undefined || cursor === null || !window.EventSource) return;
+    changeStream = new EventSource(`/api/products/changes/stream?since=${cursor}`);
+    changeStream.addEventListener('changes', event => applyChanges(JSON.parse(event.data)));
+}
+
+function applyChanges(batch) {
+    if (batch.reset) {
+        // Too far behind to know what was deleted: reload the page (the stream carries on from the new cursor)
+        fetchProducts(currentPage);
+        return;
+    }
+    let touched = 0;
+    batch.deleted.forEach(d => {
+        const product = productIndex.get(productKey(d));
+        if (product) {
+            products.splice(products.indexOf(product), 1);
+            touched++;
+        }
+    });
+    if (touched) indexProducts();
+    batch.changes.forEach(row => {
+        const product = productIndex.get(productKey(row));
+        if (product) {
+            Object.assign(product, row);
+            touched++;
+        } else {
+            offPageChanges++;
+        }
+    });
+    if (!touched && !offPageChanges) return;
+    invalidateStats();
+    if (touched) renderTable();
+    const notice = document.getElementById('liveNotice');
+    notice.textContent = offPageChanges ? `${offPageChanges} product change${offPageChanges === 1 ? '' : 's'} elsewhere in the catalog. Click to refresh.` : '';
+    notice.style.display = offPageChanges ? '' : 'none';
 }
 
 function renderTable() {
     const body = document.getElementById('productsBody');
     body.innerHTML = '';
-    const start = (currentPage - 1) * perPage;
-    const end = Math.min(start + perPage, filtered.length);
-    for (let i = start; i < end; i++) {
-        const p = filtered[i];
+    for (let i = 0; i < products.length; i++) {
+        const p = products[i];
         const availClass = p.available ? 'availability-yes' : 'availability-no';
         const availText = p.available ? 'Yes' : 'No';
-        const checked = selectedProductIds.has(parseInt(p.id, 10)) ? 'checked' : '';
+        const key = productKey(p);
+        const checked = selectedProducts.has(key) ? 'checked' : '';
         const row = document.createElement('tr');
         row.innerHTML = `
-            <td><input type="checkbox" class="select-product-checkbox" data-id="${parseInt(p.id, 10)}" ${checked}></td>
+            <td><input type="checkbox" class="select-product-checkbox" data-key="${key}" ${checked}></td>
             <td>${p.image_url ? `<img src="${p.image_url}" class="product-img">` : ''}</td>
             <td><a href="${p.url}" target="_blank">${p.title}</a></td>
             <td>${p.price || ''}</td>
@@ -104,10 +176,10 @@ function renderTable() {
             <td>${p.alcohol_type || ''}</td>
             <td><span class="date-cell">${p.published_at || ''}</span></td>
             <td><span class="date-cell">${p.updated_at || ''}</span></td>
-            <td><input type="checkbox" class="ignore-notifications-toggle" data-id="${parseInt(p.id, 10)}" ${p.ignore_notifications ? 'checked' : ''}></td>
+            <td><input type="checkbox" class="ignore-notifications-toggle" data-key="${key}" ${p.ignore_notifications ? 'checked' : ''}></td>
             <td>
                 <button class="expand-btn" data-idx="${i}" style="background:none;border:none;font-size:18px;cursor:pointer;">▶</button>
-                <button class="edit-btn" data-id="${p.id}" style="margin-left:8px;padding:4px 10px;font-size:14px;background:#2563eb;color:#fff;border:none;border-radius:4px;">Edit</button>
+                <button class="edit-btn" data-key="${key}" style="margin-left:8px;padding:4px 10px;font-size:14px;background:#2563eb;color:#fff;border:none;border-radius:4px;">Edit</button>
             </td>
         `;
         body.appendChild(row);
@@ -123,7 +195,7 @@ function renderTable() {
                 <b>Became Available At:</b> <span class="date-cell">${p.became_available_at || ''}</span><br>
                 <b>Became Unavailable At:</b> <span class="date-cell">${p.became_unavailable_at || ''}</span><br>
                 <b>Date Added:</b> <span class="date-cell">${p.date_added || ''}</span><br>
-                <b>Ignore Notifications:</b> <input type="checkbox" class="ignore-notifications-toggle" data-id="${parseInt(p.id, 10)}" ${p.ignore_notifications ? 'checked' : ''}> <span style="font-size:13px;color:#888;">(Suppress webhook alerts for this product)</span>
+                <b>Ignore Notifications:</b> <input type="checkbox" class="ignore-notifications-toggle" data-key="${key}" ${p.ignore_notifications ? 'checked' : ''}> <span style="font-size:13px;color:#888;">(Suppress webhook alerts for this product)</span>
             </div>
         </td>`;
         body.appendChild(details);
@@ -132,7 +204,7 @@ function renderTable() {
     document.querySelectorAll('.expand-btn').forEach(btn => {
         btn.onclick = function() {
             const idx = parseInt(btn.getAttribute('data-idx'));
-            const detailsRow = body.children[(idx - start) * 2 + 1];
+            const detailsRow = body.children[idx * 2 + 1];
             if (detailsRow.style.display === 'none') {
                 detailsRow.style.display = '';
                 btn.textContent = '▼';
@@ -145,20 +217,18 @@ function renderTable() {
     // Add ignore_notifications toggle logic
     document.querySelectorAll('.ignore-notifications-toggle').forEach(toggle => {
         toggle.onchange = async function() {
-            const id = parseInt(toggle.getAttribute('data-id'), 10);
+            const product = productIndex.get(toggle.getAttribute('data-key'));
+            if (!product) return;
             const checked = toggle.checked ? 1 : 0;
-            const product = products.find(p => parseInt(p.id, 10) === id);
-            const input_url = product && product.input_url ? product.input_url : '';
             try {
-                const res = await fetch(`/api/products/${id}/ignore`, {
+                const res = await fetch(`/api/products/${product.id}/ignore`, {
                     method: 'POST',
                     headers: { 'Content-Type': 'application/json' },
-                    body: JSON.stringify({ ignore_notifications: checked, input_url })
+                    body: JSON.stringify({ ignore_notifications: checked, input_url: product.input_url || '' })
                 });
                 if (!res.ok) throw new Error('Failed to update ignore_notifications');
                 // Update local data
-                products.forEach(p => { if (p.id == id) p.ignore_notifications = checked; });
-                filtered.forEach(p => { if (p.id == id) p.ignore_notifications = checked; });
+                product.ignore_notifications = checked;
             } catch (err) {
                 alert('Error updating ignore_notifications: ' + err.message);
             }
@@ -167,8 +237,7 @@ function renderTable() {
     // Add edit modal logic
     document.querySelectorAll('.edit-btn').forEach(btn => {
         btn.onclick = function() {
-            const id = parseInt(btn.getAttribute('data-id'), 10);
-            const product = products.find(p => parseInt(p.id, 10) === id);
+            const product = productIndex.get(btn.getAttribute('data-key'));
             if (!product) return;
             document.getElementById('editProductId').value = product.id;
             document.getElementById('editProductTitle').value = product.title || '';
@@ -204,24 +273,21 @@ function renderTable() {
                 body: `title=${encodeURIComponent(title)}&price=${encodeURIComponent(price)}&available=${encodeURIComponent(available)}&vendor=${encodeURIComponent(vendor)}&alcohol_type=${encodeURIComponent(alcohol_type)}&ignore_notifications=${encodeURIComponent(ignore_notifications)}&input_url=${encodeURIComponent(input_url)}`
             });
             if (!res.ok) throw new Error('Failed to update product');
+            invalidateStats();
             document.getElementById('editProductModal').style.display = 'none';
-            // Update product in local arrays
-            [products, filtered].forEach(arr => {
-            const idx = arr.findIndex(p => p.id == id);
-            if (idx !== -1) {
-                arr[idx] = {
-                    ...arr[idx],
+            // Update product on the current page
+            const product = productIndex.get(productKey({ id, input_url }));
+            if (product) {
+                Object.assign(product, {
                     title,
                     price,
                     available: available === '1',
                     vendor,
                     alcohol_type,
                     ignore_notifications
-                };
+                });
             }
-        });
             renderTable();
-            renderStats();
         } catch (err) {
             alert('Error updating product: ' + err.message);
         }
@@ -233,7 +299,7 @@ function renderTable() {
             cell.textContent = d.toLocaleString();
         }
     });
-    renderStatsPanel();
+    renderStats();
     // Always call updateBulkActionsBar after table render to ensure correct state
     updateBulkActionsBar();
 }
@@ -248,12 +314,7 @@ function renderPagination() {
         if (p === currentPage) el.className = 'active';
         el.onclick = e => {
             e.preventDefault();
-            if (p !== currentPage) {
-                currentPage = p;
-                renderTable();
-                renderPagination();
-                saveState();
-            }
+            if (p !== currentPage) fetchProducts(p);
         };
         return el;
     }
@@ -275,44 +336,25 @@ function renderPagination() {
         pagDiv.appendChild(pageBtn(currentPage+1, 'Next ›'));
         pagDiv.appendChild(pageBtn(totalPages, 'Last »'));
     }
+    const info = document.createElement('span');
+    info.textContent = `Page ${currentPage} of ${totalPages}`;
+    info.style.marginLeft = '12px';
+    pagDiv.appendChild(info);
 }
 
 function sortTable(key) {
     if (sortKey === key) sortAsc = !sortAsc; else { sortKey = key; sortAsc = true; }
-    filtered.sort((a, b) => {
-        let va = a[key] || '';
-        let vb = b[key] || '';
-        if (key === 'price') { va = parseFloat(va)||0; vb = parseFloat(vb)||0; }
-        if (va < vb) return sortAsc ? -1 : 1;
-        if (va > vb) return sortAsc ? 1 : -1;
-        return 0;
-    });
-    renderTable();
-    renderPagination(); // Ensure pagination is updated after sorting
+    filterTable();
 }
 
+document.getElementById('liveNotice').onclick = function() {
+    fetchProducts(currentPage);
+};
+
 function filterTable() {
-    const q = document.getElementById('searchInput').value.toLowerCase();
-    const vendor = document.getElementById('vendorFilter').value;
-    const type = document.getElementById('typeFilter').value;
-    const avail = document.getElementById('availableFilter').value;
-    const inputUrl = document.getElementById('inputUrlFilter').value;
-    const ignore = document.getElementById('ignoreFilter').value;
-    const showUnwanted = document.getElementById('showUnwantedCheckbox').checked;
-    filtered = products.filter(p => {
-        let match = true;
-        if (q) match = (p.title && p.title.toLowerCase().includes(q)) || (p.vendor && p.vendor.toLowerCase().includes(q)) || (p.alcohol_type && p.alcohol_type.toLowerCase().includes(q));
-        if (vendor && p.vendor !== vendor) match = false;
-        if (type && p.alcohol_type !== type) match = false;
-        if (avail && String(Number(!!p.available)) !== avail) match = false;
-        if (inputUrl && p.input_url !== inputUrl) match = false;
-        if (ignore !== '' && String(Number(!!p.ignore_notifications)) !== ignore) match = false;
-        if (!showUnwanted && p.alcohol_type === 'unwanted') match = false;
-        return match;
-    });
-    sortTable(sortKey);
-    renderStats();
-    renderPagination(); // Ensure pagination is updated after filtering
+    // Filters or sort changed: cursors from the previous query no longer apply
+    cursors = [null];
+    fetchProducts(1);
 }
 
 function resetFilters() {
@@ -327,18 +369,18 @@ function resetFilters() {
 }
 
 function populateFilters() {
-    const vendors = [...new Set(products.map(p => p.vendor).filter(Boolean))].sort();
-    const types = [...new Set(products.map(p => p.alcohol_type).filter(Boolean))].sort();
-    const inputUrls = [...new Set(products.map(p => p.input_url).filter(Boolean))].sort();
-    const vendorSel = document.getElementById('vendorFilter');
-    const typeSel = document.getElementById('typeFilter');
-    const inputUrlSel = document.getElementById('inputUrlFilter');
-    vendorSel.innerHTML = '<option value="">All Vendors</option>';
-    typeSel.innerHTML = '<option value="">All Types</option>';
-    inputUrlSel.innerHTML = '<option value="">All Input URLs</option>';
-    vendors.forEach(v => { const o = document.createElement('option'); o.value = v; o.textContent = v; vendorSel.appendChild(o); });
-    types.forEach(t => { const o = document.createElement('option'); o.value = t; o.textContent = t; typeSel.appendChild(o); });
-    inputUrls.forEach(u => { const o = document.createElement('option'); o.value = u; o.textContent = u; inputUrlSel.appendChild(o); });
+    const selects = [
+        ['vendorFilter', 'All Vendors', facets.vendors],
+        ['typeFilter', 'All Types', facets.alcohol_types],
+        ['inputUrlFilter', 'All Input URLs', facets.input_urls]
+    ];
+    selects.forEach(([id, label, values]) => {
+        const sel = document.getElementById(id);
+        const current = sel.value;
+        sel.innerHTML = `<option value="">${label}</option>`;
+        values.forEach(v => { const o = document.createElement('option'); o.value = v; o.textContent = v; sel.appendChild(o); });
+        sel.value = current;
+    });
 }
 
 function formatDate(dateStr) {
@@ -349,9 +391,7 @@ function formatDate(dateStr) {
 }
 
 // --- State Persistence Helpers ---
-const STATE_KEY = 'shopifyScraperProductsStateV2';
-const PRODUCTS_KEY = 'shopifyScraperProductsDataV2';
-const PRODUCTS_CACHE_TTL = 60 * 60 * 1000; // 1 hour
+const STATE_KEY = 'shopifyScraperProductsStateV3';
 
 function saveState() {
     const state = {
@@ -360,9 +400,10 @@ function saveState() {
         type: document.getElementById('typeFilter').value,
         avail: document.getElementById('availableFilter').value,
         inputUrl: document.getElementById('inputUrlFilter').value,
+        ignore: document.getElementById('ignoreFilter').value,
+        showUnwanted: document.getElementById('showUnwantedCheckbox').checked,
         sortKey,
-        sortAsc,
-        currentPage
+        sortAsc
     };
     localStorage.setItem(STATE_KEY, JSON.stringify(state));
 }
@@ -374,129 +415,57 @@ function loadState() {
     if (state.type !== undefined) document.getElementById('typeFilter').value = state.type;
     if (state.avail !== undefined) document.getElementById('availableFilter').value = state.avail;
     if (state.inputUrl !== undefined) document.getElementById('inputUrlFilter').value = state.inputUrl;
+    if (state.ignore !== undefined) document.getElementById('ignoreFilter').value = state.ignore;
+    if (state.showUnwanted !== undefined) document.getElementById('showUnwantedCheckbox').checked = state.showUnwanted;
     if (state.sortKey) sortKey = state.sortKey;
     if (state.sortAsc !== undefined) sortAsc = state.sortAsc;
-    if (state.currentPage) currentPage = state.currentPage;
 }
 
-function saveProductsToCache() {
-    const cache = {
-        products,
-        totalRecords,
-        timestamp: Date.now(),
-        version: 2
-    };
-    try {
-        localStorage.setItem(PRODUCTS_KEY, JSON.stringify(cache));
-    } catch (e) {
-        if (e.name === 'QuotaExceededError' || e.name === 'NS_ERROR_DOM_QUOTA_REACHED') {
-            console.warn('LocalStorage quota exceeded, skipping product cache.');
-        } else {
-            throw e;
-        }
-    }
-}
-
-function loadProductsFromCache() {
-    const cache = JSON.parse(localStorage.getItem(PRODUCTS_KEY) || 'null');
-    if (!cache || !cache.products || !cache.timestamp) return false;
-    if (Date.now() - cache.timestamp > PRODUCTS_CACHE_TTL) return false;
-    products = cache.products;
-    totalRecords = cache.totalRecords || products.length;
-    allDataLoaded = true;
-    filtered = [...products];
-    totalPages = Math.ceil(totalRecords / perPage) || 1;
-    return true;
-}
-
-// --- Patch event handlers to save state ---
-['searchInput','vendorFilter','typeFilter','availableFilter','inputUrlFilter','ignoreFilter'].forEach(id => {
-    document.getElementById(id).addEventListener('change', saveState);
-    document.getElementById(id).addEventListener('input', saveState);
+// --- On page load, restore state, then fetch the filter values and the first page ---
+document.addEventListener('DOMContentLoaded', async function() {
+    await fetchFacets();
+    loadState();
+    filterTable();
 });
-
-// Patch sortTable and pagination to save state
-const origSortTable = sortTable;
-sortTable = function(key) {
-    origSortTable(key);
-    renderPagination();
-    saveState();
-};
-
-const origRenderPagination = renderPagination;
-renderPagination = function() {
-    origRenderPagination();
-    // Patch page buttons to save state
-    document.querySelectorAll('#pagination a').forEach(a => {
-        a.addEventListener('click', () => {
-            saveState();
-        });
-    });
-};
-
-// --- Patch fetchProducts to save products to cache ---
-const origFetchProducts = fetchProducts;
-fetchProducts = async function(page = 1, append = false) {
-    await origFetchProducts(page, append);
-    if (allDataLoaded) saveProductsToCache();
-};
-
-// --- On page load, restore state and products ---
-document.addEventListener('DOMContentLoaded', function() {
-    let usedCache = false;
-    if (loadProductsFromCache()) {
-        usedCache = true;
-        populateFilters();
-        loadState();
-        filterTable();
-        renderPagination();
-        renderStats();
-        renderTable();
-    } else {
-        origFetchProducts(currentPage);
-        loadState();
-        renderStats();
-        renderPagination(); // Ensure pagination is rendered on first load
-    }
+document.getElementById('searchInput').addEventListener('input', function() {
+    clearTimeout(searchTimer);
+    searchTimer = setTimeout(filterTable, 300);
+});
+['vendorFilter','typeFilter','availableFilter','inputUrlFilter','ignoreFilter','showUnwantedCheckbox'].forEach(id => {
+    document.getElementById(id).addEventListener('change', filterTable);
 });
-document.getElementById('searchInput').addEventListener('input', filterTable);
-document.getElementById('vendorFilter').addEventListener('change', filterTable);
-document.getElementById('typeFilter').addEventListener('change', filterTable);
-document.getElementById('availableFilter').addEventListener('change', filterTable);
-document.getElementById('inputUrlFilter').addEventListener('change', filterTable);
-document.getElementById('ignoreFilter').addEventListener('change', filterTable);
-document.getElementById('showUnwantedCheckbox').addEventListener('change', filterTable);
-window.onload = function() {
-    fetchProducts(currentPage);
-    renderStats();
-    renderPagination(); // Ensure pagination is rendered on window load
-};
 document.getElementById('refreshBtn').onclick = async function() {
-    products = [];
-    filtered = [];
-    allDataLoaded = false;
-    await fetchProducts(1, false);
-    renderTable();
-    populateFilters();
-    renderPagination();
-    renderStats();
+    await fetchFacets();
+    filterTable();
 };
-function exportCSV() {
+async function exportCSV() {
+    // Walk every page of the current query with the keyset cursor
     let csv = '';
     const headers = ['Title','Price','Available','Vendor','Alcohol Type','Published At','Updated At','Input URL'];
     csv += headers.join(',') + '\n';
-    filtered.forEach(p => {
-        csv += [
-            '"'+(p.title||'')+'"',
-            p.price||'',
-            p.available ? 'Yes' : 'No',
-            '"'+(p.vendor||'')+'"',
-            '"'+(p.alcohol_type||'')+'"',
-            p.published_at||'',
-            p.updated_at||'',
-            '"'+(p.input_url||'')+'"'
-        ].join(',') + '\n';
-    });
+    const params = filterParams();
+    let cursor = null;
+    try {
+        do {
+            const data = await fetchPage(params, cursor, 5000);
+            data.products.forEach(p => {
+                csv += [
+                    '"'+(p.title||'')+'"',
+                    p.price||'',
+                    p.available ? 'Yes' : 'No',
+                    '"'+(p.vendor||'')+'"',
+                    '"'+(p.alcohol_type||'')+'"',
+                    p.published_at||'',
+                    p.updated_at||'',
+                    '"'+(p.input_url||'')+'"'
+                ].join(',') + '\n';
+            });
+            cursor = data.next_cursor;
+        } while (cursor);
+    } catch (err) {
+        alert('Error exporting products: ' + err.message);
+        return;
+    }
     const blob = new Blob([csv], {type:'text/csv'});
     const url = URL.createObjectURL(blob);
     const a = document.createElement('a');
@@ -508,57 +477,36 @@ function exportCSV() {
     URL.revokeObjectURL(url);
 }
 document.getElementById('exportBtn').onclick = exportCSV;
-function renderStats() {
-    // Compute stats from filtered and all products
-    const total = products.length;
-    const filteredCount = filtered.length;
-    const available = filtered.filter(p => p.available).length;
-    const totalAvailable = products.filter(p => p.available).length;
-    const vendors = [...new Set(filtered.map(p => p.vendor).filter(Boolean))];
-    const allVendors = [...new Set(products.map(p => p.vendor).filter(Boolean))];
-    const alcoholTypes = {};
-    filtered.forEach(p => {
-        if (p.alcohol_type) alcoholTypes[p.alcohol_type] = (alcoholTypes[p.alcohol_type]||0)+1;
-    });
-    const prices = filtered.map(p => parseFloat(p.price)).filter(x => !isNaN(x));
-    const minPrice = prices.length ? Math.min(...prices) : '';
-    const maxPrice = prices.length ? Math.max(...prices) : '';
-    const avgPrice = prices.length ? (prices.reduce((a,b)=>a+b,0)/prices.length).toFixed(2) : '';
-    // Top vendors
-    const vendorCounts = {};
-    filtered.forEach(p => { if (p.vendor) vendorCounts[p.vendor] = (vendorCounts[p.vendor]||0)+1; });
-    const topVendors = Object.entries(vendorCounts).sort((a,b)=>b[1]-a[1]).slice(0,3);
-    // Last updated (most recent updated_at or last_seen)
-    let lastUpdated = '';
-    if (filtered.length) {
-        const dates = filtered.map(p => p.updated_at || p.last_seen).filter(Boolean);
-        if (dates.length) {
-            lastUpdated = new Date(Math.max(...dates.map(d=>+new Date(d))));
-            lastUpdated = lastUpdated.toLocaleString();
-        }
+async function renderStats() {
+    let stats;
+    try {
+        stats = await fetchStats();
+    } catch (err) {
+        console.warn(err.message);
+        return;
     }
-    // Active filters summary
     const filterSummary = [];
     if (document.getElementById('searchInput').value) filterSummary.push('Search: "'+document.getElementById('searchInput').value+'"');
     if (document.getElementById('vendorFilter').value) filterSummary.push('Vendor: '+document.getElementById('vendorFilter').value);
     if (document.getElementById('typeFilter').value) filterSummary.push('Type: '+document.getElementById('typeFilter').value);
     if (document.getElementById('availableFilter').value) filterSummary.push('Available: '+(document.getElementById('availableFilter').value==='1'?'Yes':'No'));
     if (document.getElementById('inputUrlFilter').value) filterSummary.push('Input URL: '+document.getElementById('inputUrlFilter').value);
-    // Render
+    const lastUpdated = stats.last_updated ? new Date(stats.last_updated.replace(' ', 'T') + 'Z') : null;
     let html = '';
-    html += `<div><b>Total Products:</b> ${filteredCount} <span style="color:#888;font-size:13px;">/ ${total}</span></div>`;
-    html += `<div><b>Available:</b> ${available} <span style="color:#888;font-size:13px;">/ ${totalAvailable}</span></div>`;
-    html += `<div><b>Unique Vendors:</b> ${vendors.length} <span style="color:#888;font-size:13px;">/ ${allVendors.length}</span></div>`;
-    html += `<div><b>Last Updated:</b> ${lastUpdated||'-'}</div>`;
-    html += `<div><b>Alcohol Types:</b> ${Object.keys(alcoholTypes).length ? Object.entries(alcoholTypes).map(([k,v])=>`${k} (${v})`).join(', ') : '-'}</div>`;
-    html += `<div><b>Price:</b> ${prices.length ? `min $${minPrice} / avg $${avgPrice} / max $${maxPrice}` : '-'}`;
-    html += `<div><b>Top Vendors:</b> ${topVendors.length ? topVendors.map(([v,c])=>`${v} (${c})`).join(', ') : '-'}</div>`;
+    html += `<div><b>Total Products:</b> ${stats.total}</div>`;
+    html += `<div><b>Available:</b> ${stats.available} <span style="color:#888;font-size:13px;">/ ${stats.total}</span></div>`;
+    html += `<div><b>Vendors / Types:</b> ${stats.vendors} / ${Object.keys(stats.alcohol_types).length}</div>`;
+    html += `<div><b>Last Updated:</b> ${lastUpdated ? lastUpdated.toLocaleString() : '-'}</div>`;
+    html += `<div><b>Alcohol Types:</b> ${Object.keys(stats.alcohol_types).length ? Object.entries(stats.alcohol_types).map(([k,v])=>`${k} (${v})`).join(', ') : '-'}</div>`;
+    html += `<div><b>Price:</b> ${stats.min_price !== null ? `min $${stats.min_price} / avg $${stats.avg_price.toFixed(2)} / max $${stats.max_price}` : '-'}</div>`;
+    html += `<div><b>Top Vendors:</b> ${stats.top_vendors.length ? stats.top_vendors.map(([v,c])=>`${v} (${c})`).join(', ') : '-'}</div>`;
+    html += `<div><b>Showing:</b> ${products.length} of ${totalRecords} products</div>`;
     if (filterSummary.length) html += `<div style="color:#2563eb;"><b>Active Filters:</b> ${filterSummary.join('; ')}</div>`;
     document.getElementById('statsPanel').innerHTML = html;
 }
 
 function getAvailableAlcoholTypes() {
-    const types = [...new Set(products.map(p => p.alcohol_type).filter(Boolean))].sort();
+    const types = [...facets.alcohol_types];
     if (!types.includes('unwanted')) types.unshift('unwanted');
     return types;
 }
@@ -584,64 +532,43 @@ document.getElementById('editProductAlcoholType').addEventListener('change', fun
 });
 // --- Select all logic ---
 document.getElementById('selectAllCheckbox').onchange = function() {
-    const start = (currentPage - 1) * perPage;
-    const end = Math.min(start + perPage, filtered.length);
-    const allVisibleIds = filtered.slice(start, end).map(p => parseInt(p.id, 10));
     if (this.checked) {
-        allVisibleIds.forEach(id => selectedProductIds.add(id));
+        products.forEach(p => selectedProducts.set(productKey(p), { id: parseInt(p.id, 10), input_url: p.input_url || '' }));
     } else {
-        allVisibleIds.forEach(id => selectedProductIds.delete(id));
+        products.forEach(p => selectedProducts.delete(productKey(p)));
     }
     renderTable();
     updateBulkActionsBar();
 };
 // --- Bulk action handlers ---
-document.getElementById('bulkIgnoreBtn').onclick = async function() {
-    for (const id of selectedProductIds) {
-        const product = products.find(p => parseInt(p.id, 10) === id);
-        const input_url = product && product.input_url ? product.input_url : '';
-        // Update locally
-        [products, filtered].forEach(arr => {
-            const idx = arr.findIndex(p => parseInt(p.id, 10) === id);
-            if (idx !== -1) arr[idx].ignore_notifications = 1;
-        });
-        // Update backend
-        await fetch(`/api/products/${id}/ignore`, {
+// One /api/products/bulk request applies the patch to every selected product in a single transaction
+async function bulkUpdate(patch) {
+    if (!selectedProducts.size) return;
+    try {
+        const res = await fetch('/api/products/bulk', {
             method: 'POST',
             headers: { 'Content-Type': 'application/json' },
-            body: JSON.stringify({ ignore_notifications: 1, input_url })
+            body: JSON.stringify({ keys: [...selectedProducts.values()], patch })
         });
-    }
-    renderTable();
-    renderStats();
-};
-document.getElementById('bulkUnwantedBtn').onclick = async function() {
-    for (const id of selectedProductIds) {
-        const product = products.find(p => parseInt(p.id, 10) === id);
-        const input_url = product && product.input_url ? product.input_url : '';
-        // Update locally
-        [products, filtered].forEach(arr => {
-            const idx = arr.findIndex(p => parseInt(p.id, 10) === id);
-            if (idx !== -1) {
-                arr[idx].alcohol_type = 'unwanted';
-                arr[idx].ignore_notifications = 1;
-            }
-        });
-        // Update backend
-        await fetch(`/products/${id}/edit`, {
-            method: 'POST',
-            headers: { 'Content-Type': 'application/x-www-form-urlencoded' },
-            body: `alcohol_type=unwanted&ignore_notifications=1&input_url=${encodeURIComponent(input_url)}`
+        if (!res.ok) throw new Error('Failed to update the selected products');
+        const data = await res.json();
+        data.results.forEach(r => {
+            const product = r.status === 'updated' ? productIndex.get(productKey(r)) : null;
+            if (product) Object.assign(product, patch);
         });
+        if (data.not_found) alert(`${data.not_found} selected product(s) no longer exist`);
+    } catch (err) {
+        alert('Error updating products: ' + err.message);
     }
+    invalidateStats();
     renderTable();
-    renderStats();
-};
-
+}
+document.getElementById('bulkIgnoreBtn').onclick = () => bulkUpdate({ ignore_notifications: 1 });
+document.getElementById('bulkUnwantedBtn').onclick = () => bulkUpdate({ alcohol_type: 'unwanted', ignore_notifications: 1 });
 
 function updateBulkActionsBar() {
     const bulkBar = document.getElementById('bulkActions');
-    bulkBar.style.display = selectedProductIds.size > 0 ? '' : 'none';
+    bulkBar.style.display = selectedProducts.size > 0 ? '' : 'none';
     // Update selected count label
     let label = document.getElementById('selectedCountLabel');
     if (!label) {
@@ -651,24 +578,22 @@ function updateBulkActionsBar() {
         const table = document.getElementById('productsTable');
         table.parentNode.insertBefore(label, table);
     }
-    label.textContent = selectedProductIds.size > 0 ? `${selectedProductIds.size} product${selectedProductIds.size === 1 ? '' : 's'} selected` : '';
-    label.style.display = selectedProductIds.size > 0 ? '' : 'none';
+    label.textContent = selectedProducts.size > 0 ? `${selectedProducts.size} product${selectedProducts.size === 1 ? '' : 's'} selected` : '';
+    label.style.display = selectedProducts.size > 0 ? '' : 'none';
     // Also update selectAllCheckbox state
-    const start = (currentPage - 1) * perPage;
-    const end = Math.min(start + perPage, filtered.length);
-    const allVisibleIds = filtered.slice(start, end).map(p => parseInt(p.id, 10));
-    const allChecked = allVisibleIds.length > 0 && allVisibleIds.every(id => selectedProductIds.has(id));
+    const allChecked = products.length > 0 && products.every(p => selectedProducts.has(productKey(p)));
     document.getElementById('selectAllCheckbox').checked = allChecked;
 }
 
 document.getElementById('productsBody').addEventListener('change', function(event) {
     if (event.target.classList.contains('select-product-checkbox')) {
-        const id = parseInt(event.target.getAttribute('data-id'), 10);
-        if (event.target.checked) {
-            selectedProductIds.add(id);
+        const key = event.target.getAttribute('data-key');
+        const product = productIndex.get(key);
+        if (event.target.checked && product) {
+            selectedProducts.set(key, { id: parseInt(product.id, 10), input_url: product.input_url || '' });
         }
         else {
-            selectedProductIds.delete(id);
+            selectedProducts.delete(key);
         }
         updateBulkActionsBar(); // Always update label and select all state
     }
@@ -1,65 +1,496 @@
-from flask import Flask, render_template, request, jsonify, abort, redirect, url_for, flash
+from flask import Flask, Response, render_template, request, jsonify, abort, redirect, url_for, flash, g
 import sqlite3
 import os
+import sys
 import json
+import time
+import base64
+import glob
+import re
+import gzip
+import hashlib
+import threading
+import functools
+from collections import OrderedDict
+import requests
+try:
+    import orjson  # Optional: serializes large product pages several times faster than json
+except ImportError:
+    orjson = None
+try:
+    import brotli  # Optional: offered as Content-Encoding br to clients that accept it
+except ImportError:
+    brotli = None
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), '..'))
+from db import ConnectionPool, project_product, product_body_text, fts_query, pack_json, unpack_json, change_seq
+from history import availability_periods, parse_time, utc_iso
+from metrics import METRICS_PORT, merge_summaries
+from sharding import SCRAPER_PROCESSES
 
 app = Flask(__name__, static_folder='static', template_folder='templates')
 app.secret_key = 'your_secret_key'  # Needed for session management and flashing messages
 DB_PATH = os.path.join(os.path.dirname(__file__), '../data/products.db')  # Adjusted for new structure
 LOG_PATH = os.path.join(os.path.dirname(__file__), '../logs/scraper.log')
+# The scraper's metrics summaries, comma-separated: its METRICS_PORT and, with SCRAPER_PROCESSES > 1, each shard
+# worker's METRICS_PORT + 1 + N. The default only works when the scraper runs in this container (Dockerfile); with the
+# web UI alone (Dockerfile.web) set it to the scraper container's address.
+METRICS_URL = os.getenv('METRICS_URL', ','.join(f'http://127.0.0.1:{port}/metrics.json' for port in
+                                                [METRICS_PORT] + [METRICS_PORT + 1 + n for n in range(SCRAPER_PROCESSES if SCRAPER_PROCESSES > 1 else 0)]))
+# Columns returned by the list endpoints; the raw product JSON lives in product_raw and is only loaded by get_product
+PRODUCT_COLUMNS = 'id, title, price, available, vendor, alcohol_type, image_url, variant_count, tags, product_type, url, input_url, published_at, created_at, updated_at, last_seen, became_available_at, became_unavailable_at, date_added, ignore_notifications, canonical_key'
+# Sort keys accepted by /api/products. The expressions match the products indexes created by SScraper.init_db,
+# and (expression, id, input_url) is the keyset used for cursor pagination.
+SORT_KEYS = {
+    'last_seen': "COALESCE(last_seen, '')",
+    'title': "COALESCE(title, '')",
+    'price': 'COALESCE(CAST(price AS REAL), 0)',
+    'vendor': "COALESCE(vendor, '')",
+    'alcohol_type': "COALESCE(alcohol_type, '')",
+    'available': 'COALESCE(available, 0)',
+    'published_at': "COALESCE(published_at, '')",
+    'updated_at': "COALESCE(updated_at, '')",
+    'id': 'id',
+}
+MAX_PAGE_SIZE = int(os.getenv('MAX_PAGE_SIZE', '5000'))
+BULK_MAX_KEYS = int(os.getenv('BULK_MAX_KEYS', '10000'))  # Max products one /api/products/bulk request may change
+# Fields /api/products/bulk may patch (the same subset edit_product allows) and how their values are coerced
+BULK_FIELDS = {'title': str, 'price': str, 'available': int, 'vendor': str, 'alcohol_type': str, 'ignore_notifications': int}
+COUNT_CACHE_TTL = float(os.getenv('COUNT_CACHE_TTL', '30'))  # Seconds a cached aggregate is reused when the DB has no change counter
+_count_cache = {}
+# bm25 column weights for products_fts (title, vendor, alcohol_type, tags, product_type, body_text)
+SEARCH_WEIGHTS = (10.0, 5.0, 3.0, 2.0, 2.0, 1.0)
+
+_db_pool = None
 
 def get_db_connection():
-    conn = sqlite3.connect(DB_PATH)
-    conn.row_factory = sqlite3.Row
-    return conn
+    """Borrow a pooled connection for the current request; it is returned to the pool on teardown."""
+    global _db_pool
+    if 'db_conn' not in g:
+        if _db_pool is None or _db_pool.db_path != DB_PATH:
+            _db_pool = ConnectionPool(DB_PATH, row_factory=sqlite3.Row)
+        g.db_conn = _db_pool.acquire()
+        g.db_pool = _db_pool
+    return g.db_conn
+
+@app.teardown_appcontext
+def release_db_connection(exc):
+    conn = g.pop('db_conn', None)
+    if conn is not None:
+        g.pop('db_pool').release(conn)
+
+def with_projection(data):
+    """Fill the slim columns from an original_json payload when the client only sent the raw product."""
+    if data.get('original_json') and not data.get('image_url'):
+        try:
+            raw = data['original_json']
+            product = json.loads(raw) if isinstance(raw, str) else raw
+            image_url, variant_count, tags, product_type = project_product(product)
+            data = dict(data, image_url=image_url, variant_count=data.get('variant_count', variant_count),
+                        tags=data.get('tags', tags), product_type=data.get('product_type', product_type),
+                        body_text=data.get('body_text', product_body_text(product)))
+        except Exception:
+            pass
+    return data
+
+def store_raw_json(conn, product_id, input_url, original_json):
+    if original_json:
+        conn.execute('INSERT OR REPLACE INTO product_raw (id, input_url, json_z) VALUES (?, ?, ?)', (product_id, input_url, pack_json(original_json)))
 
 @app.route('/')
 @app.route('/products')
 def all_products():
-    conn = get_db_connection()
-    products = conn.execute('SELECT id, title, price, available, vendor, alcohol_type, original_json, url, input_url, published_at, created_at, updated_at, last_seen, became_available_at, became_unavailable_at, date_added, ignore_notifications FROM products ORDER BY last_seen DESC').fetchall()
-    product_list = []
-    for p in products:
-        img_url = None
-        try:
-            data = json.loads(p['original_json']) if p['original_json'] else {}
-            if data.get('images') and len(data['images']) > 0:
-                img_url = data['images'][0].get('src')
-        except Exception:
-            img_url = None
-        d = dict(p)
-        d['image_url'] = img_url
-        product_list.append(d)
-    conn.close()
-    return render_template('products.html', products=product_list)
+    # products.js loads rows page by page from /api/products
+    return render_template('products.html')
+
+def product_filters(args):
+    """WHERE clauses and parameters for the optional list filters in args."""
+    clauses = []
+    params = []
+    for column in ('vendor', 'alcohol_type', 'input_url'):
+        value = args.get(column)
+        if value:
+            # The sort key expression, so the filter seeks the same index (the same rows, as value is never empty)
+            clauses.append(f'{SORT_KEYS.get(column, column)} = ?')
+            params.append(value)
+    for column in ('available', 'ignore_notifications'):
+        value = args.get(column)
+        if value in ('0', '1'):
+            clauses.append(f'COALESCE({column}, 0) = ?')
+            params.append(int(value))
+    for arg, op in (('min_price', '>='), ('max_price', '<=')):
+        value = args.get(arg)
+        if value:
+            try:
+                params.append(float(value))
+            except ValueError:
+                abort(400, f'Invalid {arg}')
+            clauses.append(f"{SORT_KEYS['price']} {op} ?")
+    if args.get('show_unwanted') == '0':
+        clauses.append("COALESCE(alcohol_type, '') != 'unwanted'")
+    q = args.get('q', '').strip()
+    if q:
+        match = fts_query(q)
+        if has_search_index():
+            clauses.append('rowid IN (SELECT rowid FROM products_fts WHERE products_fts MATCH ?)' if match else '0')
+            params += [match] if match else []
+        else:
+            like = f'%{q}%'
+            clauses.append('(title LIKE ? OR vendor LIKE ? OR alcohol_type LIKE ?)')
+            params += [like, like, like]
+    return clauses, params
+
+def has_search_index():
+    """Whether the products_fts full-text index exists (it is skipped when SQLite lacks FTS5)."""
+    return cached_query(('fts',), lambda: get_db_connection().execute(
+        "SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone() is not None)
+
+def where_sql(clauses):
+    return f" WHERE {' AND '.join(clauses)}" if clauses else ''
+
+def current_change_seq():
+    """db_meta.change_seq, read once per request."""
+    if 'change_seq' not in g:
+        g.change_seq = change_seq(get_db_connection())
+    return g.change_seq
+
+def cached_query(key, compute):
+    """
+    Reuse an expensive aggregate (COUNT(*), DISTINCT lists, stats) until the products change counter moves,
+    or for COUNT_CACHE_TTL seconds on a database without one.
+    """
+    key = (DB_PATH,) + key
+    version = current_change_seq()
+    hit = _count_cache.get(key)
+    now = time.monotonic()
+    if hit is not None and hit[2] == version and (version is not None or now - hit[1] < COUNT_CACHE_TTL):
+        return hit[0]
+    value = compute()
+    if len(_count_cache) > 1000:
+        _count_cache.clear()
+    _count_cache[key] = (value, now, version)
+    return value
+
+def invalidate_cached_queries():
+    _count_cache.clear()
+    with _response_cache_lock:
+        _response_cache.clear()
+        _response_cache_size[0] = 0
+    g.pop('change_seq', None)
+
+# --- Serialized list responses: one JSON encoding per change_seq, compressed variants, strong ETags ---
+RESPONSE_CACHE_SIZE = int(os.getenv('RESPONSE_CACHE_SIZE', '64'))  # Serialized list pages kept in memory (0 disables)
+RESPONSE_CACHE_BYTES = int(os.getenv('RESPONSE_CACHE_BYTES', str(64 * 1024 * 1024)))  # Total bytes those pages may hold, all encodings
+COMPRESS_MIN_BYTES = int(os.getenv('COMPRESS_MIN_BYTES', '1024'))  # Smaller bodies are sent uncompressed
+GZIP_LEVEL = int(os.getenv('GZIP_LEVEL', '5'))
+_response_cache = OrderedDict()  # (DB_PATH, path, args) -> CachedBody, least recently used first
+_response_cache_size = [0]
+_response_cache_lock = threading.Lock()
+
+def dumps_json(value):
+    if orjson is not None:
+        return orjson.dumps(value)
+    return json.dumps(value, separators=(',', ':')).encode('utf-8')
+
+def compress(body, encoding):
+    if encoding == 'br':
+        return brotli.compress(body, quality=4)
+    return gzip.compress(body, compresslevel=GZIP_LEVEL, mtime=0)
+
+class CachedBody:
+    """A serialized response body and the compressed variants made of it so far."""
+    __slots__ = ('version', 'encoded', 'size')
+
+    def __init__(self, version, body):
+        self.version = version
+        self.encoded = {None: body}
+        self.size = len(body)
+
+    def get(self, encoding):
+        body = self.encoded.get(encoding)
+        if body is None:
+            body = self.encoded[encoding] = compress(self.encoded[None], encoding)
+            self.size += len(body)
+        return body
+
+def negotiate_encoding(body_size):
+    if body_size < COMPRESS_MIN_BYTES:
+        return None
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        return 'br'
+    if accepted['gzip']:
+        return 'gzip'
+    return None
+
+def response_cache_get(key, version):
+    with _response_cache_lock:
+        entry = _response_cache.get(key)
+        if entry is None or entry.version != version:
+            return None
+        _response_cache.move_to_end(key)
+        return entry
+
+def response_cache_put(key, entry, old_size=0):
+    """Store entry (or account for variants added to it since old_size), evicting the least recently used pages."""
+    if RESPONSE_CACHE_SIZE <= 0:
+        return
+    with _response_cache_lock:
+        previous = _response_cache.get(key)
+        if previous is entry:
+            _response_cache_size[0] += entry.size - old_size
+        else:
+            if previous is not None:
+                _response_cache_size[0] -= previous.size
+            _response_cache[key] = entry
+            _response_cache_size[0] += entry.size
+        _response_cache.move_to_end(key)
+        while _response_cache and (len(_response_cache) > RESPONSE_CACHE_SIZE or _response_cache_size[0] > RESPONSE_CACHE_BYTES):
+            _, evicted = _response_cache.popitem(last=False)
+            _response_cache_size[0] -= evicted.size
+
+def json_response(body, encoding=None, etag=None):
+    response = Response(body, mimetype='application/json')
+    if encoding:
+        response.headers['Content-Encoding'] = encoding
+    if etag:
+        response.headers['ETag'] = f'"{etag}"'
+        response.headers['Cache-Control'] = 'no-cache'  # Browsers keep the body but revalidate it every time
+    response.headers['Vary'] = 'Accept-Encoding'
+    return response
+
+def cached_json(view):
+    """
+    For GET endpoints whose body depends only on the query string and the products tables. The view returns a dict;
+    it is serialized once per change_seq and kept in _response_cache, and the strong ETag is derived from
+    change_seq, so revalidating an unchanged page answers 304 without running the view at all.
+    """
+    @functools.wraps(view)
+    def wrapper(*args, **kwargs):
+        version = current_change_seq()
+        if version is None:
+            # No change counter to validate against: serialize and compress, but neither tag nor cache
+            body = dumps_json(view(*args, **kwargs))
+            encoding = negotiate_encoding(len(body))
+            return json_response(compress(body, encoding) if encoding else body, encoding)
+        key = (DB_PATH, request.path, tuple(sorted(request.args.items(multi=True))))
+        tag = f"{version:x}-{hashlib.blake2b(repr(key).encode('utf-8'), digest_size=8).hexdigest()}"
+        for variant in (tag, f'{tag}-gzip', f'{tag}-br'):
+            if request.if_none_match.contains(variant):
+                response = json_response(b'', etag=variant)
+                response.status_code = 304
+                return response
+        entry = response_cache_get(key, version)
+        if entry is None:
+            entry = CachedBody(version, dumps_json(view(*args, **kwargs)))
+            response_cache_put(key, entry)
+        encoding = negotiate_encoding(len(entry.encoded[None]))
+        old_size = entry.size
+        body = entry.get(encoding)
+        if entry.size != old_size:
+            response_cache_put(key, entry, old_size)
+        return json_response(body, encoding, f'{tag}-{encoding}' if encoding else tag)
+    return wrapper
+
+def encode_cursor(row, sort_value):
+    raw = json.dumps([sort_value, row['id'], row['input_url']], separators=(',', ':'))
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+def decode_cursor(cursor):
+    try:
+        values = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        if isinstance(values, list) and len(values) == 3:
+            return values
+    except Exception:
+        pass
+    abort(400, 'Invalid cursor')
 
 @app.route('/api/products', methods=['GET'])
+@cached_json
 def api_products():
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 500))
-    offset = (page - 1) * per_page
+    """
+    List products with server-side filtering and sorting.
+    Keyset pagination: pass a response's next_cursor back as cursor. Without a cursor, page/per_page still
+    selects a page with OFFSET for older clients.
+    """
+    sort = request.args.get('sort', 'last_seen')
+    if sort not in SORT_KEYS:
+        abort(400, f'Unknown sort key {sort}')
+    order = request.args.get('order', 'desc').lower()
+    if order not in ('asc', 'desc'):
+        abort(400, 'order must be asc or desc')
+    try:
+        limit = max(1, min(int(request.args.get('limit', request.args.get('per_page', 500))), MAX_PAGE_SIZE))
+        page = int(request.args.get('page', 1))
+    except ValueError:
+        abort(400, 'limit/per_page and page must be integers')
+    cursor = request.args.get('cursor')
+    clauses, params = product_filters(request.args)
     conn = get_db_connection()
-    total = conn.execute('SELECT COUNT(*) FROM products').fetchone()[0]
-    products = conn.execute('SELECT id, title, price, available, vendor, alcohol_type, original_json, url, input_url, published_at, created_at, updated_at, last_seen, became_available_at, became_unavailable_at, date_added, ignore_notifications FROM products ORDER BY last_seen DESC LIMIT ? OFFSET ?', (per_page, offset)).fetchall()
+    total = cached_query(('count', tuple(clauses), tuple(params)),
+                         lambda: conn.execute(f'SELECT COUNT(*) FROM products{where_sql(clauses)}', params).fetchone()[0])
+    sort_expr = SORT_KEYS[sort]
+    direction = 'DESC' if order == 'desc' else 'ASC'
+    offset = 0
+    if cursor:
+        # The leading single-column bound lets SQLite seek the expression index; the row value breaks ties
+        op = '<' if order == 'desc' else '>'
+        values = decode_cursor(cursor)
+        clauses.append(f'{sort_expr} {op}= ? AND ({sort_expr}, id, input_url) {op} (?, ?, ?)')
+        params += [values[0]] + values
+    else:
+        offset = (page - 1) * limit
+    products = conn.execute(f'''SELECT {PRODUCT_COLUMNS}, {sort_expr} AS sort_value FROM products{where_sql(clauses)}
+                                ORDER BY {sort_expr} {direction}, id {direction}, input_url {direction} LIMIT ? OFFSET ?''',
+                            params + [limit + 1, offset]).fetchall()
+    next_cursor = encode_cursor(products[limit - 1], products[limit - 1]['sort_value']) if len(products) > limit else None
     product_list = []
-    for p in products:
-        img_url = None
-        try:
-            data = json.loads(p['original_json']) if p['original_json'] else {}
-            if data.get('images') and len(data['images']) > 0:
-                img_url = data['images'][0].get('src')
-        except Exception:
-            img_url = None
+    for p in products[:limit]:
         d = dict(p)
-        d['image_url'] = img_url
+        del d['sort_value']
         product_list.append(d)
-    conn.close()
-    return jsonify({
+    return {
         'products': product_list,
         'total': total,
         'page': page,
-        'per_page': per_page
-    })
+        'per_page': limit,
+        'next_cursor': next_cursor,
+        'sort': sort,
+        'order': order,
+        'change_seq': current_change_seq()  # Start /api/products/changes here to follow this listing
+    }
+
+CHANGES_STREAM_POLL = float(os.getenv('CHANGES_STREAM_POLL', '2'))  # Seconds between change counter checks in /api/products/changes/stream
+STREAM_HEARTBEAT = 15  # Seconds between SSE keep-alive comments on an idle stream
+
+def product_changes(conn, since, current, limit):
+    """
+    The change feed after sequence number since: products rows inserted or updated (oldest change first, at most
+    limit) and keys deleted, up to the returned cursor. reset means since is unusable (older than the pruned
+    tombstones, or ahead of the database) and the client should reload and continue from cursor.
+    """
+    floor = conn.execute("SELECT value FROM db_meta WHERE key = 'tombstone_floor'").fetchone()
+    if since is None or since > current or since < (floor[0] if floor else 0):
+        return {'changes': [], 'deleted': [], 'cursor': current, 'more': False, 'reset': True}
+    rows = conn.execute(f'SELECT {PRODUCT_COLUMNS}, change_seq FROM products WHERE change_seq > ? ORDER BY change_seq LIMIT ?',
+                        (since, limit + 1)).fetchall()
+    more = len(rows) > limit
+    rows = rows[:limit]
+    # Rows written after current was read may already be included; deletes are bounded by the same cursor
+    cursor = rows[-1]['change_seq'] if more else max([current] + [r['change_seq'] for r in rows[-1:]])
+    deleted = conn.execute('SELECT id, input_url, change_seq FROM product_tombstones WHERE change_seq > ? AND change_seq <= ? ORDER BY change_seq',
+                           (since, cursor)).fetchall()
+    return {'changes': [dict(r) for r in rows], 'deleted': [dict(r) for r in deleted], 'cursor': cursor, 'more': more, 'reset': False}
+
+def changes_since(value):
+    if value in (None, ''):
+        return None
+    try:
+        return int(value)
+    except ValueError:
+        abort(400, 'since must be a change sequence number')
+
+@app.route('/api/products/changes', methods=['GET'])
+def api_product_changes():
+    """
+    Products inserted, updated or deleted since the since cursor (a change_seq from /api/products or a previous
+    call). Apply deleted before changes; pass cursor back as since, immediately while more is true.
+    """
+    since = changes_since(request.args.get('since'))
+    try:
+        limit = max(1, min(int(request.args.get('limit', 1000)), MAX_PAGE_SIZE))
+    except ValueError:
+        abort(400, 'limit must be an integer')
+    current = current_change_seq()
+    if current is None:
+        abort(503, 'The database has no change counter yet')
+    return jsonify(product_changes(get_db_connection(), since, current, limit))
+
+@app.route('/api/products/changes/stream', methods=['GET'])
+def stream_product_changes():
+    """
+    Server-Sent Events form of /api/products/changes: a 'changes' event with the same payload whenever products
+    change, its cursor as the event id so a reconnecting EventSource resumes from Last-Event-ID.
+    """
+    since = changes_since(request.headers.get('Last-Event-ID') or request.args.get('since'))
+    get_db_connection()
+    pool = g.db_pool
+    if since is None:
+        since = current_change_seq()
+
+    def events(since):
+        last_sent = time.monotonic()
+        yield 'retry: 3000\n\n'
+        while True:
+            conn = pool.acquire()
+            try:
+                current = change_seq(conn)
+                batch = product_changes(conn, since, current, MAX_PAGE_SIZE) if current is not None and current != since else None
+            finally:
+                pool.release(conn)
+            if batch is not None:
+                since = batch['cursor']
+                yield f"id: {since}\nevent: changes\ndata: {json.dumps(batch)}\n\n"
+                last_sent = time.monotonic()
+                if batch['more']:
+                    continue
+            elif time.monotonic() - last_sent >= STREAM_HEARTBEAT:
+                yield ': keep-alive\n\n'
+                last_sent = time.monotonic()
+            time.sleep(CHANGES_STREAM_POLL)
+
+    return Response(events(since), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/products/facets', methods=['GET'])
+@cached_json
+def product_facets():
+    """Distinct vendors, alcohol types and input URLs for the filter dropdowns."""
+    conn = get_db_connection()
+    def distinct(column):
+        expr = SORT_KEYS.get(column, column)
+        return cached_query(('facet', column), lambda: [r[0] for r in conn.execute(
+            f"SELECT DISTINCT {expr} FROM products WHERE {expr} != '' ORDER BY {expr}").fetchall()])
+    return {
+        'vendors': distinct('vendor'),
+        'alcohol_types': distinct('alcohol_type'),
+        'input_urls': distinct('input_url')
+    }
+
+@app.route('/api/stats', methods=['GET'])
+@cached_json
+def product_stats():
+    """
+    Summary figures for the stats panel over the products matching the list filters: totals, availability,
+    vendors, per-type counts, price range and the most recent update. Cached until the data changes.
+    """
+    clauses, params = product_filters(request.args)
+    try:
+        top = max(0, min(int(request.args.get('top', 3)), 100))
+    except ValueError:
+        abort(400, 'top must be an integer')
+    where = where_sql(clauses)
+    price = "CAST(NULLIF(TRIM(price), '') AS REAL)"
+    conn = get_db_connection()
+
+    def compute():
+        row = conn.execute(f'''SELECT COUNT(*) AS total, COALESCE(SUM(available), 0) AS available, COUNT(DISTINCT vendor) AS vendors,
+                                         MIN({price}) AS min_price, MAX({price}) AS max_price, AVG({price}) AS avg_price,
+                                         datetime(MAX(julianday(COALESCE(NULLIF(updated_at, ''), last_seen)))) AS last_updated
+                                  FROM products{where}''', params).fetchone()
+        # Grouped by the sort key expressions, which idx_products_alcohol_type and idx_products_vendor index
+        types = conn.execute(f'''SELECT COALESCE(alcohol_type, '') AS t, COUNT(*) FROM products{where_sql(clauses + ["COALESCE(alcohol_type, '') != ''"])}
+                                   GROUP BY t ORDER BY COUNT(*) DESC''', params).fetchall()
+        vendors = conn.execute(f'''SELECT COALESCE(vendor, '') AS v, COUNT(*) FROM products{where_sql(clauses + ["COALESCE(vendor, '') != ''"])}
+                                     GROUP BY v ORDER BY COUNT(*) DESC, v LIMIT ?''', params + [top]).fetchall()
+        stats = dict(row)
+        stats['avg_price'] = round(stats['avg_price'], 2) if stats['avg_price'] is not None else None
+        stats['alcohol_types'] = {t: n for t, n in types}
+        stats['top_vendors'] = [[v, n] for v, n in vendors]
+        return stats
+    key = ('stats', top) + tuple(sorted((k, v) for k, v in request.args.items() if k not in ('sort', 'order', 'cursor', 'limit', 'page', 'per_page')))
+    stats = dict(cached_query(key, compute))
+    stats['change_seq'] = current_change_seq()
+    return stats
 
 @app.route('/api/products/<int:product_id>', methods=['GET'])
 def get_product(product_id):
@@ -68,35 +499,115 @@ def get_product(product_id):
         abort(400, 'Missing input_url')
     conn = get_db_connection()
     p = conn.execute('SELECT * FROM products WHERE id = ? AND input_url = ?', (product_id, input_url)).fetchone()
-    conn.close()
     if p is None:
         abort(404)
     d = dict(p)
-    try:
-        data = json.loads(p['original_json']) if p['original_json'] else {}
-        if data.get('images') and len(data['images']) > 0:
-            d['image_url'] = data['images'][0].get('src')
-        else:
-            d['image_url'] = None
-    except Exception:
-        d['image_url'] = None
+    # The compressed raw JSON is only decoded when asked for
+    if request.args.get('include_raw') in ('1', 'true'):
+        raw = conn.execute('SELECT json_z FROM product_raw WHERE id = ? AND input_url = ?', (product_id, input_url)).fetchone()
+        d['original_json'] = unpack_json(raw['json_z']) if raw else d.get('original_json')
     return jsonify(d)
 
+@app.route('/api/products/<int:product_id>/stores', methods=['GET'])
+def product_stores(product_id):
+    """Every store listing the same bottle as this product (same canonical_key), the product itself included."""
+    input_url = request.args.get('input_url')
+    if not input_url:
+        abort(400, 'Missing input_url')
+    conn = get_db_connection()
+    p = conn.execute('SELECT canonical_key FROM products WHERE id = ? AND input_url = ?', (product_id, input_url)).fetchone()
+    if p is None:
+        abort(404)
+    if p['canonical_key'] is None:
+        return jsonify({'canonical_key': None, 'products': []})
+    rows = conn.execute(f'SELECT {PRODUCT_COLUMNS} FROM products WHERE canonical_key = ? ORDER BY available DESC, CAST(price AS REAL)', (p['canonical_key'],)).fetchall()
+    return jsonify({'canonical_key': p['canonical_key'], 'products': [dict(r) for r in rows]})
+
+@app.route('/api/canonical', methods=['GET'])
+def canonical_products():
+    """Bottles carried by at least min_stores stores, the most widely stocked first."""
+    try:
+        min_stores = max(int(request.args.get('min_stores', 2)), 1)
+        limit = max(1, min(int(request.args.get('limit', 100)), MAX_PAGE_SIZE))
+    except ValueError:
+        abort(400, 'min_stores and limit must be integers')
+    conn = get_db_connection()
+    rows = cached_query(('canonical', min_stores, limit), lambda: [dict(r) for r in conn.execute('''
+        SELECT canonical_key, MIN(title) AS title, MIN(vendor) AS vendor, COUNT(DISTINCT input_url) AS store_count,
+               SUM(available) AS available_count, MIN(CAST(price AS REAL)) AS min_price, MAX(CAST(price AS REAL)) AS max_price
+        FROM products WHERE canonical_key IS NOT NULL
+        GROUP BY canonical_key HAVING COUNT(DISTINCT input_url) >= ?
+        ORDER BY store_count DESC, available_count DESC LIMIT ?''', (min_stores, limit)).fetchall()])
+    return jsonify({'products': rows})
+
+def history_range(args):
+    """(since, until, limit) from the history endpoints' query string; bad values abort with 400."""
+    try:
+        since = parse_time(args.get('since'))
+        until = parse_time(args.get('until'))
+        limit = max(1, min(int(args.get('limit', 1000)), MAX_PAGE_SIZE))
+    except ValueError:
+        abort(400, 'since/until must be epoch seconds or ISO 8601, limit an integer')
+    return since, until, limit
+
+def event_dict(row):
+    d = dict(row)
+    d['at'] = utc_iso(d['ts'])
+    return d
+
+@app.route('/api/products/<int:product_id>/history', methods=['GET'])
+def product_history(product_id):
+    """One product's price and availability changes at one store, oldest first, plus its in-stock periods."""
+    input_url = request.args.get('input_url')
+    if not input_url:
+        abort(400, 'Missing input_url')
+    since, until, limit = history_range(request.args)
+    conn = get_db_connection()
+    store = conn.execute('SELECT store_id FROM stores WHERE input_url = ?', (input_url,)).fetchone()
+    if store is None:
+        return jsonify({'events': [], 'periods': []})
+    rows = conn.execute('''SELECT ts, old_price, new_price, old_available, new_available FROM product_events
+                           WHERE product_id = ? AND store_id = ? AND ts >= ? AND ts <= ? ORDER BY ts LIMIT ?''',
+                        (product_id, store['store_id'], since or 0, until or 2 ** 62, limit)).fetchall()
+    events = [event_dict(r) for r in rows]
+    periods = availability_periods(events)
+    for period in periods:
+        period['start_at'], period['end_at'] = utc_iso(period['start']), utc_iso(period['end'])
+    return jsonify({'events': events, 'periods': periods})
+
+@app.route('/api/history', methods=['GET'])
+def recent_history():
+    """Changes across all products (or one store) in a time range, newest first."""
+    since, until, limit = history_range(request.args)
+    params = [since or 0, until or 2 ** 62]
+    store_clause = ''
+    if request.args.get('input_url'):
+        store_clause = 'AND s.input_url = ?'
+        params.append(request.args['input_url'])
+    params.append(limit)
+    conn = get_db_connection()
+    rows = conn.execute(f'''SELECT e.product_id AS id, s.input_url, p.title, e.ts, e.old_price, e.new_price, e.old_available, e.new_available
+                            FROM product_events e JOIN stores s ON s.store_id = e.store_id
+                            LEFT JOIN products p ON p.id = e.product_id AND p.input_url = s.input_url
+                            WHERE e.ts >= ? AND e.ts <= ? {store_clause} ORDER BY e.ts DESC LIMIT ?''', params).fetchall()
+    return jsonify({'events': [event_dict(r) for r in rows]})
+
 @app.route('/api/products', methods=['POST'])
 def create_product():
     data = request.get_json()
     if not data:
         abort(400, 'Missing JSON body')
-    fields = ['id', 'handle', 'title', 'available', 'published_at', 'created_at', 'updated_at', 'vendor', 'url', 'price', 'original_json', 'input_url', 'alcohol_type', 'became_available_at', 'became_unavailable_at']
+    data = with_projection(data)
+    fields = ['id', 'handle', 'title', 'available', 'published_at', 'created_at', 'updated_at', 'vendor', 'url', 'price', 'image_url', 'variant_count', 'tags', 'product_type', 'body_text', 'input_url', 'alcohol_type', 'became_available_at', 'became_unavailable_at']
     values = [data.get(f) for f in fields]
     conn = get_db_connection()
     try:
         conn.execute(f"INSERT INTO products ({', '.join(fields)}) VALUES ({', '.join(['?']*len(fields))})", values)
+        store_raw_json(conn, data.get('id'), data.get('input_url'), data.get('original_json'))
         conn.commit()
+        invalidate_cached_queries()
     except sqlite3.IntegrityError:
-        conn.close()
         abort(409, 'Product already exists')
-    conn.close()
     return jsonify({'message': 'Product created'}), 201
 
 @app.route('/api/products/<int:product_id>', methods=['PUT'])
@@ -104,14 +615,17 @@ def update_product(product_id):
     data = request.get_json()
     if not data:
         abort(400, 'Missing JSON body')
-    fields = ['handle', 'title', 'available', 'published_at', 'created_at', 'updated_at', 'vendor', 'url', 'price', 'original_json', 'input_url', 'alcohol_type', 'became_available_at', 'became_unavailable_at']
+    data = with_projection(data)
+    fields = ['handle', 'title', 'available', 'published_at', 'created_at', 'updated_at', 'vendor', 'url', 'price', 'image_url', 'variant_count', 'tags', 'product_type', 'body_text', 'input_url', 'alcohol_type', 'became_available_at', 'became_unavailable_at']
     set_clause = ', '.join([f"{f} = ?" for f in fields])
     values = [data.get(f) for f in fields]
     values.append(product_id)
     conn = get_db_connection()
     cur = conn.execute(f"UPDATE products SET {set_clause} WHERE id = ?", values)
+    if cur.rowcount:
+        store_raw_json(conn, product_id, data.get('input_url'), data.get('original_json'))
     conn.commit()
-    conn.close()
+    invalidate_cached_queries()
     if cur.rowcount == 0:
         abort(404, 'Product not found')
     return jsonify({'message': 'Product updated'})
@@ -121,53 +635,255 @@ def delete_product(product_id):
     conn = get_db_connection()
     cur = conn.execute('DELETE FROM products WHERE id = ?', (product_id,))
     conn.commit()
-    conn.close()
+    invalidate_cached_queries()
     if cur.rowcount == 0:
         abort(404, 'Product not found')
     return jsonify({'message': 'Product deleted'})
 
 @app.route('/api/products/search', methods=['GET'])
+@cached_json
 def search_products():
+    """
+    Ranked full-text search over title, vendor, alcohol type, tags, product type and description.
+    Every word matches as a prefix; each result carries a highlighted snippet of the best matching column.
+    """
     q = request.args.get('q', '').strip()
-    if not q:
-        return jsonify({'products': [], 'total': 0, 'page': 1, 'per_page': 0})
-    page = int(request.args.get('page', 1))
-    per_page = int(request.args.get('per_page', 500))
+    try:
+        page = max(1, int(request.args.get('page', 1)))
+        per_page = max(1, min(int(request.args.get('per_page', 500)), MAX_PAGE_SIZE))
+    except ValueError:
+        abort(400, 'per_page and page must be integers')
+    match = fts_query(q)
+    if not match:
+        return {'products': [], 'total': 0, 'page': 1, 'per_page': 0}
     offset = (page - 1) * per_page
     conn = get_db_connection()
-    like = f'%{q}%'
-    products = conn.execute('''SELECT id, title, price, available, vendor, alcohol_type, original_json, url, input_url, published_at, created_at, updated_at, last_seen, became_available_at, became_unavailable_at, date_added, ignore_notifications FROM products WHERE title LIKE ? OR vendor LIKE ? OR alcohol_type LIKE ? OR original_json LIKE ? ORDER BY last_seen DESC LIMIT ? OFFSET ?''', (like, like, like, like, per_page, offset)).fetchall()
-    total = conn.execute('''SELECT COUNT(*) FROM products WHERE title LIKE ? OR vendor LIKE ? OR alcohol_type LIKE ? OR original_json LIKE ?''', (like, like, like, like)).fetchone()[0]
-    product_list = []
-    for p in products:
-        img_url = None
-        try:
-            data = json.loads(p['original_json']) if p['original_json'] else {}
-            if data.get('images') and len(data['images']) > 0:
-                img_url = data['images'][0].get('src')
-        except Exception:
-            img_url = None
-        d = dict(p)
-        d['image_url'] = img_url
-        product_list.append(d)
-    conn.close()
-    return jsonify({
+    if has_search_index():
+        columns = ', '.join(f'p.{c.strip()}' for c in PRODUCT_COLUMNS.split(','))
+        weights = ', '.join(str(w) for w in SEARCH_WEIGHTS)
+        products = conn.execute(f'''SELECT {columns}, snippet(products_fts, -1, '<b>', '</b>', '…', 12) AS snippet
+                                    FROM products_fts JOIN products p ON p.rowid = products_fts.rowid
+                                    WHERE products_fts MATCH ? ORDER BY bm25(products_fts, {weights}) LIMIT ? OFFSET ?''',
+                                (match, per_page, offset)).fetchall()
+        total = cached_query(('search', match), lambda: conn.execute(
+            'SELECT COUNT(*) FROM products_fts WHERE products_fts MATCH ?', (match,)).fetchone()[0])
+    else:
+        like = f'%{q}%'
+        products = conn.execute(f'''SELECT {PRODUCT_COLUMNS} FROM products WHERE title LIKE ? OR vendor LIKE ? OR alcohol_type LIKE ? OR tags LIKE ? OR product_type LIKE ? ORDER BY COALESCE(last_seen, '') DESC LIMIT ? OFFSET ?''', (like, like, like, like, like, per_page, offset)).fetchall()
+        total = conn.execute('''SELECT COUNT(*) FROM products WHERE title LIKE ? OR vendor LIKE ? OR alcohol_type LIKE ? OR tags LIKE ? OR product_type LIKE ?''', (like, like, like, like, like)).fetchone()[0]
+    product_list = [dict(p) for p in products]
+    return {
         'products': product_list,
         'total': total,
         'page': page,
         'per_page': per_page
-    })
+    }
+
+# --- Scraper log API: tail from the end, follow with a byte-offset cursor, filter server-side ---
+LOG_READ_MAX_BYTES = int(os.getenv('LOG_READ_MAX_BYTES', str(1024 * 1024)))  # Max bytes one /api/logs page reads after a cursor
+LOG_TAIL_MAX_BYTES = int(os.getenv('LOG_TAIL_MAX_BYTES', str(16 * 1024 * 1024)))  # Max bytes scanned back from the end for a filtered tail
+LOG_STREAM_POLL = float(os.getenv('LOG_STREAM_POLL', '1'))  # Seconds between checks for new lines in /api/logs/stream
+# Matches SScraper's log_formatter: time [threadName][Thread-id][LEVEL] message
+LOG_LINE_RE = re.compile(r'^(\d{4}-\d\d-\d\d \d\d:\d\d:\d\d) \[([^\]]*)\]\[Thread-\d+\]\[(\w+)\] ')
+LOG_LEVELS = {'DEBUG': 10, 'INFO': 20, 'WARNING': 30, 'ERROR': 40, 'CRITICAL': 50}
+
+def parse_log_records(data):
+    """Split complete log lines into records; lines that don't start a record (tracebacks) join the one before."""
+    records = []
+    for line in data.decode('utf-8', errors='replace').splitlines():
+        m = LOG_LINE_RE.match(line)
+        if m:
+            records.append({'time': m.group(1), 'thread': m.group(2), 'level': m.group(3), 'text': line})
+        elif records:
+            records[-1]['text'] += '\n' + line
+        else:
+            records.append({'time': None, 'thread': None, 'level': None, 'text': line})
+    return records
+
+def log_filter(args):
+    """Record predicate for the level (minimum), thread (substring) and q (case-insensitive substring) parameters."""
+    level = (args.get('level') or '').upper()
+    if level and level not in LOG_LEVELS:
+        abort(400, f"level must be one of {', '.join(LOG_LEVELS)}")
+    min_level = LOG_LEVELS.get(level, 0)
+    thread = args.get('thread') or ''
+    q = (args.get('q') or '').lower()
+
+    def match(record):
+        if min_level and LOG_LEVELS.get(record['level'], 0) < min_level:
+            return False
+        if thread and thread not in (record['thread'] or ''):
+            return False
+        return not q or q in record['text'].lower()
+    return match
+
+def encode_log_cursor(inode, offset):
+    return f'{inode}:{offset}'
+
+def decode_log_cursor(cursor):
+    try:
+        inode, offset = cursor.split(':')
+        return int(inode), int(offset)
+    except (AttributeError, ValueError):
+        abort(400, 'Invalid cursor')
+
+def open_log_at(inode, offset):
+    """
+    (path, inode, offset) to continue reading from a cursor. After TimedRotatingFileHandler renames scraper.log,
+    the rest of the old file is read from its rotated name first; a truncated or unknown file restarts at 0.
+    """
+    st = os.stat(LOG_PATH)
+    if inode == st.st_ino:
+        return LOG_PATH, inode, offset if offset <= st.st_size else 0
+    for path in glob.glob(LOG_PATH + '.*'):
+        try:
+            rotated = os.stat(path)
+        except OSError:
+            continue
+        if rotated.st_ino == inode and offset < rotated.st_size:
+            return path, inode, offset
+    return LOG_PATH, st.st_ino, 0
+
+def read_log_after(cursor, match, max_bytes=LOG_READ_MAX_BYTES):
+    """Matching records written after cursor, up to max_bytes of log. Returns (records, next cursor, more)."""
+    path, inode, offset = open_log_at(*cursor)
+    with open(path, 'rb') as f:
+        f.seek(offset)
+        data = f.read(max_bytes)
+    # Only complete lines; a partial last line is picked up by the next read
+    end = data.rfind(b'\n') + 1
+    if end == 0 and len(data) >= max_bytes:
+        end = len(data)  # a single line longer than max_bytes
+    more = len(data) >= max_bytes or (path != LOG_PATH)
+    records = [r for r in parse_log_records(data[:end]) if match(r)]
+    return records, (inode, offset + end), more
+
+def tail_log(match, limit):
+    """The last limit matching records, reading back from the end in growing windows. Returns (records, cursor)."""
+    st = os.stat(LOG_PATH)
+    size = st.st_size
+    window = 256 * 1024
+    with open(LOG_PATH, 'rb') as f:
+        while True:
+            start = max(size - window, 0)
+            f.seek(start)
+            data = f.read(size - start)
+            end = data.rfind(b'\n') + 1
+            body = data[:end]
+            if start > 0:
+                # Drop the partial first line and any continuation lines of a record that began before the window
+                body = body[body.find(b'\n') + 1:]
+                records = parse_log_records(body)
+                if records and records[0]['level'] is None:
+                    records = records[1:]
+            else:
+                records = parse_log_records(body)
+            matched = [r for r in records if match(r)]
+            if len(matched) >= limit or start == 0 or window >= LOG_TAIL_MAX_BYTES:
+                return matched[-limit:], (st.st_ino, start + end)
+            window *= 4
 
 @app.route('/logs')
 def view_logs():
+    # logs.js loads the tail from /api/logs and follows /api/logs/stream
+    return render_template('logs.html')
+
+@app.route('/api/logs', methods=['GET'])
+def api_logs():
+    """
+    Scraper log records. Without a cursor, the last limit records matching the filters; with one, the records
+    written after it (at most LOG_READ_MAX_BYTES of log per call). Pass the returned cursor back to continue.
+    """
+    match = log_filter(request.args)
     try:
-        with open(LOG_PATH, 'r', encoding='utf-8', errors='replace') as f:
-            log_content = f.read()[-100_000:]  # Show last 100k chars for performance
-    except FileNotFoundError:
-        log_content = 'Log file not found.'
-    except Exception as e:
-        log_content = f'Error reading log file: {e}'
-    return render_template('logs.html', log_content=log_content)
+        limit = max(1, min(int(request.args.get('limit', 500)), MAX_PAGE_SIZE))
+    except ValueError:
+        abort(400, 'limit must be an integer')
+    if not os.path.exists(LOG_PATH):
+        return jsonify({'records': [], 'cursor': None, 'more': False})
+    cursor = request.args.get('cursor')
+    if cursor:
+        records, next_cursor, more = read_log_after(decode_log_cursor(cursor), match)
+    else:
+        (records, next_cursor), more = tail_log(match, limit), False
+    return jsonify({'records': records, 'cursor': encode_log_cursor(*next_cursor), 'more': more})
+
+@app.route('/api/logs/stream', methods=['GET'])
+def stream_logs():
+    """
+    Server-Sent Events tail of the scraper log: one 'logs' event per batch of new matching records, with the
+    cursor as the event id so a reconnecting EventSource resumes where it stopped (Last-Event-ID). Follows rotation.
+    """
+    match = log_filter(request.args)
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('cursor')
+    if cursor:
+        cursor = decode_log_cursor(cursor)
+    elif os.path.exists(LOG_PATH):
+        st = os.stat(LOG_PATH)
+        cursor = (st.st_ino, st.st_size)
+
+    def events(cursor):
+        last_sent = time.monotonic()
+        yield 'retry: 3000\n\n'
+        while True:
+            if cursor is None:
+                if os.path.exists(LOG_PATH):
+                    cursor = (os.stat(LOG_PATH).st_ino, 0)
+                else:
+                    time.sleep(LOG_STREAM_POLL)
+                    continue
+            records, cursor, more = read_log_after(cursor, match)
+            if records:
+                yield f"id: {encode_log_cursor(*cursor)}\nevent: logs\ndata: {json.dumps(records)}\n\n"
+                last_sent = time.monotonic()
+            elif time.monotonic() - last_sent >= STREAM_HEARTBEAT:
+                yield ': keep-alive\n\n'
+                last_sent = time.monotonic()
+            if not more:
+                time.sleep(LOG_STREAM_POLL)
+
+    return Response(events(cursor), mimetype='text/event-stream', headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+@app.route('/api/schedule', methods=['GET'])
+def store_schedule():
+    """The scraper's polling schedule: every store with its learned change rate and interval, next due first."""
+    conn = get_db_connection()
+    rows = conn.execute('SELECT * FROM store_schedule ORDER BY next_due_at').fetchall()
+    return jsonify({'stores': [dict(r) for r in rows]})
+
+@app.route('/api/backoff', methods=['GET'])
+def host_backoff():
+    """Hosts the scraper has backed off from after 429s or errors, the longest-waiting first."""
+    conn = get_db_connection()
+    rows = conn.execute('SELECT * FROM host_backoff ORDER BY ready_at DESC').fetchall()
+    return jsonify({'hosts': [dict(r) for r in rows]})
+
+@app.route('/api/metrics', methods=['GET'])
+def scraper_metrics():
+    """
+    The scraper's metrics summary, fetched from its metrics endpoints (METRICS_URL) since it runs in other processes;
+    the shard workers' are added up. Endpoints that do not answer are listed under unreachable, and when none does
+    the response is a 503. ?prefix= keeps only metrics whose name starts with it (e.g. scraper_fetch).
+    """
+    urls = [u.strip() for u in METRICS_URL.split(',') if u.strip()]
+    summaries = []
+    unreachable = []
+    for url in urls:
+        try:
+            resp = requests.get(url, timeout=2)
+            resp.raise_for_status()
+            summaries.append(resp.json())
+        except (requests.RequestException, ValueError) as e:
+            unreachable.append({'url': url, 'error': str(e)})
+    if not summaries:
+        errors = '; '.join(f"{u['url']}: {u['error']}" for u in unreachable)
+        abort(503, f'Scraper metrics unreachable ({errors}). Set METRICS_URL to the scraper\'s metrics address (see exampleenv.txt)')
+    summary = merge_summaries(summaries) if len(summaries) > 1 else summaries[0]
+    summary['unreachable'] = unreachable
+    prefix = request.args.get('prefix')
+    if prefix:
+        summary['metrics'] = {name: m for name, m in summary.get('metrics', {}).items() if name.startswith(prefix)}
+    return jsonify(summary)
 
 @app.route('/api/products/<int:product_id>/ignore', methods=['POST'])
 def set_ignore_notifications(product_id):
@@ -179,11 +895,47 @@ def set_ignore_notifications(product_id):
     conn = get_db_connection()
     cur = conn.execute('UPDATE products SET ignore_notifications = ? WHERE id = ? AND input_url = ?', (value, product_id, input_url))
     conn.commit()
-    conn.close()
+    invalidate_cached_queries()
     if cur.rowcount == 0:
         abort(404, 'Product not found')
     return jsonify({'message': 'ignore_notifications updated', 'id': product_id, 'input_url': input_url, 'ignore_notifications': value})
 
+@app.route('/api/products/bulk', methods=['POST'])
+def bulk_update_products():
+    """
+    Apply one patch to many products in a single transaction.
+    Body: {"keys": [{"id": 1, "input_url": "..."}, ...], "patch": {"alcohol_type": "unwanted", "ignore_notifications": 1}}.
+    Returns per-key results with status 'updated' or 'not_found', plus the counts of each.
+    """
+    data = request.get_json(silent=True) or {}
+    keys = data.get('keys')
+    patch = data.get('patch')
+    if not isinstance(keys, list) or not keys:
+        abort(400, 'keys must be a non-empty list of {id, input_url}')
+    if len(keys) > BULK_MAX_KEYS:
+        abort(400, f'At most {BULK_MAX_KEYS} keys per request')
+    if not isinstance(patch, dict) or not patch:
+        abort(400, 'patch must be a non-empty object')
+    unknown = set(patch) - set(BULK_FIELDS)
+    if unknown:
+        abort(400, f"Fields that can't be patched: {', '.join(sorted(unknown))}")
+    try:
+        columns = sorted(patch)
+        values = [BULK_FIELDS[c](patch[c]) if patch[c] is not None else None for c in columns]
+        keys = [(int(k['id']), str(k['input_url'])) for k in keys]
+    except (KeyError, TypeError, ValueError):
+        abort(400, 'Invalid key or patch value')
+    sql = f"UPDATE products SET {', '.join(f'{c} = ?' for c in columns)} WHERE id = ? AND input_url = ?"
+    conn = get_db_connection()
+    results = []
+    with conn:
+        for product_id, input_url in keys:
+            cur = conn.execute(sql, values + [product_id, input_url])
+            results.append({'id': product_id, 'input_url': input_url, 'status': 'updated' if cur.rowcount else 'not_found'})
+    invalidate_cached_queries()
+    updated = sum(r['status'] == 'updated' for r in results)
+    return jsonify({'updated': updated, 'not_found': len(results) - updated, 'results': results})
+
 @app.route('/products/<int:product_id>/edit', methods=['POST', 'PUT'])
 def edit_product(product_id):
     input_url = request.form.get('input_url') or request.args.get('input_url')
@@ -192,7 +944,6 @@ def edit_product(product_id):
     conn = get_db_connection()
     p = conn.execute('SELECT * FROM products WHERE id = ? AND input_url = ?', (product_id, input_url)).fetchone()
     if not p:
-        conn.close()
         abort(404)
     # Only allow editing a subset of fields for safety
     if request.method in ['POST', 'PUT']:
@@ -214,9 +965,8 @@ def edit_product(product_id):
         conn.execute('UPDATE products SET title = ?, price = ?, available = ?, vendor = ?, alcohol_type = ?, ignore_notifications = ? WHERE id = ? AND input_url = ?',
             (title, price, available, vendor, alcohol_type, ignore_notifications, product_id, input_url))
         conn.commit()
-        conn.close()
+        invalidate_cached_queries()
         return jsonify({'message': 'Product updated', 'id': product_id, 'input_url': input_url})
-    conn.close()
     abort(405)
 
 @app.route('/products/<int:product_id>/ignore', methods=['GET'])
@@ -227,7 +977,7 @@ def ignore_product(product_id):
     conn = get_db_connection()
     cur = conn.execute('UPDATE products SET ignore_notifications = 1 WHERE id = ? AND input_url = ?', (product_id, input_url))
     conn.commit()
-    conn.close()
+    invalidate_cached_queries()
     flash('Product ignored (notifications suppressed).', 'success')
     return redirect(url_for('all_products'))
 